@@ -169,7 +169,7 @@ class CommandTaxAssign(object):
         if len(variant_not_tax_assigned) > 0:  # Run blast for variants that need tax assignation
 
             blast_variant_df = pandas.DataFrame.from_records(variant_not_tax_assigned, index='id')
-            taxonomy = Taxonomy(tsv=taxonomy_tsv)
+            taxonomy = Taxonomy(tsv=taxonomy_tsv, lineage_cache=True)
             sequence_list = blast_variant_df.sequence.tolist()
             tax_assign_runner = RunnerTaxAssign(
                 sequence_list=sequence_list,
@@ -307,7 +307,7 @@ class CommandTaxAssign(object):
                 __file__, inspect.currentframe().f_lineno))
 
         tax_id_list = variant_output_df.ltg_tax_id.unique().tolist()  # unique list of tax ids
-        tax_lineage = TaxLineage(taxonomic_tsv_path=taxonomy_tsv)
+        tax_lineage = TaxLineage(taxonomic_tsv_path=taxonomy_tsv, lineage_cache=True)
         tax_lineage_df = tax_lineage.create_lineage_from_tax_id_list(
             tax_id_list=tax_id_list, tax_name=True)
 
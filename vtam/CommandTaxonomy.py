@@ -1,3 +1,4 @@
+import csv
 import gzip
 import inspect
 import os
@@ -14,6 +15,7 @@ from sqlalchemy.exc import OperationalError
 from vtam.utils import tqdm_hook
 from vtam.utils.Logger import Logger
 from vtam.utils.PathManager import PathManager
+from vtam.utils.Taxonomy import Taxonomy
 from vtam.utils.VTAMexception import VTAMexception
 from vtam.utils.constants import taxonomy_tsv_gz_url1, taxonomy_tsv_gz_url2, taxonomy_tsv_gz_url3
 from tqdm import tqdm
@@ -86,13 +88,13 @@ class CommandTaxonomy(object):
         #
         nodes_dmp = os.path.join(self.tempdir, "nodes.dmp")
         nodes_dmp_df = pandas.read_table(
-            nodes_dmp, header=None, sep='\t', engine='python', usecols=[
+            nodes_dmp, header=None, sep='\t', quoting=csv.QUOTE_NONE, usecols=[
                 0, 2, 4], names=[
                 'tax_id', 'parent_tax_id', 'rank'])
         #
         names_dmp = os.path.join(self.tempdir, "names.dmp")
         names_dmp_df = pandas.read_table(
-            names_dmp, header=None, sep=r'\t', engine='python', usecols=[
+            names_dmp, header=None, sep='\t', quoting=csv.QUOTE_NONE, usecols=[
                 0, 2, 6], names=[
                 'tax_id', 'name_txt', 'name_class'])
         names_dmp_df = names_dmp_df.loc[names_dmp_df.name_class ==
@@ -103,7 +105,7 @@ class CommandTaxonomy(object):
         #
         merged_dmp = os.path.join(self.tempdir, "merged.dmp")
         merged_dmp_df = pandas.read_table(
-            merged_dmp, header=None, sep='\t', engine='python', usecols=[
+            merged_dmp, header=None, sep='\t', quoting=csv.QUOTE_NONE, usecols=[
                 0, 2], names=[
                 'old_tax_id', 'tax_id'])
         #
@@ -186,3 +188,20 @@ class CommandTaxonomy(object):
             self.download_precomputed_taxonomy()
         else:
             self.create_denovo_from_ncbi()
+        self.write_binary_taxonomy()
+
+    def write_binary_taxonomy(self):
+        """Writes the binary taxonomy and the lineage cache next to the TSV file, which are memory-mapped by the
+        Taxonomy class"""
+
+        if not os.path.isfile(self.taxonomy_tsv_path):
+            return
+        if not Taxonomy.is_binary_up_to_date(self.taxonomy_tsv_path):
+            Logger.instance().debug(
+                "file: {}; line: {}; Write binary taxonomy".format(
+                    __file__, inspect.currentframe().f_lineno))
+            Taxonomy(tsv=self.taxonomy_tsv_path).write_binary(Taxonomy.get_binary_dir(self.taxonomy_tsv_path))
+        Logger.instance().debug(
+            "file: {}; line: {}; Write lineage cache".format(
+                __file__, inspect.currentframe().f_lineno))
+        Taxonomy(tsv=self.taxonomy_tsv_path, lineage_cache=True)  # Written if not up to date
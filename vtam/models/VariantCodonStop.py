@@ -0,0 +1,21 @@
+from wopmars.Base import Base
+from sqlalchemy import Boolean, Column, Integer, ForeignKey, UniqueConstraint
+
+
+class VariantCodonStop(Base):
+    """Cache of the stop codon scans of the variants for each genetic code, filled by the FilterCodonStop step"""
+    __tablename__ = __qualname__
+    __table_args__ = (
+        UniqueConstraint('variant_id', 'genetic_code'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    variant_id = Column(
+        Integer,
+        ForeignKey(
+            "Variant.id",
+            onupdate="CASCADE",
+            ondelete="CASCADE"),
+        nullable=False)
+    genetic_code = Column(Integer, nullable=False)
+    has_stop_codon = Column(Boolean, nullable=False)
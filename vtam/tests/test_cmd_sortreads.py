@@ -3,6 +3,7 @@ from vtam import CommandSortReads
 from vtam.utils.PathManager import PathManager
 import filecmp
 import os
+import pandas
 import shutil
 
 
@@ -28,5 +29,18 @@ class TestCommandSortReads(TestCase):
             'sortedinfo.tsv', 'MFZR_14Ben01_Tpos1_1_fw_48_000.fasta', 'MFZR_14Ben01_Tpos1_1_fw_48_001.fasta',
             'MFZR_14Ben01_Tpos1_1_fw_48_002.fasta', 'MFZR_14Ben01_Tpos1_1_fw_48_003.fasta'], shallow=True))
 
+    def test_02_empty_fastainfo(self):
+
+        fastainfo = os.path.join(self.outdir_path, "mergedinfo_empty.tsv")
+        os.makedirs(self.outdir_path, exist_ok=True)
+        with open(self.fastainfo) as fin, open(fastainfo, 'w') as fout:
+            fout.write(fin.readline())
+
+        CommandSortReads.main(fastainfo=fastainfo, fastadir=self.fastadir, sorteddir=self.sorted_dir)
+
+        sorted_read_info_df = pandas.read_csv(os.path.join(self.sorted_dir, 'sortedinfo.tsv'), sep="\t")
+        self.assertEqual(sorted_read_info_df.columns.tolist(), ['run', 'marker', 'sample', 'replicate', 'sortedfasta'])
+        self.assertEqual(sorted_read_info_df.shape[0], 0)
+
     def tearDown(self):
         shutil.rmtree(self.outdir_path, ignore_errors=True)
@@ -0,0 +1,99 @@
+import os
+import pandas
+import shutil
+import sqlalchemy
+import tempfile
+import unittest
+
+from vtam.models.FilterLFN import FilterLFN
+from vtam.models.Marker import Marker
+from vtam.models.Run import Run
+from vtam.models.Sample import Sample
+from vtam.models.Variant import Variant
+from vtam.models.VariantReadCount import VariantReadCount
+from vtam.utils.FileSampleInformation import FileSampleInformation
+
+
+class TestFileSampleInformation(unittest.TestCase):
+
+    def setUp(self):
+
+        self.engine = sqlalchemy.create_engine('sqlite://')
+        for model in [Run, Marker, Sample, Variant, VariantReadCount, FilterLFN]:
+            model.__table__.create(self.engine)
+
+        # Sample IDs not in the order of the sample information file
+        with self.engine.connect() as conn:
+            conn.execute(Run.__table__.insert(), [{'id': 1, 'name': 'run1'}])
+            conn.execute(Marker.__table__.insert(), [{'id': 1, 'name': 'MFZR'}])
+            conn.execute(Sample.__table__.insert(), [
+                {'id': 1, 'name': 'sample1'}, {'id': 2, 'name': 'sample2'}, {'id': 3, 'name': 'sample3'}])
+            conn.execute(Variant.__table__.insert(), [
+                {'id': i, 'sequence': sequence} for i, sequence in enumerate(['ACGT', 'ACGA', 'ACGC'], start=1)])
+
+        self.tempdir = tempfile.mkdtemp()
+        self.sortedinfo_tsv = os.path.join(self.tempdir, 'sortedinfo.tsv')
+        pandas.DataFrame({
+            'run': ['run1'] * 3, 'marker': ['MFZR'] * 3, 'sample': ['sample2', 'sample1', 'sample2'],
+            'replicate': [2, 1, 1], 'sortedfasta': ['s2_2.fasta', 's1_1.fasta', 's2_1.fasta']}).to_csv(
+            self.sortedinfo_tsv, sep='\t', index=False)
+        # Sample keys in the order of the sample information file
+        self.sample_key_lst = [(1, 1, 2, 2), (1, 1, 1, 1), (1, 1, 2, 1)]
+
+        # The last rows belong to a replicate and a sample missing in the sample information file
+        self.variant_read_count_df = pandas.DataFrame(
+            [[1, 1, 1, 1, 1, 10], [1, 1, 1, 1, 2, 5], [1, 1, 2, 1, 3, 7], [1, 1, 2, 2, 1, 3], [1, 1, 2, 2, 2, 4],
+             [1, 1, 1, 2, 1, 8], [1, 1, 3, 1, 1, 9]],
+            columns=['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count'])
+
+    def assert_nijk_df(self, nijk_df, nijk_bak_df):
+
+        columns = ['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count']
+        self.assertEqual(nijk_df.columns.tolist(), columns)
+        sample_key_lst = [tuple(row) for row in nijk_df[columns[:4]].drop_duplicates().itertuples(index=False)]
+        self.assertEqual(sample_key_lst, [
+            sample_key for sample_key in self.sample_key_lst if sample_key in sample_key_lst])
+        pandas.testing.assert_frame_equal(
+            nijk_df.sort_values(columns).reset_index(drop=True),
+            nijk_bak_df[columns].sort_values(columns).reset_index(drop=True), check_dtype=False)
+
+    def test_get_nijk_df(self):
+
+        with self.engine.connect() as conn:
+            conn.execute(VariantReadCount.__table__.insert(), self.variant_read_count_df.to_dict('records'))
+
+        nijk_df = FileSampleInformation(self.sortedinfo_tsv).get_nijk_df(
+            variant_read_count_like_model=VariantReadCount, engine=self.engine)
+        self.assert_nijk_df(nijk_df, self.variant_read_count_df.iloc[:5])
+        self.assertEqual(nijk_df.sample_id.tolist()[:2], [2, 2])
+
+    def test_get_nijk_df_filter_id(self):
+
+        filter_lfn_df = pandas.concat([
+            self.variant_read_count_df.assign(filter_id=8, filter_delete=False),
+            self.variant_read_count_df.assign(filter_id=2, filter_delete=False)], axis=0)
+        filter_lfn_df.loc[(filter_lfn_df.filter_id == 8) & (filter_lfn_df.variant_id == 2), 'filter_delete'] = True
+        with self.engine.connect() as conn:
+            conn.execute(FilterLFN.__table__.insert(), filter_lfn_df.to_dict('records'))
+
+        nijk_df = FileSampleInformation(self.sortedinfo_tsv).get_nijk_df(
+            variant_read_count_like_model=FilterLFN, engine=self.engine, filter_id=8)
+        nijk_bak_df = self.variant_read_count_df.iloc[:5]
+        self.assert_nijk_df(nijk_df, nijk_bak_df.loc[nijk_bak_df.variant_id != 2])
+
+    def test_get_nijk_df_repeated_sample(self):
+
+        with self.engine.connect() as conn:
+            conn.execute(VariantReadCount.__table__.insert(), self.variant_read_count_df.to_dict('records'))
+        # A sample replicate repeated in the sample information file is read once
+        sortedinfo_df = pandas.read_csv(self.sortedinfo_tsv, sep='\t')
+        sortedinfo_df = pandas.concat([sortedinfo_df, sortedinfo_df.iloc[[0]].assign(sortedfasta='s2_2b.fasta')])
+        sortedinfo_df.to_csv(self.sortedinfo_tsv, sep='\t', index=False)
+
+        nijk_df = FileSampleInformation(self.sortedinfo_tsv).get_nijk_df(
+            variant_read_count_like_model=VariantReadCount, engine=self.engine)
+        self.assert_nijk_df(nijk_df, self.variant_read_count_df.iloc[:5])
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tempdir, ignore_errors=True)
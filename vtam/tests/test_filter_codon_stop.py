@@ -1,7 +1,10 @@
 import pandas
+import sqlalchemy
 import unittest
 import io
 
+from vtam.models.Variant import Variant
+from vtam.models.VariantCodonStop import VariantCodonStop
 from vtam.utils.RunnerFilterCodonStop import RunnerFilterCodonStop
 
 
@@ -139,3 +142,57 @@ seq_stop2_code5_stop5_code1_frame1_TAA_TAG_TGA	TAAGTATTTTGACTCCTTATGCCTGCTTTAATA
             'id', 'has_stop_codon']].to_string()
         self.assertTrue(variant_stop_codon_count_df_str ==
                         variant_stop_codon_count_df_bak_str)
+
+    def test_annotate_stop_codon_count_cached(self):
+        engine = sqlalchemy.create_engine('sqlite://')
+        Variant.__table__.create(engine)
+        VariantCodonStop.__table__.create(engine)
+        variant_df = pandas.DataFrame({'sequence': self.variant_df.sequence.tolist()},
+                                      index=range(1, self.variant_df.shape[0] + 1))
+        variant_bak_df = self.filter_codon_stop_runner_obj.annotate_stop_codon_count(
+            variant_df.copy(), genetic_code=5)
+
+        variant_has_stop_codon_df = self.filter_codon_stop_runner_obj.annotate_stop_codon_count_cached(
+            variant_df.copy(), genetic_code=5, engine=engine, variant_codon_stop_model=VariantCodonStop)
+        self.assertEqual(variant_has_stop_codon_df.has_stop_codon.tolist(), variant_bak_df.has_stop_codon.tolist())
+
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(sqlalchemy.select(
+                [sqlalchemy.func.count()]).select_from(VariantCodonStop.__table__)).scalar(), 5)
+            # Cached results are not scanned again
+            conn.execute(VariantCodonStop.__table__.update().where(
+                VariantCodonStop.__table__.c.variant_id == 1).values(has_stop_codon=True))
+        variant_has_stop_codon_df = self.filter_codon_stop_runner_obj.annotate_stop_codon_count_cached(
+            variant_df.copy(), genetic_code=5, engine=engine, variant_codon_stop_model=VariantCodonStop)
+        self.assertEqual(variant_has_stop_codon_df.has_stop_codon.tolist(),
+                         [1] + variant_bak_df.has_stop_codon.tolist()[1:])
+
+    def test_annotate_stop_codon_count_cached_concurrent(self):
+        engine = sqlalchemy.create_engine('sqlite://')
+        Variant.__table__.create(engine)
+        VariantCodonStop.__table__.create(engine)
+        variant_df = pandas.DataFrame({'sequence': self.variant_df.sequence.tolist()},
+                                      index=range(1, self.variant_df.shape[0] + 1))
+        self.filter_codon_stop_runner_obj.annotate_stop_codon_count_cached(
+            variant_df.iloc[:2].copy(), genetic_code=5, engine=engine, variant_codon_stop_model=VariantCodonStop)
+
+        # Variants cached by a concurrent run between the select and the insert are skipped
+        filter_codon_stop_runner_obj = RunnerFilterCodonStop(variant_read_count_df=None)
+        filter_codon_stop_runner_obj.select_has_stop_codon_dic = lambda *args: {}
+        variant_has_stop_codon_df = filter_codon_stop_runner_obj.annotate_stop_codon_count_cached(
+            variant_df.copy(), genetic_code=5, engine=engine, variant_codon_stop_model=VariantCodonStop)
+        variant_bak_df = self.filter_codon_stop_runner_obj.annotate_stop_codon_count(
+            variant_df.copy(), genetic_code=5)
+        self.assertEqual(variant_has_stop_codon_df.has_stop_codon.tolist(), variant_bak_df.has_stop_codon.tolist())
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(sqlalchemy.select(
+                [sqlalchemy.func.count()]).select_from(VariantCodonStop.__table__)).scalar(), 5)
+
+    def test_get_frame_has_stop_codon_2d(self):
+        sequence_lst = self.variant_df.sequence.tolist() + ['TA', 'ATAAN', 'NTAGTGA', '']
+        for genetic_code in [1, 5]:
+            frame_has_stop_codon_2d = self.filter_codon_stop_runner_obj.get_frame_has_stop_codon_2d(
+                sequence_lst, genetic_code=genetic_code)
+            frame_has_stop_codon_bak_lst = [[self.filter_codon_stop_runner_obj.seq_has_codon_stop(
+                sequence, frame=frame, genetic_code=genetic_code) for frame in [1, 2, 3]] for sequence in sequence_lst]
+            self.assertEqual(frame_has_stop_codon_2d.tolist(), frame_has_stop_codon_bak_lst)
@@ -211,3 +211,27 @@ class TestFilterLFN(unittest.TestCase):
             & (self.filter_lfn_runner.variant_read_count_filter_delete_df.replicate == 3)
             & (self.filter_lfn_runner.variant_read_count_filter_delete_df.filter_id == 8),
             'filter_delete'].values[0])
+
+    def test_mark_delete_lfn_per_Ni_specific_cutoff(self):
+
+        cutoff_specific_df = pandas.DataFrame({
+            'run_id': [1], 'marker_id': [1], 'variant_id': [1], 'cutoff': [0.05], 'variant_sequence': ['tata']})
+        self.filter_lfn_runner.mark_delete_lfn_per_Ni_or_Nik_or_Njk(
+            lfn_denominator='N_i', cutoff=0.001, cutoff_specific_df=cutoff_specific_df)
+        filter_delete_df = self.filter_lfn_runner.variant_read_count_filter_delete_df
+        # N_1 = 507: 10/507 is above the general cutoff and below the specific cutoff
+        self.assertEqual(filter_delete_df.loc[filter_delete_df.filter_id == 4].shape[0], 6)
+        self.assertEqual(filter_delete_df.loc[filter_delete_df.filter_id == 4].filter_delete.tolist(),
+                         [True, True, True, False, False, False])
+        self.assertFalse(filter_delete_df.loc[(filter_delete_df.filter_id == 2)
+                                              & (filter_delete_df.variant_id == 1)].filter_delete.values[0])
+
+    def test_iter_variant_read_count_filter_delete_df(self):
+
+        self.filter_lfn_runner.mark_delete_lfn_all_filters(
+            lfn_variant_cutoff=0.001, lfn_variant_specific_cutoff=None, lfn_variant_replicate_cutoff=None,
+            lfn_variant_replicate_specific_cutoff=None, lfn_sample_replicate_cutoff=0.001, lfn_read_count_cutoff=10)
+        chunk_df_lst = list(self.filter_lfn_runner.iter_variant_read_count_filter_delete_df(chunk_size=100))
+        self.assertTrue(max([chunk_df.shape[0] for chunk_df in chunk_df_lst]) <= 100)
+        self.assertTrue(pandas.concat(chunk_df_lst, ignore_index=True).equals(
+            self.filter_lfn_runner.variant_read_count_filter_delete_df))
@@ -40,20 +40,22 @@ class TestFilterPCRError(TestCase):
             os.path.basename(__file__))
         pathlib.Path(self.this_tempdir).mkdir(parents=True, exist_ok=True)
 
-    def test_get_vsearch_alignement_df(self):
+    def test_get_one_edit_alignement_df(self):
 
         filter_pcr_error_runner = RunnerFilterPCRerror(
             variant_expected_df=self.variant_df,
             variant_unexpected_df=self.variant_df,
             variant_read_count_df=self.variant_read_count_df)
-        vsearch_alignement_df = filter_pcr_error_runner.get_vsearch_alignement_df()
+        one_edit_alignement_df = filter_pcr_error_runner.get_one_edit_alignement_df()
         self.assertTrue(
             sorted(
-                vsearch_alignement_df.ids.unique().tolist()) == [
-                297,
-                298,
+                one_edit_alignement_df.ids.unique().tolist()) == [
                 299,
                 300])
+        one_edit_alignement_df = one_edit_alignement_df.loc[one_edit_alignement_df.mism == 1]
+        self.assertEqual(
+            sorted(zip(one_edit_alignement_df.variant_id_unexpected, one_edit_alignement_df.variant_id_expected)),
+            [(1, 2), (1, 3), (2, 1), (3, 1), (3, 4), (4, 3)])
 
     def test_get_filter_output_df(self):
 
@@ -0,0 +1,61 @@
+import sqlalchemy
+import unittest
+
+from vtam.models.Run import Run
+from vtam.models.Variant import Variant
+from vtam.utils import constants
+from vtam.utils.NameIdConverter import NameIdConverter
+
+
+class TestNameIdConverter(unittest.TestCase):
+
+    def setUp(self):
+
+        self.engine = sqlalchemy.create_engine('sqlite://')
+        Run.__table__.create(self.engine)
+        Variant.__table__.create(self.engine)
+        self.sequence_lst = ['ACGT' + 'A' * i for i in range(constants.sql_in_chunk_size + 10)]
+        with self.engine.connect() as conn:
+            conn.execute(Run.__table__.insert(), [{'id': 1, 'name': 'prerun'}, {'id': 2, 'name': 'run2'}])
+            conn.execute(Variant.__table__.insert(), [
+                {'id': i + 1, 'sequence': sequence} for i, sequence in enumerate(self.sequence_lst)])
+
+    def test_to_ids_to_names(self):
+
+        self.assertEqual(NameIdConverter(['run2', 'prerun', 'run2'], self.engine).to_ids(Run), [2, 1, 2])
+        self.assertEqual(NameIdConverter([1, 2, 1], self.engine).to_names(Run), ['prerun', 'run2', 'prerun'])
+
+    def test_variant_sequence_to_id_chunks(self):
+
+        sequence_lst = self.sequence_lst[::-1]
+        variant_id_lst = NameIdConverter(sequence_lst, self.engine).variant_sequence_to_id()
+        self.assertEqual(variant_id_lst, list(range(len(sequence_lst), 0, -1)))
+        self.assertEqual(NameIdConverter(variant_id_lst, self.engine).variant_id_to_sequence(), sequence_lst)
+
+    def test_cache(self):
+
+        self.assertEqual(NameIdConverter(['run2'], self.engine).to_ids(Run), [2])
+        with self.engine.connect() as conn:
+            conn.execute(Run.__table__.delete())
+        # Cached names are not queried again
+        self.assertEqual(NameIdConverter(['run2'], self.engine).to_ids(Run), [2])
+        with self.assertRaises(SystemExit):
+            NameIdConverter(['prerun'], self.engine).to_ids(Run)
+
+    def test_cache_recreated_table(self):
+
+        self.assertEqual(NameIdConverter(['run2'], self.engine).to_ids(Run), [2])
+        self.assertEqual(NameIdConverter([1], self.engine).variant_id_to_sequence(), [self.sequence_lst[0]])
+        with self.engine.connect() as conn:
+            conn.execute(Variant.__table__.delete())
+        Run.__table__.drop(self.engine)
+        Run.__table__.create(self.engine)
+        with self.engine.connect() as conn:
+            conn.execute(Run.__table__.insert(), [{'id': 1, 'name': 'run2'}])
+        self.assertEqual(NameIdConverter(['run2'], self.engine).to_ids(Run), [1])
+        # The cache of the other tables is kept
+        self.assertEqual(NameIdConverter([1], self.engine).variant_id_to_sequence(), [self.sequence_lst[0]])
+
+    def tearDown(self):
+
+        NameIdConverter.clear_cache()
@@ -2,6 +2,8 @@ import os
 import pandas
 import unittest
 
+from vtam.utils.RunnerFilterLFNreplicateRemain import RunnerFilterLFNreplicateRemain
+from vtam.utils.RunnerOptimizeLFNreadCountAndVariant import RunnerOptimizeLFNreadCountAndVariant, shared_memory
 from vtam.utils.RunnerOptimizeLFNreadCountAndVariantRunMarker import \
     RunnerOptimizeLFNreadCountAndVariantRunMarker
 from vtam.utils.constants import get_params_default_dic
@@ -18,6 +20,8 @@ class TestOptimizeLFNreadCountAndLFNvariantRunner(unittest.TestCase):
 
         nijk_df = pandas.read_csv(nijk_path, header=0, sep="\t")
         known_occurrences_df = pandas.read_csv(known_occurrences_path, header=0, sep="\t")
+        self.nijk_all_df = nijk_df
+        self.known_occurrences_all_df = known_occurrences_df
 
         self.nijk_df = nijk_df.loc[(nijk_df.run_id == 1) & (nijk_df.marker_id == 1)]  # one marker
         self.known_occurrences_df = known_occurrences_df.loc[
@@ -51,6 +55,24 @@ class TestOptimizeLFNreadCountAndLFNvariantRunner(unittest.TestCase):
         self.assertEqual(count_keep_max, 6)
         self.assertEqual(count_delete_max, 0)
 
+    def test_count_keep_delete(self):
+
+        for lfn_nik_cutoff in [None, self.lfn_nik_cutoff]:
+            for lfn_nijk_cutoff in [10, 170, 200]:
+                optimize_params_dic = dict(self.optimize_params_dic, lfn_nik_cutoff=lfn_nik_cutoff,
+                                           lfn_nijk_cutoff=lfn_nijk_cutoff)
+                self.assertEqual(
+                    self.optim_run_marker_obj.count_keep_delete(**optimize_params_dic),
+                    RunnerFilterLFNreplicateRemain(nijk_df=self.nijk_df, **optimize_params_dic).count_keep_delete(
+                        known_occurrences_df=self.known_occurrences_df))
+
+    def test_get_count_keep_max_prefix_length(self):
+
+        count_keep_dic = {1: 6, 2: 6, 3: 5, 4: 3}
+        for cutoff_lst in [[1, 2, 3, 4], [2, 1, 4, 3]]:
+            self.assertEqual(RunnerOptimizeLFNreadCountAndVariantRunMarker.get_count_keep_max_prefix_length(
+                cutoff_lst, count_keep_dic.get, 6), 2)
+
     def test_get_lst_lfn_nijk_cutoff(self):
 
         lfn_nijk_cutoff_lst = self.optim_run_marker_obj.get_lst_one_par_lfn_nijk_cutoff(
@@ -114,3 +136,54 @@ class TestOptimizeLFNreadCountAndLFNvariantRunner(unittest.TestCase):
 1                   6                     0              150              0.177
 0                   6                     0              150              0.010"""
         self.assertEqual(out_two_pars_df.to_string(), out_two_pars_df_bak)
+
+    def test_get_df_optim_lfn_readcount_variant_cutoff_exact(self):
+
+        for lfn_ni_cutoff, lfn_nik_cutoff in [(self.lfn_ni_cutoff, None), (None, self.lfn_nik_cutoff)]:
+            out_two_pars_df = self.optim_run_marker_obj.get_df_optim_lfn_readcount_variant_replicate_cutoff_exact(
+                lfn_ni_cutoff=lfn_ni_cutoff, lfn_nik_cutoff=lfn_nik_cutoff, lfn_njk_cutoff=self.lfn_njk_cutoff,
+                lfn_nijk_cutoff=self.lfn_nijk_cutoff, min_replicate_number=self.min_replicate_number,
+                lfn_nijk_cutoff_max=1000, lfn_ni_nik_cutoff_max=1)
+            self.assertTrue(out_two_pars_df.shape[0] > 0)
+            # Each exact point has the counts of the filters with these cutoffs
+            for row in out_two_pars_df.itertuples():
+                self.assertEqual(self.optim_run_marker_obj.count_keep_delete(
+                    *self.optim_run_marker_obj.get_lfn_ni_nik_cutoff_pair(
+                        lfn_ni_cutoff, lfn_nik_cutoff, row.lfn_ni_nik_cutoff),
+                    lfn_njk_cutoff=self.lfn_njk_cutoff, lfn_nijk_cutoff=row.lfn_nijk_cutoff,
+                    min_replicate_number=self.min_replicate_number),
+                    (row.occurrence_nb_keep, row.occurrence_nb_delete))
+            # The exact sweep goes at least as far as the grid
+            self.assertTrue(out_two_pars_df.lfn_nijk_cutoff.max() >= 170)
+            self.assertTrue(out_two_pars_df.occurrence_nb_keep.min() == 6)
+
+    def test_get_optimize_df_num_threads(self):
+
+        known_occurrences_df = self.known_occurrences_all_df.copy()
+        known_occurrences_df.loc[known_occurrences_df.action == 'delete', 'marker_id'] = 2  # two run-markers
+
+        out_df_lst = []
+        for num_threads in [1, 2]:
+            out_df_lst.append(RunnerOptimizeLFNreadCountAndVariant(
+                nijk_df=self.nijk_all_df, known_occurrences_df=known_occurrences_df,
+                num_threads=num_threads).get_optimize_df(**self.optimize_params_dic))
+        for out_serial_df, out_parallel_df in zip(*out_df_lst):
+            self.assertEqual(out_serial_df.to_string(), out_parallel_df.to_string())
+        self.assertEqual(out_df_lst[1][0].marker_id.unique().tolist(), [1, 2])
+        # The serial run does not set the nijk array of the worker processes
+        self.assertIsNone(RunnerOptimizeLFNreadCountAndVariant.worker_nijk_arr)
+
+    @unittest.skipIf(shared_memory is None, "requires Python >= 3.8")
+    def test_close_worker(self):
+
+        nijk_arr = self.nijk_all_df[RunnerOptimizeLFNreadCountAndVariant.nijk_column_lst].to_numpy(dtype='int64')
+        nijk_shm = shared_memory.SharedMemory(create=True, size=nijk_arr.nbytes)
+        try:
+            RunnerOptimizeLFNreadCountAndVariant.init_worker(nijk_arr.shape, nijk_shm.name)
+            self.assertEqual(RunnerOptimizeLFNreadCountAndVariant.worker_nijk_arr.shape, nijk_arr.shape)
+            RunnerOptimizeLFNreadCountAndVariant.close_worker()
+            self.assertIsNone(RunnerOptimizeLFNreadCountAndVariant.worker_nijk_arr)
+            self.assertIsNone(RunnerOptimizeLFNreadCountAndVariant.worker_nijk_shm)
+        finally:
+            nijk_shm.close()
+            nijk_shm.unlink()
@@ -0,0 +1,77 @@
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+
+from vtam.utils.RunnerBlast import RunnerBlast
+
+
+class TestRunnerBlast(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tempdir = tempfile.mkdtemp()
+        self.variant_fasta = os.path.join(self.tempdir, 'variant.fasta')
+        self.sequence_lst = ['ACGT' * (10 + i % 7) for i in range(20)]
+        with open(self.variant_fasta, 'w') as fout:
+            for sequence in self.sequence_lst:
+                fout.write(">{}\n{}\n".format(sequence, sequence))
+
+    def test_split_fasta(self):
+
+        chunk_fasta_lst = RunnerBlast.split_fasta(self.variant_fasta, 4, os.path.join(self.tempdir, 'chunk'))
+        self.assertEqual(len(chunk_fasta_lst), 4)
+        # Chunks are consecutive and balanced
+        chunk_str_lst = []
+        for chunk_fasta in chunk_fasta_lst:
+            with open(chunk_fasta) as fin:
+                chunk_str_lst.append(fin.read())
+        with open(self.variant_fasta) as fin:
+            self.assertEqual(''.join(chunk_str_lst), fin.read())
+        chunk_length_lst = [len(chunk_str) for chunk_str in chunk_str_lst]
+        self.assertLess(max(chunk_length_lst) - min(chunk_length_lst), 2 * 2 * len(max(self.sequence_lst, key=len)) + 4)
+
+    def test_split_fasta_one_chunk(self):
+
+        self.assertEqual(RunnerBlast.split_fasta(self.variant_fasta, 1, os.path.join(self.tempdir, 'chunk')),
+                         [self.variant_fasta])
+        # At most one chunk per sequence
+        self.assertLessEqual(len(RunnerBlast.split_fasta(self.variant_fasta, 100, os.path.join(
+            self.tempdir, 'chunk'))), len(self.sequence_lst))
+
+    def test_num_chunks(self):
+
+        self.assertEqual(RunnerBlast(self.variant_fasta, self.tempdir, 'db', 8, 80).num_chunks, 4)
+        self.assertEqual(RunnerBlast(self.variant_fasta, self.tempdir, 'db', '1', 80).num_chunks, 1)
+        self.assertEqual(RunnerBlast(self.variant_fasta, self.tempdir, 'db', 8, 80, num_chunks=1).num_chunks, 1)
+
+    def test_process_blast_result(self):
+
+        blast_output_tsv = os.path.join(self.tempdir, 'blast_output.tsv')
+        with open(blast_output_tsv, 'w') as fout:
+            fout.write("v1\tMF1\t100.000\t1e-80\t100\t189839\n"
+                       "v1\tMF2\t99.429\t1e-80\t100\t189839;1469487\n"
+                       "v1\tMF3\t99.100\t1e-80\t100\t189839\n"
+                       "v1\tMF4\t98.857\t1e-80\t100\t1469487\n"
+                       "v1\tMF5\t65.000\t1e-10\t100\t1469487\n"
+                       "v2\tMF6\t96.000\t1e-80\t100\t\n"
+                       "v2\tMF7\t96.000\t1e-80\t100\t6220\n"
+                       "v1\tMF8\t99.000\t1e-80\t100\t189839\n")
+        blast_output_chunk_size = RunnerBlast.blast_output_chunk_size
+        RunnerBlast.blast_output_chunk_size = 3
+        try:
+            blast_output_df = RunnerBlast.process_blast_result(blast_output_tsv)
+        finally:
+            RunnerBlast.blast_output_chunk_size = blast_output_chunk_size
+
+        blast_output_bak_df = pandas.DataFrame({
+            'variant_id': ['v1', 'v1', 'v1', 'v2'],
+            'identity': [100, 99, 97, 95],
+            'target_tax_id': [189839, 189839, 1469487, 6220],
+            'hit_count': [1, 3, 1, 1]})
+        pandas.testing.assert_frame_equal(blast_output_df, blast_output_bak_df, check_dtype=False)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tempdir, ignore_errors=True)
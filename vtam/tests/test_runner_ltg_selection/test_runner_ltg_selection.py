@@ -45,3 +45,54 @@ class TestRunnerLTGselection(unittest.TestCase):
 
     def tearDown(self):
         shutil.rmtree(self.outdir_path, ignore_errors=True)
+
+
+class TestRunnerLTGselectionGrouped(unittest.TestCase):
+
+    def setUp(self):
+
+        test_path = os.path.join(PathManager.get_test_path())
+        self.variantid_identity_lineage_df = pandas.read_csv(os.path.join(test_path, "test_runner_ltg_selection", "variantid_identity_lineage.tsv"), sep="\t", header=0)
+        lineage_df = self.variantid_identity_lineage_df.drop(
+            ['variant_id', 'target_id', 'identity', 'evalue', 'coverage', 'target_tax_id'], axis=1)
+        tax_id_list = sorted(set(lineage_df.stack().astype('int').tolist()))
+        self.taxonomy_df = pandas.DataFrame(
+            {'name_txt': ['taxon_{}'.format(tax_id) for tax_id in tax_id_list]}, index=tax_id_list)
+
+    def test_several_variants_to_ltg_as_one_variant_to_ltg(self):
+
+        runner_ltg_selection = RunnerLTGselection(
+            variant_identity_lineage_df=self.variantid_identity_lineage_df, taxonomy_df=self.taxonomy_df, params=None)
+        ltg_df = runner_ltg_selection.several_variants_to_ltg()
+
+        ltg_list = []
+        for variant_id in sorted(self.variantid_identity_lineage_df.variant_id.unique().tolist()):
+            ltg_dic = runner_ltg_selection.one_variant_to_ltg(variant_id)
+            if not (ltg_dic == {}):
+                ltg_list.append({**{'variant_id': variant_id}, **ltg_dic})
+        ltg_bak_df = pandas.DataFrame(data=ltg_list, columns=['variant_id', 'identity',
+                'ltg_tax_id', 'ltg_tax_name', 'ltg_rank'])
+        ltg_bak_df.ltg_tax_id = ltg_bak_df.ltg_tax_id.astype('int')
+
+        self.assertEqual(ltg_df.shape[0], 6)
+        pandas._testing.assert_frame_equal(ltg_bak_df, ltg_df)
+
+    def test_one_variant_to_ltg_hit_count(self):
+
+        hit_df = self.variantid_identity_lineage_df.drop(['target_id', 'evalue', 'coverage'], axis=1)
+        # The hits of the last target of each variant are repeated to change the LTGs
+        repeat_df = hit_df.loc[hit_df.target_tax_id == hit_df.groupby('variant_id').target_tax_id.transform('last')]
+        hit_df = pandas.concat([hit_df] + [repeat_df] * 9).reset_index(drop=True)
+        hit_count_df = hit_df.groupby(hit_df.columns.tolist(), sort=False, dropna=False).size().reset_index(
+            name='hit_count')
+        self.assertTrue(hit_count_df.shape[0] < hit_df.shape[0])
+
+        runner_ltg_selection = RunnerLTGselection(
+            variant_identity_lineage_df=hit_df, taxonomy_df=self.taxonomy_df, params=None)
+        runner_ltg_selection_hit_count = RunnerLTGselection(
+            variant_identity_lineage_df=hit_count_df, taxonomy_df=self.taxonomy_df, params=None)
+        for variant_id in hit_df.variant_id.unique().tolist():
+            self.assertEqual(runner_ltg_selection_hit_count.one_variant_to_ltg(variant_id),
+                             runner_ltg_selection.one_variant_to_ltg(variant_id))
+        pandas._testing.assert_frame_equal(runner_ltg_selection_hit_count.several_variants_to_ltg(),
+                                           runner_ltg_selection.several_variants_to_ltg())
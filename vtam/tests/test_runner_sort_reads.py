@@ -0,0 +1,74 @@
+import filecmp
+import os
+import pathlib
+import shutil
+import unittest
+
+from vtam.utils.FileSampleInformation import FileSampleInformation
+from vtam.utils.PathManager import PathManager
+from vtam.utils.RunnerSortReads import RunnerSortReads
+
+
+class TestRunnerSortReads(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.test_path = PathManager.get_test_path()
+        cls.outdir_path = os.path.join(cls.test_path, 'outdir')
+
+    def setUp(self):
+
+        self.fastainfo_df = FileSampleInformation(os.path.join(
+            self.test_path, "test_files", "mergedinfo.tsv")).read_tsv_into_df()
+        self.fastadir = os.path.join(self.test_path, "test_files", "merged")
+        self.sorted_dir = os.path.join(self.outdir_path, "sorted")
+        self.sorted_dir_bak = os.path.join(self.test_path, "test_files", "sorted")
+        pathlib.Path(self.sorted_dir).mkdir(parents=True, exist_ok=True)
+
+    def test_run(self):
+
+        in_fasta_basename = 'MFZR_14Ben01_Tpos1_2_fw_48.fasta'
+        fastainfo_df = self.fastainfo_df.loc[self.fastainfo_df.mergedfasta == in_fasta_basename]
+        runner_sort_reads = RunnerSortReads(
+            fastainfo_df=fastainfo_df, in_fasta_path=os.path.join(self.fastadir, in_fasta_basename),
+            sorteddir=self.sorted_dir, cutadapt_error_rate=0.1, cutadapt_minimum_length=50,
+            cutadapt_maximum_length=500)
+        sorted_read_info_df = runner_sort_reads.run()
+
+        sortedfasta_lst = ['MFZR_14Ben01_Tpos1_2_fw_48_002.fasta', 'MFZR_14Ben01_Tpos1_2_fw_48_003.fasta']
+        self.assertEqual(sorted_read_info_df.sortedfasta.tolist(), sortedfasta_lst)
+        match, mismatch, errors = filecmp.cmpfiles(self.sorted_dir, self.sorted_dir_bak, common=sortedfasta_lst,
+                                                   shallow=False)
+        self.assertEqual(match, sortedfasta_lst)
+
+    def test_locate_primer(self):
+
+        runner_sort_reads = RunnerSortReads(
+            fastainfo_df=self.fastainfo_df, in_fasta_path=None, sorteddir=self.sorted_dir,
+            cutadapt_error_rate=0.1, cutadapt_minimum_length=50, cutadapt_maximum_length=500)
+        primer_codes = runner_sort_reads.encode_primer('TCCACTAATCACAARGATATTGGTAC')
+
+        read = 'GGTCCACTAATCACAAGGATATTGGTACTTT'
+        read_codes = runner_sort_reads.read_code_lookup[[ord(c) for c in read]]
+        self.assertEqual(runner_sort_reads.locate_primer(read_codes, primer_codes), 2)
+        # Two mismatches are allowed for this primer length
+        read = 'GGTCCACTAATGACAAGGATATTGGTTCTTT'
+        read_codes = runner_sort_reads.read_code_lookup[[ord(c) for c in read]]
+        self.assertEqual(runner_sort_reads.locate_primer(read_codes, primer_codes), 2)
+        # Three mismatches are not
+        read = 'GGTCCACTAATGACAAGGATATTCGTTCTTT'
+        read_codes = runner_sort_reads.read_code_lookup[[ord(c) for c in read]]
+        self.assertEqual(runner_sort_reads.locate_primer(read_codes, primer_codes), -1)
+
+    def test_find_tags(self):
+
+        tag_dic = dict.fromkeys(['ACAG', 'GTAC', 'CGTCGA', 'TTTT'])
+        tag_length_lst = RunnerSortReads.get_tag_length_lst(tag_dic)
+        read = 'GTACAGCGTCGAACAGTTTGTAC'
+        # Leftmost occurrence of each tag from the start position, as with str.find
+        for start in [0, 3, 10]:
+            self.assertEqual(RunnerSortReads.find_tags(read, tag_dic, tag_length_lst, start), {
+                tag: read.find(tag, start) for tag in tag_dic if read.find(tag, start) >= 0})
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir_path, ignore_errors=True)
@@ -0,0 +1,69 @@
+import os
+import pandas
+import sqlalchemy
+import unittest
+
+from vtam.models.Variant import Variant
+from vtam.utils.PathManager import PathManager
+from vtam.utils.RunnerVariantReadCount import RunnerVariantReadCount
+
+
+class TestRunnerVariantReadCount(unittest.TestCase):
+
+    def setUp(self):
+
+        self.read_dir = os.path.join(PathManager.get_test_path(), "test_cmd_filter_without_downloaded_sorted")
+        self.sample_info_ids_df = pandas.DataFrame({
+            'run_id': [1, 1],
+            'marker_id': [1, 1],
+            'sample_id': [1, 1],
+            'replicate': [1, 2],
+            'sortedfasta': ['mfzr_1_fw_000.fasta', 'mfzr_1_fw_000_singletons.fasta'],
+        })
+
+    def test_count_fasta_reads(self):
+
+        read_count_counter = RunnerVariantReadCount.count_fasta_reads(
+            os.path.join(self.read_dir, 'mfzr_1_fw_000.fasta'))
+
+        self.assertEqual(sum(read_count_counter.values()), 4)
+        self.assertEqual(read_count_counter['AACCAGGATCTTTAATTGGAGATGATCAAATTTATAATGTTATCATTACAGCT'], 2)
+        # Sequence over two lines
+        self.assertEqual(read_count_counter['TTCTTTATATTTTCTATTTGGAGCGTGGGCTGGAATAGTAGGAACATCAATAAGTATACTTATTCGTGCAGAACTTGGTC'], 2)
+
+    def test_get_variant_read_count_df(self):
+
+        variant_read_count_df = RunnerVariantReadCount(
+            sample_info_ids_df=self.sample_info_ids_df, read_dir=self.read_dir).get_variant_read_count_df()
+
+        self.assertEqual(variant_read_count_df.columns.tolist(), [
+            'run_id', 'marker_id', 'sample_id', 'replicate', 'read_sequence', 'read_count'])
+        self.assertEqual(variant_read_count_df.loc[variant_read_count_df.replicate == 1, 'read_count'].sum(), 4)
+        self.assertEqual(variant_read_count_df.loc[variant_read_count_df.replicate == 2, 'read_count'].sum(), 2)
+
+    def test_get_variant_id_df(self):
+
+        engine = sqlalchemy.create_engine('sqlite://')
+        Variant.__table__.create(engine)
+        with engine.connect() as conn:
+            conn.execute(Variant.__table__.insert(), [{'id': 1, 'sequence': 'ACGT'}, {'id': 2, 'sequence': 'CCCC'}])
+
+        variant_read_count_df = pandas.DataFrame({
+            'sample_id': [1, 1, 2, 2],
+            'variant_sequence': ['AAAA', 'CCCC', 'AAAA', 'GGGG'],
+        })
+        variant_read_count_df, variant_new_df = RunnerVariantReadCount.get_variant_id_df(
+            variant_read_count_df=variant_read_count_df, variant_model=Variant, engine=engine)
+
+        self.assertEqual(variant_read_count_df.variant_id.tolist(), [3, 2, 3, 4])
+        self.assertEqual(variant_new_df.to_dict('records'), [{'id': 3, 'sequence': 'AAAA'}, {'id': 4, 'sequence': 'GGGG'}])
+
+    def test_get_variant_read_count_df_threads(self):
+
+        variant_read_count_df = RunnerVariantReadCount(
+            sample_info_ids_df=self.sample_info_ids_df, read_dir=self.read_dir).get_variant_read_count_df()
+        variant_read_count_threads_df = RunnerVariantReadCount(
+            sample_info_ids_df=self.sample_info_ids_df, read_dir=self.read_dir,
+            num_threads=2).get_variant_read_count_df()
+
+        pandas.testing.assert_frame_equal(variant_read_count_df, variant_read_count_threads_df)
@@ -0,0 +1,57 @@
+import itertools
+import random
+import unittest
+
+import pandas
+
+from vtam.utils.SequenceNeighbourIndex import SequenceNeighbourIndex
+
+
+class TestSequenceNeighbourIndex(unittest.TestCase):
+
+    def setUp(self):
+
+        random.seed(0)
+        sequence_lst = [''.join(random.choice('ACGT') for i in range(20)) for j in range(20)]
+        sequence_lst += ['AAAAAAACCCC', 'AAAAAACCCC', 'AAAAAAACCCT', 'AAAATAACCCC']
+        # One random edit of the first sequences
+        for sequence in sequence_lst[:10]:
+            position = random.randrange(len(sequence))
+            sequence_lst.append(sequence[:position] + random.choice('ACGT') + sequence[position + 1:])
+            sequence_lst.append(sequence[:position] + sequence[position + 1:])
+            sequence_lst.append(sequence[:position] + random.choice('ACGT') + sequence[position:])
+        self.variant_df = pandas.DataFrame({'sequence': sequence_lst}, index=range(1, len(sequence_lst) + 1))
+
+    @staticmethod
+    def edit_distance(sequence_a, sequence_b):
+
+        previous_row = list(range(len(sequence_b) + 1))
+        for i, nt_a in enumerate(sequence_a, 1):
+            row = [i]
+            for j, nt_b in enumerate(sequence_b, 1):
+                row.append(min(previous_row[j] + 1, row[j - 1] + 1, previous_row[j - 1] + (nt_a != nt_b)))
+            previous_row = row
+        return previous_row[-1]
+
+    def test_get_one_edit_pair_df(self):
+
+        pair_df = SequenceNeighbourIndex(self.variant_df).get_one_edit_pair_df(self.variant_df)
+        pair_set = set(zip(pair_df.variant_id_query, pair_df.variant_id_target))
+
+        pair_bak_set = set()
+        for (id_a, sequence_a), (id_b, sequence_b) in itertools.product(self.variant_df.sequence.items(), repeat=2):
+            if self.edit_distance(sequence_a, sequence_b) <= 1:
+                pair_bak_set.add((id_a, id_b))
+        self.assertEqual(pair_set, pair_bak_set)
+        self.assertEqual(len(pair_set), pair_df.shape[0])
+        self.assertTrue(((pair_df.mism + pair_df.gaps) == (pair_df.alnlen - pair_df.ids)).all())
+
+    def test_get_one_edit_pair_df_homopolymer(self):
+
+        variant_df = pandas.DataFrame({'sequence': ['AAAAAAACCCC', 'AAAAAACCCC', 'AAAAAAACCCT']}, index=[1, 2, 3])
+        pair_df = SequenceNeighbourIndex(variant_df).get_one_edit_pair_df(variant_df.loc[[1]])
+        self.assertEqual(pair_df.variant_id_target.tolist(), [1, 2, 3])
+        self.assertEqual(pair_df.mism.tolist(), [0, 0, 1])
+        self.assertEqual(pair_df.gaps.tolist(), [0, 1, 0])
+        self.assertEqual(pair_df.alnlen.tolist(), [11, 11, 11])
+        self.assertEqual(pair_df.ids.tolist(), [11, 10, 10])
@@ -0,0 +1,125 @@
+import numpy
+import os
+import pandas
+import shutil
+import tempfile
+import unittest
+
+from vtam.CommandTaxonomy import CommandTaxonomy
+from vtam.utils.TaxLineage import TaxLineage
+from vtam.utils.Taxonomy import Taxonomy
+
+
+class TestTaxonomy(unittest.TestCase):
+
+    def setUp(self):
+
+        self.taxonomy_df = pandas.DataFrame({
+            'tax_id': [1, 131567, 2759, 33208, 6656, 50557, 7041, 7042, 7043, 7044],
+            'parent_tax_id': [1, 1, 131567, 2759, 33208, 6656, 50557, 7041, 7041, 999999],
+            'rank': ['no rank', 'no rank', 'superkingdom', 'kingdom', 'phylum', 'class', 'order', 'family',
+                     'family', 'genus'],
+            'name_txt': ['root', 'cellular organisms', 'Eukaryota', 'Metazoa', 'Arthropoda', 'Insecta',
+                         'Coleoptera', 'Family1', 'Family2', 'Genus1'],
+            'old_tax_id': [numpy.nan] * 8 + [7000, numpy.nan]})
+        self.tempdir = tempfile.mkdtemp()
+
+    def test_get_several_tax_id_lineages(self):
+
+        taxonomy = Taxonomy(df=self.taxonomy_df)
+        tax_id_lst = [7042, 7000, 7044, 6656, 424242]
+        tax_id_lineage_df = taxonomy.get_several_tax_id_lineages(tax_id_lst)
+
+        lineage_bak_df = pandas.DataFrame([{**{'tax_id': tax_id}, **taxonomy.get_one_tax_id_lineage(tax_id)}
+                                           for tax_id in tax_id_lst]).set_index('tax_id')
+        pandas.testing.assert_frame_equal(tax_id_lineage_df[lineage_bak_df.columns], lineage_bak_df)
+        self.assertEqual(tax_id_lineage_df.loc[7042, 'no rank'], 131567)
+        self.assertEqual(tax_id_lineage_df.loc[7000, 'order'], 7041)
+
+    def test_lineage_cache(self):
+
+        taxonomy_tsv = os.path.join(self.tempdir, 'taxonomy.tsv')
+        self.taxonomy_df.to_csv(taxonomy_tsv, sep='\t', index=False)
+        tax_id_lineage_df = Taxonomy(tsv=taxonomy_tsv).get_several_tax_id_lineages([7042, 7000, 1])
+
+        Taxonomy(tsv=taxonomy_tsv, lineage_cache=True)
+        self.assertTrue(os.path.isfile(os.path.join(self.tempdir, 'taxonomy.lineage.npy')))
+        taxonomy = Taxonomy(tsv=taxonomy_tsv, lineage_cache=True)
+        self.assertIsInstance(taxonomy.lineage_arr, numpy.memmap)
+        pandas.testing.assert_frame_equal(
+            taxonomy.get_several_tax_id_lineages([7042, 7000, 1]), tax_id_lineage_df)
+
+    def test_lineage_cache_large_tax_id(self):
+
+        taxonomy_tsv = os.path.join(self.tempdir, 'taxonomy.tsv')
+        taxonomy_df = self.taxonomy_df.copy()
+        taxonomy_df.loc[taxonomy_df.tax_id == 7041, 'tax_id'] = 2 ** 31 + 7041  # Beyond int32
+        taxonomy_df.loc[taxonomy_df.parent_tax_id == 7041, 'parent_tax_id'] = 2 ** 31 + 7041
+        taxonomy_df.to_csv(taxonomy_tsv, sep='\t', index=False)
+
+        Taxonomy(tsv=taxonomy_tsv, lineage_cache=True)
+        taxonomy = Taxonomy(tsv=taxonomy_tsv, lineage_cache=True)
+        self.assertIsInstance(taxonomy.lineage_arr, numpy.memmap)
+        self.assertEqual(taxonomy.get_several_tax_id_lineages([7042]).loc[7042, 'order'], 2 ** 31 + 7041)
+
+    def test_lineage_cache_opt_in(self):
+
+        taxonomy_tsv = os.path.join(self.tempdir, 'taxonomy.tsv')
+        self.taxonomy_df.to_csv(taxonomy_tsv, sep='\t', index=False)
+        tax_lineage_df = TaxLineage(taxonomic_tsv_path=taxonomy_tsv).create_lineage_from_tax_id_list([7042, 7000])
+        for npy in Taxonomy.get_lineage_cache_npy(taxonomy_tsv):
+            self.assertFalse(os.path.isfile(npy))
+
+        pandas.testing.assert_frame_equal(TaxLineage(
+            taxonomic_tsv_path=taxonomy_tsv, lineage_cache=True).create_lineage_from_tax_id_list([7042, 7000]),
+            tax_lineage_df)
+        for npy in Taxonomy.get_lineage_cache_npy(taxonomy_tsv):
+            self.assertTrue(os.path.isfile(npy))
+
+    def test_lineage_cache_missing_parent(self):
+
+        taxonomy_tsv = os.path.join(self.tempdir, 'taxonomy.tsv')
+        self.taxonomy_df.to_csv(taxonomy_tsv, sep='\t', index=False)
+        tax_id_arr = numpy.array([7042, 7044])
+        Taxonomy(tsv=taxonomy_tsv, lineage_cache=True)
+        for lineage_cache in [False, True]:
+            taxonomy = Taxonomy(tsv=taxonomy_tsv, lineage_cache=lineage_cache)
+            with self.assertLogs('vtam', level='WARNING') as log:
+                lineage_arr, is_complete_arr = taxonomy.get_tax_id_lineage_arr(tax_id_arr)
+            self.assertEqual(is_complete_arr.tolist(), [True, False])
+            self.assertIn('999999', log.output[0])
+            self.assertEqual(lineage_arr[1, taxonomy.rank_lst.index('genus')], 7044)
+
+    def test_binary_taxonomy(self):
+
+        taxonomy_tsv = os.path.join(self.tempdir, 'taxonomy.tsv')
+        self.taxonomy_df.to_csv(taxonomy_tsv, sep='\t', index=False)
+        taxonomy_tsv_obj = Taxonomy(tsv=taxonomy_tsv)
+        self.assertFalse(Taxonomy.is_binary_up_to_date(taxonomy_tsv))
+
+        taxonomy_tsv_obj.write_binary(Taxonomy.get_binary_dir(taxonomy_tsv))
+        self.assertTrue(Taxonomy.is_binary_up_to_date(taxonomy_tsv))
+        taxonomy = Taxonomy(tsv=taxonomy_tsv)
+        self.assertIsInstance(taxonomy.tax_id_arr, numpy.memmap)
+
+        pandas.testing.assert_frame_equal(taxonomy.df, taxonomy_tsv_obj.df.sort_index())
+        pandas.testing.assert_frame_equal(taxonomy.old_tax_df, taxonomy_tsv_obj.old_tax_df)
+        pandas.testing.assert_frame_equal(taxonomy.get_several_tax_id_lineages([7042, 7000, 7044]),
+                                          taxonomy_tsv_obj.get_several_tax_id_lineages([7042, 7000, 7044]))
+        self.assertEqual(taxonomy.get_name_df([7000, 7043, 424242]).name_txt.tolist(), ['Family2', 'Family2'])
+
+    def test_write_binary_taxonomy(self):
+
+        taxonomy_tsv = os.path.join(self.tempdir, 'taxonomy.tsv')
+        self.taxonomy_df.to_csv(taxonomy_tsv, sep='\t', index=False)
+        CommandTaxonomy(taxonomy_tsv=taxonomy_tsv).write_binary_taxonomy()
+        self.assertTrue(Taxonomy.is_binary_up_to_date(taxonomy_tsv))
+        for npy in Taxonomy.get_lineage_cache_npy(taxonomy_tsv):
+            self.assertTrue(os.path.isfile(npy))
+        taxonomy = Taxonomy(tsv=taxonomy_tsv, lineage_cache=True)
+        self.assertIsInstance(taxonomy.lineage_arr, numpy.memmap)
+        self.assertIsInstance(taxonomy.lineage_complete_arr, numpy.memmap)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tempdir, ignore_errors=True)
@@ -78,7 +78,7 @@ TAS2	IIICBR	S21	1	TAS2-R1_S1_L001_R1_001_000.fasta"""
 
     def test01(self):
 
-        cmd = """wopmars tool vtam.wrapper.FilterCodonStop -D sqlite:///db.sqlite -i \"{'file': {'sortedinfo': 'sortedinfo.tsv', 'params': 'params.yml'}, 'table': {'Marker': 'vtam.models.Marker', 'Run': 'vtam.models.Run', 'Sample': 'vtam.models.Sample', 'FilterIndel': 'vtam.models.FilterIndel', 'Variant': 'vtam.models.Variant'}}\" -o \"{'table': {'FilterCodonStop': 'vtam.models.FilterCodonStop'}}\" -P \"{'genetic_code': 5, 'skip_filter_codon_stop': 0}\""""
+        cmd = """wopmars tool vtam.wrapper.FilterCodonStop -D sqlite:///db.sqlite -i \"{'file': {'sortedinfo': 'sortedinfo.tsv', 'params': 'params.yml'}, 'table': {'Marker': 'vtam.models.Marker', 'Run': 'vtam.models.Run', 'Sample': 'vtam.models.Sample', 'FilterIndel': 'vtam.models.FilterIndel', 'Variant': 'vtam.models.Variant'}}\" -o \"{'table': {'FilterCodonStop': 'vtam.models.FilterCodonStop', 'VariantCodonStop': 'vtam.models.VariantCodonStop'}}\" -P \"{'genetic_code': 5, 'skip_filter_codon_stop': 0}\""""
 
         if sys.platform.startswith("win"):
             args = cmd
@@ -6,6 +6,7 @@ import pandas
 import sqlalchemy
 
 from vtam.utils.Logger import Logger
+from vtam.utils.NameIdConverter import NameIdConverter
 from vtam.utils.VTAMexception import VTAMexception
 
 from vtam.models.Run import Run
@@ -58,49 +59,62 @@ class FileSampleInformation:
 
         variant_read_count_like_table = variant_read_count_like_model.__table__
 
-        variant_read_count_list = []
-        # for sample_instance in self.get_fasta_information_record_list():
-        for sample_instance_row in self.to_identifier_df(
-                engine=engine).itertuples():
-            run_id = sample_instance_row.run_id
-            marker_id = sample_instance_row.marker_id
-            sample_id = sample_instance_row.sample_id
-            replicate = sample_instance_row.replicate
-            stmt_select = sqlalchemy.select(
-                [
-                    variant_read_count_like_table.c.run_id,
-                    variant_read_count_like_table.c.marker_id,
-                    variant_read_count_like_table.c.sample_id,
-                    variant_read_count_like_table.c.replicate,
-                    variant_read_count_like_table.c.variant_id,
-                    variant_read_count_like_table.c.read_count]).distinct() .where(
-                variant_read_count_like_table.c.run_id == run_id).where(
-                variant_read_count_like_table.c.marker_id == marker_id) .where(
-                    variant_read_count_like_table.c.sample_id == sample_id).where(
-                        variant_read_count_like_table.c.replicate == replicate)
-            # Used for filters tables where filter_delete attribute exists
-            if 'filter_delete' in [
-                    column.key for column in variant_read_count_like_table.columns]:
-                stmt_select = stmt_select.where(
-                    variant_read_count_like_table.c.filter_delete == 0)
-            # used for filter lfn where filter_id = 8 is necessary (do not pass
-            # all filters)
-            if filter_id is not None:
-                stmt_select = stmt_select.where(
-                    variant_read_count_like_table.c.filter_id == filter_id)
-            with engine.connect() as conn2:
-                for row in conn2.execute(stmt_select).fetchall():
-                    variant_read_count_list.append(row)
+        ############################################################################################
         #
-        variant_read_count_df = pandas.DataFrame.from_records(
-            variant_read_count_list,
-            columns=[
-                'run_id',
-                'marker_id',
-                'sample_id',
-                'replicate',
-                'variant_id',
-                'read_count'])
+        # The sample keys are written to a temporary table and joined in a single query
+        #
+        ############################################################################################
+
+        sample_key_df = self.to_identifier_df(engine=engine)[['run_id', 'marker_id', 'sample_id', 'replicate']]
+        sample_key_df = sample_key_df.astype('int64').drop_duplicates()
+        sample_key_df['sample_order'] = range(sample_key_df.shape[0])
+
+        sample_key_table = sqlalchemy.Table(
+            'SampleKeyTemporary', sqlalchemy.MetaData(),
+            sqlalchemy.Column('run_id', sqlalchemy.Integer),
+            sqlalchemy.Column('marker_id', sqlalchemy.Integer),
+            sqlalchemy.Column('sample_id', sqlalchemy.Integer),
+            sqlalchemy.Column('replicate', sqlalchemy.Integer),
+            sqlalchemy.Column('sample_order', sqlalchemy.Integer),
+            prefixes=['TEMPORARY'])
+
+        stmt_select = sqlalchemy.select([
+            variant_read_count_like_table.c.run_id,
+            variant_read_count_like_table.c.marker_id,
+            variant_read_count_like_table.c.sample_id,
+            variant_read_count_like_table.c.replicate,
+            variant_read_count_like_table.c.variant_id,
+            variant_read_count_like_table.c.read_count,
+            sample_key_table.c.sample_order]).distinct().select_from(
+            variant_read_count_like_table.join(sample_key_table, sqlalchemy.and_(
+                variant_read_count_like_table.c.run_id == sample_key_table.c.run_id,
+                variant_read_count_like_table.c.marker_id == sample_key_table.c.marker_id,
+                variant_read_count_like_table.c.sample_id == sample_key_table.c.sample_id,
+                variant_read_count_like_table.c.replicate == sample_key_table.c.replicate)))
+        # Used for filters tables where filter_delete attribute exists
+        if 'filter_delete' in [
+                column.key for column in variant_read_count_like_table.columns]:
+            stmt_select = stmt_select.where(
+                variant_read_count_like_table.c.filter_delete == 0)
+        # used for filter lfn where filter_id = 8 is necessary (do not pass
+        # all filters)
+        if filter_id is not None:
+            stmt_select = stmt_select.where(
+                variant_read_count_like_table.c.filter_id == filter_id)
+
+        with engine.connect() as conn:
+            sample_key_table.create(conn, checkfirst=True)
+            try:
+                conn.execute(sample_key_table.delete())
+                conn.execute(sample_key_table.insert(), sample_key_df.to_dict('records'))
+                variant_read_count_df = pandas.read_sql(stmt_select, conn)
+            finally:
+                sample_key_table.drop(conn, checkfirst=True)
+
+        # Rows ordered by sample as in the sample information file
+        variant_read_count_df = variant_read_count_df.sort_values(
+            'sample_order', kind='mergesort').drop('sample_order', axis=1).reset_index(drop=True)
+        variant_read_count_df = variant_read_count_df.astype('int64')
 
         # Exit if no variants for analysis
         try:
@@ -124,40 +138,16 @@ class FileSampleInformation:
 
         """
 
-        sample_info_df = pandas.DataFrame()
-        sample_info_df['run_id'] = None
-        sample_info_df['marker_id'] = None
-        sample_info_df['sample_id'] = None
-        with engine.connect() as conn:
-            for k, row in self.read_tsv_into_df().iterrows():
-                marker_name = row.marker
-                run_name = row.run
-                sample_name = row['sample']  # fixed confusion of sample method and variable
-                replicate = int(row.replicate)
-                # get run_id ###########
-                stmt_select_run_id = sqlalchemy.select(
-                    [Run.__table__.c.id]).where(Run.__table__.c.name == run_name)
-                run_id = conn.execute(stmt_select_run_id).first()[0]
-                # get marker_id ###########
-                stmt_select_marker_id = sqlalchemy.select([Marker.__table__.c.id]).where(
-                    Marker.__table__.c.name == marker_name)
-                marker_id = conn.execute(stmt_select_marker_id).first()[0]
-                # get sample_id ###########
-                stmt_select_sample_id = sqlalchemy.select([Sample.__table__.c.id]).where(
-                    Sample.__table__.c.name == sample_name)
-                sample_id = conn.execute(
-                    stmt_select_sample_id).first()[0]
-                new_row_dic = dict(row)
-                new_row_dic['run_id'] = run_id
-                new_row_dic['marker_id'] = marker_id
-                new_row_dic['sample_id'] = sample_id
-                new_row_dic['replicate'] = replicate
-                del new_row_dic["run"]
-                del new_row_dic["marker"]
-                del new_row_dic["sample"]
-
-                sample_info_df = sample_info_df.append(
-                    pandas.DataFrame(new_row_dic, index=[0]), sort=False)
+        sample_info_df = self.read_tsv_into_df()
+        # Names are resolved in bulk, each distinct name once
+        sample_info_df.insert(0, 'run_id', NameIdConverter(
+            sample_info_df.run.tolist(), engine=engine).to_ids(Run))
+        sample_info_df.insert(1, 'marker_id', NameIdConverter(
+            sample_info_df.marker.tolist(), engine=engine).to_ids(Marker))
+        sample_info_df.insert(2, 'sample_id', NameIdConverter(
+            sample_info_df['sample'].tolist(), engine=engine).to_ids(Sample))
+        sample_info_df['replicate'] = sample_info_df.replicate.astype(int)
+        sample_info_df = sample_info_df.drop(['run', 'marker', 'sample'], axis=1)
 
         sample_info_df.columns = sample_info_df.columns.str.lower()
         return sample_info_df
@@ -1,86 +1,136 @@
+import collections
 import sys
+import weakref
 
+import numpy
 import sqlalchemy
 
 from vtam.models.FilterChimeraBorderline import FilterChimeraBorderline
 from vtam.models.Variant import Variant
 from vtam.utils.Logger import Logger
+from vtam.utils import constants
 
 
 class NameIdConverter:
-    """Takes a list of names or IDs and returns the complementeary"""
+    """Takes a list of names or IDs and returns the complementeary
+
+    Each list is resolved with chunked 'IN (...)' queries. The Run, Marker, Sample and Variant mappings, which are
+    append-only, are kept in a per-engine LRU cache so that repeated conversions in one process do not query the
+    database again. The mappings of a table are cleared when the table is created or dropped, so that a database
+    recreated behind the same engine is queried again."""
+
+    # engine -> (table name, key column, value column) -> OrderedDict key -> value
+    __cache = weakref.WeakKeyDictionary()
+    cache_max_size = 1000000
 
     def __init__(self, id_name_or_sequence_list, engine):
 
         self.id_name_or_sequence_list = id_name_or_sequence_list
         self.engine = engine
 
-    def to_ids(self, declarative_model):
+    @classmethod
+    def clear_cache(cls):
+
+        cls.__cache.clear()
+
+    @classmethod
+    def clear_table_cache(cls, table, connection, **kw):
+        """Clears the mappings of the table in the cache of the engine. Listens to the create and drop table events"""
+
+        cache_dic = cls.__cache.get(connection.engine, {})
+        for cache_key in [cache_key for cache_key in cache_dic if cache_key[0] == table.name]:
+            del cache_dic[cache_key]
+
+    @staticmethod
+    def to_native(key):
+        """Converts numpy scalars to python scalars that can be bound in SQL queries"""
+
+        if isinstance(key, numpy.generic):
+            return key.item()
+        return key
+
+    def select_mapping(self, key_column, value_column, key_lst):
+        """Returns a dictionary key -> value for the keys found in the table, with one query per chunk of keys"""
 
-        id_lst = []
+        mapping_dic = {}
         with self.engine.connect() as conn:
-            for name in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([declarative_model.__table__.c.id]).where(
-                        declarative_model.__table__.c.name == name)).first()
-                if result is None:
-                    Logger.instance().error("Name {} not found in table {}".format(name, str(declarative_model.__table__)))
-                    sys.exit(1)
-                id_lst.append(result[0])
-        return id_lst
+            for i in range(0, len(key_lst), constants.sql_in_chunk_size):
+                stmt_select = sqlalchemy.select([key_column, value_column]).where(
+                    key_column.in_(key_lst[i:i + constants.sql_in_chunk_size]))
+                for key, value in conn.execute(stmt_select):
+                    mapping_dic.setdefault(key, value)
+        return mapping_dic
+
+    def convert(self, key_column, value_column, error_message, cached=True):
+        """Maps self.id_name_or_sequence_list from key_column to value_column values
+
+        :param key_column: SQLAlchemy column of the keys
+        :param value_column: SQLAlchemy column of the values
+        :param error_message: message formatted with the missing key before exiting
+        :param cached: use the per-engine LRU cache, only for append-only tables
+        :return: list of values in the same order as self.id_name_or_sequence_list
+        """
+
+        key_lst = [self.to_native(key) for key in self.id_name_or_sequence_list]
+
+        if cached:
+            cache_key = (key_column.table.name, key_column.key, value_column.key)
+            cache_dic = NameIdConverter.__cache.setdefault(self.engine, {}).setdefault(
+                cache_key, collections.OrderedDict())
+        else:
+            cache_dic = collections.OrderedDict()
+
+        missing_key_lst = [key for key in dict.fromkeys(key_lst) if key not in cache_dic]
+        if len(missing_key_lst) > 0:
+            cache_dic.update(self.select_mapping(key_column, value_column, missing_key_lst))
+
+        value_lst = []
+        for key in key_lst:
+            if key not in cache_dic:
+                Logger.instance().error(error_message.format(key))
+                sys.exit(1)
+            value_lst.append(cache_dic[key])
+
+        if cached:  # Refresh the recently used keys and evict the least recently used ones
+            for key in dict.fromkeys(key_lst):
+                cache_dic.move_to_end(key)
+            while len(cache_dic) > self.cache_max_size:
+                cache_dic.popitem(last=False)
+
+        return value_lst
+
+    def to_ids(self, declarative_model):
+
+        return self.convert(
+            key_column=declarative_model.__table__.c.name, value_column=declarative_model.__table__.c.id,
+            error_message="Name {} not found in table " + str(declarative_model.__table__))
 
     def to_names(self, declarative_model):
 
-        nameid_lst = []
-        with self.engine.connect() as conn:
-            for idx in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([declarative_model.__table__.c.name]).where(
-                        declarative_model.__table__.c.id == idx)).first()
-                if result is None:
-                    Logger.instance().error("Id {} not found in table {}".format(idx, str(declarative_model.__table__)))
-                    sys.exit(1)
-                nameid_lst.append(result[0])
-        return nameid_lst
+        return self.convert(
+            key_column=declarative_model.__table__.c.id, value_column=declarative_model.__table__.c.name,
+            error_message="Id {} not found in table " + str(declarative_model.__table__))
 
     def variant_id_to_sequence(self):
 
-        sequence_lst = []
-        with self.engine.connect() as conn:
-            for variant_id in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([Variant.__table__.c.sequence]).where(
-                        Variant.__table__.c.id == variant_id)).first()
-                if result is None:
-                    Logger.instance().error("Variant ID {} not found in table {}".format(variant_id, str(Variant.__table__)))
-                    sys.exit(1)
-                sequence_lst.append(result[0])
-        return sequence_lst
+        return self.convert(
+            key_column=Variant.__table__.c.id, value_column=Variant.__table__.c.sequence,
+            error_message="Variant ID {} not found in table " + str(Variant.__table__))
 
     def variant_sequence_to_id(self):
 
-        variant_id_lst = []
-        with self.engine.connect() as conn:
-            for sequence in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([Variant.__table__.c.id]).where(
-                        Variant.__table__.c.sequence == sequence)).first()
-                if result is None:
-                    Logger.instance().error("Sequence {} not found in table {}".format(sequence, str(Variant.__table__)))
-                    sys.exit(1)
-                variant_id_lst.append(result[0])
-        return variant_id_lst
+        return self.convert(
+            key_column=Variant.__table__.c.sequence, value_column=Variant.__table__.c.id,
+            error_message="Sequence {} not found in table " + str(Variant.__table__))
 
     def variant_id_is_chimera_borderline(self):
 
-        chimera_borderline_lst = []
-        with self.engine.connect() as conn:
-            for variant_id in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([FilterChimeraBorderline.__table__.c.filter_delete]).where(
-                        FilterChimeraBorderline.__table__.c.variant_id == variant_id).distinct()).first()
-                if result is None:
-                    Logger.instance().error("Variant ID {} not found in table FilterChimeraBorderline".format(variant_id))
-                    sys.exit(1)
-                chimera_borderline_lst.append(result[0])
-        return chimera_borderline_lst
+        # FilterChimeraBorderline is rewritten by each filter run, so it is not cached
+        return self.convert(
+            key_column=FilterChimeraBorderline.__table__.c.variant_id,
+            value_column=FilterChimeraBorderline.__table__.c.filter_delete,
+            error_message="Variant ID {} not found in table FilterChimeraBorderline", cached=False)
+
+
+sqlalchemy.event.listen(sqlalchemy.Table, 'after_create', NameIdConverter.clear_table_cache)
+sqlalchemy.event.listen(sqlalchemy.Table, 'after_drop', NameIdConverter.clear_table_cache)
@@ -1,6 +1,9 @@
 import inspect
+import multiprocessing.pool
+import numpy
 import os
 import pathlib
+import shutil
 import sys
 
 import pandas
@@ -9,14 +12,26 @@ from vtam.utils.VTAMexception import VTAMexception
 from vtam.utils.PathManager import PathManager
 
 from vtam.utils.Logger import Logger
+from vtam.utils.constants import identity_list
+from Bio import SeqIO
 from Bio.Blast.Applications import NcbiblastnCommandline
 
 
 class RunnerBlast(object):
-    """Runs Blast. Used by Taxassign"""
+    """Runs Blast. Used by Taxassign
+
+    blastn threads scale poorly on short queries, so with several threads the query FASTA file is split into chunks
+    that are blasted by concurrent blastn processes with threads_per_chunk threads each."""
+
+    threads_per_chunk = 2
+    # Number of Blast output lines read at once by process_blast_result
+    blast_output_chunk_size = 1000000
 
     def __init__(self, variant_fasta, blast_db_dir, blast_db_name, num_threads,
-            qcov_hsp_perc):
+            qcov_hsp_perc, num_chunks=None):
+        """
+        :param num_chunks: number of concurrent blastn processes. Default num_threads/threads_per_chunk
+        """
 
         self.variant_fasta = variant_fasta
         self.blast_db_dir = blast_db_dir
@@ -26,6 +41,9 @@ class RunnerBlast(object):
         # self.min_number_of_taxa = min_number_of_taxa
         self.num_threads = num_threads
         self.qcov_hsp_perc = qcov_hsp_perc
+        if num_chunks is None:
+            num_chunks = int(num_threads) // self.threads_per_chunk
+        self.num_chunks = max(1, num_chunks)
 
         self.this_temp_dir = os.path.join(PathManager.instance().get_tempdir(),
             os.path.basename(__file__))
@@ -49,14 +67,42 @@ class RunnerBlast(object):
         # get blast db dir and filename prefix from NHR file
         os.environ['BLASTDB'] = self.blast_db_dir
 
+        variant_fasta_lst = self.split_fasta(self.variant_fasta, self.num_chunks, os.path.join(
+            self.this_temp_dir, 'chunk'))
+        if len(variant_fasta_lst) == 1:  # Single blastn process with all the threads
+            self.run_blastn((self.variant_fasta, blast_output_tsv, self.num_threads))
+            return blast_output_tsv
+
+        #######################################################################
+        #
+        # Concurrent blastn processes on the chunks. Outputs are concatenated in the chunk order.
+        #
+        #######################################################################
+
+        num_threads_chunk = max(1, int(self.num_threads) // len(variant_fasta_lst))
+        blast_task_lst = [(variant_fasta_chunk, '{}.tsv'.format(os.path.splitext(variant_fasta_chunk)[0]),
+                           num_threads_chunk) for variant_fasta_chunk in variant_fasta_lst]
+        with multiprocessing.pool.ThreadPool(processes=len(blast_task_lst)) as pool:
+            pool.map(self.run_blastn, blast_task_lst, chunksize=1)
+
+        with open(blast_output_tsv, 'wb') as fout:
+            for blast_task in blast_task_lst:
+                with open(blast_task[1], 'rb') as fin:
+                    shutil.copyfileobj(fin, fout)
+        return blast_output_tsv
+
+    def run_blastn(self, blast_task):
+        """Runs blastn with a (query FASTA, output TSV, number of threads) task"""
+
+        query_fasta, blast_output_tsv, num_threads = blast_task
         blastn_cline = NcbiblastnCommandline(
-            query=self.variant_fasta,
+            query=query_fasta,
             db=self.blast_db_name,
             evalue=1e-5,
             outfmt='"6 qseqid sacc pident evalue qcovhsp staxids"',
             dust='yes',
             qcov_hsp_perc=self.qcov_hsp_perc,
-            num_threads=self.num_threads,
+            num_threads=num_threads,
             out=blast_output_tsv)
         Logger.instance().debug(
             "file: {}; line: {}; {}".format(
@@ -66,47 +112,94 @@ class RunnerBlast(object):
         #
         # Run blast
         stdout, stderr = blastn_cline()
-        return blast_output_tsv
 
     @staticmethod
-    def process_blast_result(blast_output_tsv):
+    def split_fasta(fasta_path, num_chunks, chunk_prefix):
+        """Splits a FASTA file in at most num_chunks consecutive chunks with balanced total sequence lengths
+
+        :param fasta_path: path to the FASTA file
+        :param num_chunks: maximal number of chunks
+        :param chunk_prefix: path prefix of the chunk FASTA files
+        :return: list of paths of the chunk FASTA files in order, or [fasta_path] if there is one chunk
+        """
+
+        if num_chunks <= 1:
+            return [fasta_path]
+        record_lst = list(SeqIO.parse(fasta_path, 'fasta'))
+        num_chunks = min(num_chunks, len(record_lst))
+        if num_chunks <= 1:
+            return [fasta_path]
+
+        # Chunk i starts at the first record whose cumulated length reaches i/num_chunks of the total
+        length_cumsum_arr = numpy.cumsum([len(record) for record in record_lst])
+        start_arr = numpy.searchsorted(
+            length_cumsum_arr, length_cumsum_arr[-1] * numpy.arange(1, num_chunks) / num_chunks, side='left') + 1
+        start_arr = numpy.unique(numpy.concatenate([[0], numpy.minimum(start_arr, len(record_lst)), [len(record_lst)]]))
+
+        chunk_fasta_lst = []
+        for chunk_i, (start, end) in enumerate(zip(start_arr[:-1], start_arr[1:])):
+            chunk_fasta = '{}_{}.fasta'.format(chunk_prefix, chunk_i)
+            with open(chunk_fasta, 'w') as fout:
+                for record in record_lst[start:end]:
+                    fout.write(">{}\n{}\n".format(record.description, str(record.seq)))
+            chunk_fasta_lst.append(chunk_fasta)
+        return chunk_fasta_lst
+
+    @classmethod
+    def process_blast_result(cls, blast_output_tsv):
         """Reads blast_output_tsv and creates a DF that is compatible to the following taxassign. If this DF is empty, vtam will exit with a warning
 
+        The Blast output is read in chunks of blast_output_chunk_size lines. The identity of each hit is lowered to
+        the closest identity in identity_list, which is the identity cutoff used by the LTG selection, and the hits
+        below the lowest one are dropped. The hits are then counted by (variant_id, identity, target_tax_id) in the
+        order of their first appearance.
+
+        Returns
+        -------
+        pandas.DataFrame
+        DF with columns variant_id, identity, target_tax_id, hit_count
+
         """
 
         Logger.instance().debug(
             "file: {}; line: {}; Reading Blast output from: {}".format(
                 __file__, inspect.currentframe().f_lineno, blast_output_tsv))
-        blast_output_df = pandas.read_csv(blast_output_tsv, sep='\t',
-                                          header=None, names=[
-                'variant_id',
-                'target_id',
-                'identity',
-                'evalue',
-                'coverage',
-                'target_tax_id'])
-        # Remove null target tax ids
-        blast_output_df = blast_output_df.loc[~blast_output_df.target_tax_id.isnull()]
-
-        # expand multiple target_tax_ids
-        # first convert as string
-        blast_output_df.target_tax_id = blast_output_df.target_tax_id.astype('str')
-        # split by ';' to keep just one target_tax_id and reassign in DF
-        blast_output_df.target_tax_id = blast_output_df.target_tax_id.str.split(pat=';', n=1,
-                                                                                expand=True)
-        # Convert back to numeric/int
-        blast_output_df.target_tax_id = blast_output_df.target_tax_id.astype('float').astype('int')
-        # blast_output_df = (pandas.concat([
-        #     blast_output_df, blast_output_df.target_tax_id.str.split(pat=';', n=1, expand=True)],
-        #         axis=1))
-        # blast_output_df.drop(['target_tax_id'], axis=1, inplace=true)
+
+        identity_arr = numpy.array(identity_list, dtype='float')
+        blast_output_df_lst = []
+        for blast_output_chunk_df in pandas.read_csv(
+                blast_output_tsv, sep='\t', header=None,
+                names=['variant_id', 'target_id', 'identity', 'evalue', 'coverage', 'target_tax_id'],
+                usecols=['variant_id', 'identity', 'target_tax_id'],
+                dtype={'variant_id': 'str', 'identity': 'float', 'target_tax_id': 'str'},
+                chunksize=cls.blast_output_chunk_size):
+
+            # Keep the first of multiple target_tax_ids, separated by ';'. Remove null target tax ids
+            target_tax_id_sr = pandas.to_numeric(blast_output_chunk_df.target_tax_id, errors='coerce')
+            is_multiple = target_tax_id_sr.isnull() & blast_output_chunk_df.target_tax_id.str.contains(';', na=False)
+            target_tax_id_sr.loc[is_multiple] = pandas.to_numeric(
+                blast_output_chunk_df.target_tax_id.loc[is_multiple].str.split(';', n=1).str[0], errors='coerce')
+
+            # Identity lowered to the identity_list steps
+            step_arr = numpy.searchsorted(-identity_arr, -blast_output_chunk_df.identity.to_numpy(), side='left')
+            is_kept = (~target_tax_id_sr.isnull()).to_numpy() & (step_arr < identity_arr.shape[0])
+
+            blast_output_df_lst.append(pandas.DataFrame({
+                'variant_id': blast_output_chunk_df.variant_id.to_numpy()[is_kept],
+                'identity': numpy.array(identity_list)[step_arr[is_kept]],
+                'target_tax_id': target_tax_id_sr.to_numpy()[is_kept].astype('int'),
+                'hit_count': 1}).groupby(['variant_id', 'identity', 'target_tax_id'], sort=False).hit_count.sum())
+
+        if len(blast_output_df_lst) > 0:
+            blast_output_df = pandas.concat(blast_output_df_lst).groupby(
+                level=['variant_id', 'identity', 'target_tax_id'], sort=False).sum().reset_index()
+        else:
+            blast_output_df = pandas.DataFrame(columns=['variant_id', 'identity', 'target_tax_id', 'hit_count'])
         # Blast output extract
-        """   variant_id  target_id  identity        evalue  coverage  target_tax_id
-0           2  MF7836761    99.429  1.620000e-86       100        1469487
-1           2  MF7836761    99.429  1.620000e-86       100         189839
-2           2  KY2618191    98.857  7.520000e-85       100         189839
-3           2  MF7834791    98.857  7.520000e-85       100         189839
-4           2  KU9559321    98.857  7.520000e-85       100         189839
+        """   variant_id  identity  target_tax_id  hit_count
+0           2        99        1469487          1
+1           2        99         189839          1
+2           2        97         189839          3
 """
 
         if blast_output_df.shape[0] == 0:
@@ -114,4 +207,4 @@ class RunnerBlast(object):
                 VTAMexception("Blast did not find any target. "
                               "VTAM will stop here."))
             sys.exit(0)
-        return blast_output_df
\ No newline at end of file
+        return blast_output_df
@@ -1,4 +1,7 @@
+import multiprocessing
+import multiprocessing.pool
 import os
+import pandas
 import pathlib
 
 from Bio import SeqIO
@@ -17,6 +20,37 @@ class RunnerFilterChimera(object):
 
         self.variant_read_count_df = variant_read_count_df
 
+    @staticmethod
+    def run_uchime3_denovo(uchime_task):
+        """Runs vsearch uchime3_denovo for one sample
+
+        :param uchime_task: dictionary with the FASTA paths of the sample and the uchime3_denovo_abskew parameter
+        :return: tuple with the lists of variant IDs of the chimeras and the borderline variants
+        """
+
+        vsearch_parameters = {'uchime3_denovo': uchime_task['uchime_fasta_path'],
+                              'borderline': uchime_task['uchime_borderline_fasta_path'],
+                              'nonchimeras': uchime_task['uchime_nonchimeras_fasta_path'],
+                              'chimeras': uchime_task['uchime_chimeras_fasta_path'],
+                              'abskew': uchime_task['uchime3_denovo_abskew'],
+                              }
+        vsearch_cluster = RunnerVSearch(parameters=vsearch_parameters)
+        vsearch_cluster.run()
+
+        Logger.instance().debug(
+            "Vsearch uchime chimera tsv_path: {}".format(uchime_task['uchime_chimeras_fasta_path']))
+        with open(uchime_task['uchime_chimeras_fasta_path'], "r") as handle:
+            chimera_variant_id_lst = [int(chimera_seqrecord.id.split(';')[0])
+                                      for chimera_seqrecord in SeqIO.parse(handle, "fasta")]
+
+        Logger.instance().debug("Vsearch uchime chimera borderline tsv_path: {}".format(
+            uchime_task['uchime_borderline_fasta_path']))
+        with open(uchime_task['uchime_borderline_fasta_path'], "r") as handle:
+            borderline_variant_id_lst = [int(chimera_seqrecord.id.split(';')[0])
+                                         for chimera_seqrecord in SeqIO.parse(handle, "fasta")]
+
+        return chimera_variant_id_lst, borderline_variant_id_lst
+
     def get_variant_read_count_delete_df(
             self, variant_df, uchime3_denovo_abskew):
 
@@ -25,11 +59,11 @@ class RunnerFilterChimera(object):
             os.path.basename(__file__))
         pathlib.Path(temp_dir).mkdir(exist_ok=True)
 
-        filter_output_chimera_df = self.variant_read_count_df.copy()
-        filter_output_chimera_df['filter_delete'] = False
-        #
-        filter_output_borderline_df = self.variant_read_count_df.copy()
-        filter_output_borderline_df['filter_delete'] = False
+        # (run_id, marker_id, sample_id, variant_id) keys of the chimeras and borderline variants
+        chimera_key_lst = []
+        borderline_key_lst = []
+        # One uchime3_denovo run per sample
+        uchime_task_lst = []
 
         run_marker_sample_df = self.variant_read_count_df[[
             'run_id', 'marker_id', 'sample_id']].drop_duplicates(inplace=False)
@@ -69,12 +103,6 @@ class RunnerFilterChimera(object):
             variant_df_utils_obj.to_fasta(
                 fasta_path=uchime_fasta_path, add_column="size")
 
-            ###################################################################
-            #
-            # Run uchime_denovo
-            #
-            ###################################################################
-
             uchime_borderline_fasta_path = os.path.join(
                 temp_dir, 'run_{}_marker_{}_sample_{}_borderline.fasta' .format(
                     run_id, marker_id, sample_id))
@@ -85,41 +113,52 @@ class RunnerFilterChimera(object):
                 temp_dir, 'run_{}_marker_{}_sample_{}_chimeras.fasta' .format(
                     run_id, marker_id, sample_id))
 
-            #
-            # Create object and run_name vsearch
-            vsearch_parameters = {'uchime3_denovo': uchime_fasta_path,
-                                  'borderline': uchime_borderline_fasta_path,
-                                  'nonchimeras': uchime_nonchimeras_fasta_path,
-                                  'chimeras': uchime_chimeras_fasta_path,
-                                  'abskew': uchime3_denovo_abskew,
-                                  }
-            vsearch_cluster = RunnerVSearch(parameters=vsearch_parameters)
-            vsearch_cluster.run()
+            uchime_task_lst.append({
+                'run_id': run_id, 'marker_id': marker_id, 'sample_id': sample_id,
+                'uchime_fasta_path': uchime_fasta_path,
+                'uchime_borderline_fasta_path': uchime_borderline_fasta_path,
+                'uchime_nonchimeras_fasta_path': uchime_nonchimeras_fasta_path,
+                'uchime_chimeras_fasta_path': uchime_chimeras_fasta_path,
+                'uchime3_denovo_abskew': uchime3_denovo_abskew})
 
-            ###################################################################
-            #
-            # 4. Delete variant from replicate/sample if chimeras
-            #
-            ###################################################################
+        ###################################################################
+        #
+        # 4. Run the samples in a bounded pool of threads, each waiting for its vsearch process.
+        # The results come back in the sample order.
+        #
+        ###################################################################
+
+        if os.getenv('VTAM_THREADS') is None:
+            num_threads = multiprocessing.cpu_count()
+        else:
+            num_threads = int(os.getenv('VTAM_THREADS'))
+        num_threads = max(1, min(num_threads, len(uchime_task_lst)))
+
+        if num_threads > 1:
+            with multiprocessing.pool.ThreadPool(processes=num_threads) as pool:
+                uchime_result_lst = pool.map(self.run_uchime3_denovo, uchime_task_lst, chunksize=1)
+        else:
+            uchime_result_lst = [self.run_uchime3_denovo(uchime_task) for uchime_task in uchime_task_lst]
+
+        for uchime_task, (chimera_variant_id_lst, borderline_variant_id_lst) in zip(
+                uchime_task_lst, uchime_result_lst):
+            sample_key = (uchime_task['run_id'], uchime_task['marker_id'], uchime_task['sample_id'])
+            chimera_key_lst += [sample_key + (variant_id,) for variant_id in chimera_variant_id_lst]
+            borderline_key_lst += [sample_key + (variant_id,) for variant_id in borderline_variant_id_lst]
+
+        ###################################################################
+        #
+        # 5. Mark the chimera and borderline keys in one pass
+        #
+        ###################################################################
+
+        variant_read_count_key_index = pandas.MultiIndex.from_frame(
+            self.variant_read_count_df[['run_id', 'marker_id', 'sample_id', 'variant_id']])
 
-            Logger.instance().debug(
-                "Vsearch uchime chimera tsv_path: {}".format(uchime_chimeras_fasta_path))
-            with open(uchime_chimeras_fasta_path, "r") as handle:
-                for chimera_seqrecord in SeqIO.parse(handle, "fasta"):
-                    variant_id = int(chimera_seqrecord.id.split(';')[0])
-                    filter_output_chimera_df.loc[(filter_output_chimera_df['run_id'] == run_id)
-                                                 & (filter_output_chimera_df['marker_id'] == marker_id)
-                                                 & (filter_output_chimera_df['sample_id'] == sample_id)
-                                                 & (filter_output_chimera_df['variant_id'] == variant_id), 'filter_delete'] = True
-
-            Logger.instance().debug("Vsearch uchime chimera borderline tsv_path: {}".format(
-                uchime_borderline_fasta_path))
-            with open(uchime_borderline_fasta_path, "r") as handle:
-                for chimera_seqrecord in SeqIO.parse(handle, "fasta"):
-                    variant_id = int(chimera_seqrecord.id.split(';')[0])
-                    filter_output_borderline_df.loc[(filter_output_borderline_df['run_id'] == run_id)
-                                                    & (filter_output_borderline_df['marker_id'] == marker_id)
-                                                    & (filter_output_borderline_df['sample_id'] == sample_id)
-                                                    & (filter_output_borderline_df['variant_id'] == variant_id), 'filter_delete'] = True
+        filter_output_chimera_df = self.variant_read_count_df.copy()
+        filter_output_chimera_df['filter_delete'] = variant_read_count_key_index.isin(chimera_key_lst)
+        #
+        filter_output_borderline_df = self.variant_read_count_df.copy()
+        filter_output_borderline_df['filter_delete'] = variant_read_count_key_index.isin(borderline_key_lst)
 
         return filter_output_chimera_df, filter_output_borderline_df
@@ -1,8 +1,17 @@
 import Bio
+import numpy
+import sqlalchemy
+
+from sqlalchemy.exc import IntegrityError
+
+from vtam.utils import constants
 
 
 class RunnerFilterCodonStop(object):
 
+    # Number of sequences encoded at once by the stop codon scanner, so that its matrices stay in the CPU cache
+    scan_chunk_size = 2000
+
     def __init__(self, variant_read_count_df):
         """Carries out a chimera analysis"""
         self.variant_read_count_df = variant_read_count_df
@@ -12,15 +21,30 @@ class RunnerFilterCodonStop(object):
             self,
             variant_df,
             genetic_code,
-            skip_filter_codon_stop):
+            skip_filter_codon_stop,
+            engine=None,
+            variant_codon_stop_model=None):
+        """
+        :param variant_df: DataFrame (id, sequence) with the variant IDs as index
+        :param genetic_code: NCBI genetic code
+        :param skip_filter_codon_stop: returns all the variants if True
+        :param engine: SQLAlchemy engine of the database with the VariantCodonStop cache table, or None to scan all
+        the variants
+        :param variant_codon_stop_model: SQLAlchemy model of the VariantCodonStop cache table
+        :return: DataFrame (run_id, marker_id, sample_id, replicate, variant_id, read_count, filter_delete)
+        """
 
         variant_read_count_delete_df = self.variant_read_count_df.copy()
         variant_read_count_delete_df['filter_delete'] = False
 
         if not skip_filter_codon_stop:
 
-            variant_has_stop_codon_df = self.annotate_stop_codon_count(
-                variant_df, genetic_code)
+            if engine is None or variant_codon_stop_model is None:
+                variant_has_stop_codon_df = self.annotate_stop_codon_count(
+                    variant_df, genetic_code)
+            else:
+                variant_has_stop_codon_df = self.annotate_stop_codon_count_cached(
+                    variant_df, genetic_code, engine, variant_codon_stop_model)
             variants_with_stop_codons_list = variant_has_stop_codon_df.index[variant_has_stop_codon_df['has_stop_codon'] == 1].tolist(
             )
 
@@ -43,20 +67,144 @@ class RunnerFilterCodonStop(object):
         variant_df['sequence'] = variant_df['sequence'].str.upper()
 
         variant_has_stop_codon_df = variant_df.copy()
-        variant_has_stop_codon_df['has_stop_codon'] = 0
-
-        for row in variant_df.iterrows():
-            id = row[0]
-            sequence = row[1].sequence
-            #
-            variant_has_stop_codon_frame1 = self.seq_has_codon_stop(sequence=sequence, frame=1, genetic_code=genetic_code)
-            variant_has_stop_codon_frame2 = self.seq_has_codon_stop(sequence=sequence, frame=2, genetic_code=genetic_code)
-            variant_has_stop_codon_frame3 = self.seq_has_codon_stop(sequence=sequence, frame=3, genetic_code=genetic_code)
-
-            # Check if all frames have stop codons
-            if variant_has_stop_codon_frame1 and variant_has_stop_codon_frame2 and variant_has_stop_codon_frame3:
-                variant_has_stop_codon_df.loc[variant_has_stop_codon_df.index ==
-                                              id, 'has_stop_codon'] = 1
+
+        # Check if all frames have stop codons
+        variant_has_stop_codon_df['has_stop_codon'] = self.get_frame_has_stop_codon_2d(
+            variant_df.sequence.tolist(), genetic_code).all(axis=1).astype(int)
+
+        return variant_has_stop_codon_df
+
+    @classmethod
+    def get_frame_has_stop_codon_2d(cls, sequence_lst, genetic_code):
+        """Takes upper case sequences and returns whether they have stop codons in each open reading frame
+
+        The sequences are encoded, by chunks, in a padded uint8 matrix of nucleotide codes (A, C, G, T/U) = (0, 1, 2, 3)
+        and 4 for other letters and padding. Each codon is a 6-bit integer looked up in the stop codons of the genetic
+        code. Codons with other letters or overlapping the end of the sequence are never stop codons.
+
+        Parameters
+        ----------
+        sequence_lst: list
+            DNA sequences in upper case
+        genetic_code : int
+            NCBI genetic_codes: https://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array with one row per sequence and one column per open reading frame 1,2,3
+
+        """
+
+        # Translation table of the ASCII letters to the nucleotide codes
+        nucleotide_code_table = bytearray([4] * 256)
+        for nucleotide_code, nucleotide_lst in enumerate(['A', 'C', 'G', 'TU']):
+            for nucleotide in nucleotide_lst:
+                nucleotide_code_table[ord(nucleotide)] = nucleotide_code
+        nucleotide_code_table = bytes(nucleotide_code_table)
+
+        stop_codon_code_set = set()
+        for stop_codon in Bio.Data.CodonTable.generic_by_id[genetic_code].__dict__['stop_codons']:
+            codon_code_lst = stop_codon.encode('ascii').translate(nucleotide_code_table)
+            if max(codon_code_lst) < 4:
+                stop_codon_code_set.add((codon_code_lst[0] << 4) | (codon_code_lst[1] << 2) | codon_code_lst[2])
+
+        frame_has_stop_codon_2d = numpy.zeros((len(sequence_lst), 3), dtype='bool')
+
+        for chunk_start in range(0, len(sequence_lst), cls.scan_chunk_size):
+            sequence_chunk_lst = sequence_lst[chunk_start:chunk_start + cls.scan_chunk_size]
+            length_arr = numpy.array([len(sequence) for sequence in sequence_chunk_lst], dtype='int64')
+            length_max = max(int(length_arr.max()), 3)
+
+            nucleotide_code_bytes = ''.join(sequence_chunk_lst).encode('ascii', errors='replace').translate(
+                nucleotide_code_table)
+            if (length_arr == length_max).all():
+                nucleotide_2d = numpy.frombuffer(nucleotide_code_bytes, dtype='uint8').reshape(
+                    len(sequence_chunk_lst), length_max)
+            else:
+                nucleotide_2d = numpy.full((len(sequence_chunk_lst), length_max), 4, dtype='uint8')
+                nucleotide_2d[numpy.arange(length_max) < length_arr[:, None]] = numpy.frombuffer(
+                    nucleotide_code_bytes, dtype='uint8')
+
+            first_2d, second_2d, third_2d = nucleotide_2d[:, :-2], nucleotide_2d[:, 1:-1], nucleotide_2d[:, 2:]
+            if (length_arr == length_max).all() and nucleotide_code_bytes.count(4) == 0:
+                codon_2d = (first_2d << 4) | (second_2d << 2) | third_2d
+                is_valid_codon_2d = None
+            else:
+                codon_2d = ((first_2d & 3) << 4) | ((second_2d & 3) << 2) | (third_2d & 3)
+                # Bit 2 is set if one of the nucleotides is not A, C, G, T or is padding
+                is_valid_codon_2d = (first_2d | second_2d | third_2d) < 4
+
+            is_stop_codon_2d = numpy.zeros(codon_2d.shape, dtype='bool')
+            for stop_codon_code in stop_codon_code_set:
+                is_stop_codon_2d |= codon_2d == stop_codon_code
+            if is_valid_codon_2d is not None:
+                is_stop_codon_2d &= is_valid_codon_2d
+
+            for frame in range(3):
+                frame_has_stop_codon_2d[chunk_start:chunk_start + len(sequence_chunk_lst), frame] = \
+                    is_stop_codon_2d[:, frame::3].any(axis=1)
+
+        return frame_has_stop_codon_2d
+
+    @staticmethod
+    def select_has_stop_codon_dic(conn, variant_codon_stop_table, genetic_code, variant_id_lst):
+        """Returns a dictionary variant_id -> has_stop_codon of the variants cached for this genetic code"""
+
+        has_stop_codon_dic = {}
+        for i in range(0, len(variant_id_lst), constants.sql_in_chunk_size):
+            stmt_select = sqlalchemy.select([
+                variant_codon_stop_table.c.variant_id, variant_codon_stop_table.c.has_stop_codon]).where(
+                variant_codon_stop_table.c.genetic_code == genetic_code).where(
+                variant_codon_stop_table.c.variant_id.in_(variant_id_lst[i:i + constants.sql_in_chunk_size]))
+            for variant_id, has_stop_codon in conn.execute(stmt_select):
+                has_stop_codon_dic[variant_id] = int(has_stop_codon)
+        return has_stop_codon_dic
+
+    def annotate_stop_codon_count_cached(self, variant_df, genetic_code, engine, variant_codon_stop_model):
+        """Same as annotate_stop_codon_count but only the variants not in the VariantCodonStop table for this genetic
+        code are scanned and then added to this table. Variants are append-only, so cached results stay valid.
+
+        Returns
+        -------
+        pandas DF
+            Columns are id, sequence, has_stop_codon"""
+
+        variant_codon_stop_table = variant_codon_stop_model.__table__
+
+        variant_id_lst = [int(variant_id) for variant_id in variant_df.index]
+        with engine.connect() as conn:
+            has_stop_codon_dic = self.select_has_stop_codon_dic(
+                conn, variant_codon_stop_table, genetic_code, variant_id_lst)
+
+        is_cached = variant_df.index.isin(list(has_stop_codon_dic.keys()))
+        variant_new_has_stop_codon_df = self.annotate_stop_codon_count(variant_df.loc[~is_cached].copy(), genetic_code)
+
+        if variant_new_has_stop_codon_df.shape[0] > 0:
+            record_lst = [{'variant_id': int(variant_id), 'genetic_code': genetic_code,
+                           'has_stop_codon': bool(has_stop_codon)} for variant_id, has_stop_codon in zip(
+                variant_new_has_stop_codon_df.index, variant_new_has_stop_codon_df.has_stop_codon)]
+            with engine.connect() as conn:
+                # Concurrent runs on the same database may have cached the same variants in the meantime
+                cached_variant_id_set = set(self.select_has_stop_codon_dic(
+                    conn, variant_codon_stop_table, genetic_code, [record['variant_id'] for record in record_lst]))
+                record_lst = [record for record in record_lst if record['variant_id'] not in cached_variant_id_set]
+                if len(record_lst) > 0:
+                    try:
+                        conn.execute(variant_codon_stop_table.insert(), record_lst)
+                    except IntegrityError:  # Cached between the select and the insert
+                        for record in record_lst:
+                            try:
+                                conn.execute(variant_codon_stop_table.insert(), record)
+                            except IntegrityError:
+                                pass
+
+        variant_has_stop_codon_df = variant_df.copy()
+        variant_has_stop_codon_df['sequence'] = variant_has_stop_codon_df['sequence'].str.upper()
+        variant_has_stop_codon_df['has_stop_codon'] = [has_stop_codon_dic.get(int(variant_id), 0)
+                                                       for variant_id in variant_df.index]
+        variant_has_stop_codon_df.loc[variant_new_has_stop_codon_df.index, 'has_stop_codon'] = \
+            variant_new_has_stop_codon_df.has_stop_codon
         return variant_has_stop_codon_df
 
     def seq_has_codon_stop(self, sequence, frame, genetic_code):
@@ -17,20 +17,14 @@ class RunnerFilterIndel:
 
         else:
 
-            variant_read_count_delete_df = self.variant_read_count_df.copy()
-            variant_read_count_delete_df['filter_delete'] = False
-            #
-            df = variant_df.copy()
-            df['sequence_length_module_3'] = variant_df.sequence.apply(
-                lambda x: len(x) % 3)  # compute module for each variant
-            #  most common remaining of modulo 3
-            majority_sequence_length_module_3 = df.sequence_length_module_3.mode()
-            # select id of variant that do not pass on a list
-            df = df.loc[df['sequence_length_module_3'] !=
-                        majority_sequence_length_module_3.values[0]]
+            sequence_length_module_3 = variant_df.sequence.str.len() % 3  # compute module for each variant
+            #  most common remaining of modulo 3
+            majority_sequence_length_module_3 = sequence_length_module_3.mode()
+            # select id of variant that do not pass
+            variant_indel_id_lst = variant_df.index[(
+                sequence_length_module_3 != majority_sequence_length_module_3.values[0]).to_numpy()]
             #
-            for id in df.index.tolist():
-                variant_read_count_delete_df.loc[variant_read_count_delete_df['variant_id']
-                                                 == id, 'filter_delete'] = True
+            variant_read_count_delete_df['filter_delete'] = variant_read_count_delete_df.variant_id.isin(
+                variant_indel_id_lst)
 
         return variant_read_count_delete_df
@@ -17,47 +17,72 @@ vtam/discussion_reda_aitor/example_filter.ods
 """
 import sys
 
+import numpy
 import pandas
 
 from vtam.utils.Logger import Logger
 from vtam.utils.VTAMexception import VTAMexception
-from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
 
 
 class RunnerFilterLFN:
+    """Runs the LFN filters on the variant read counts
+
+    The read counts are kept as NumPy arrays in the input row order. Each filter is stored as a boolean deletion
+    mask over these rows (or over a subset of them for the specific cutoffs) and the long table with the filter_id
+    and filter_delete columns is only built when it is read or streamed to the database."""
+
+    # Number of rows of each DataFrame yielded by iter_variant_read_count_filter_delete_df
+    output_chunk_size = 500000
 
     def __init__(self, variant_read_count_df):
         self.variant_read_count_df = variant_read_count_df[[
             'marker_id', 'run_id', 'variant_id', 'sample_id', 'replicate', 'read_count']]
-        #  Instance for all the calculations N_i, N_ij, etc
-        self.variant_read_count_lfn_df = DataframeVariantReadCountLike(
-            variant_read_count_df)
         #
         if self.variant_read_count_df.shape[1] != 6:
             raise Exception(
                 'VariantReadCountLikeModel missing in the variant2sample2replicate2count data frame!')
 
+        self.column_arr_dic = {column: self.variant_read_count_df[column].to_numpy()
+                               for column in self.variant_read_count_df.columns}
+        self.read_count_arr = self.column_arr_dic['read_count']
+
+        #  Row index of each group of N_i, N_ik, N_jk, computed once
+        self.group_index_dic = {}
+
         #######################################################################
         #
-        #  Output variant_read_count_input_df with deleted variants
+        #  Output: list of (filter_id, row indices or None for all rows, deletion mask)
         #
         ################################
 
-        self.variant_read_count_filter_delete_df = pandas.DataFrame(
-            data={
-                'run_id': [],
-                'marker_id': [],
-                'sample_id': [],
-                'variant_id': [],
-                'replicate': [],
-                'read_count': [],
-                'filter_id': [],
-                'filter_delete': []},
-            dtype='uint32')
+        self.filter_mask_lst = []
+
+    def get_group_index(self, lfn_denominator):
+        """Returns the group index of each row for the 'N_i', 'N_ik' or 'N_jk' denominator"""
+
+        if not (lfn_denominator in self.group_index_dic):
+            group_column_lst = {
+                'N_i': ['run_id', 'marker_id', 'variant_id'],
+                'N_ik': ['run_id', 'marker_id', 'variant_id', 'replicate'],
+                'N_jk': ['run_id', 'marker_id', 'sample_id', 'replicate']}[lfn_denominator]
+            self.group_index_dic[lfn_denominator] = self.variant_read_count_df.groupby(
+                group_column_lst, sort=False).ngroup().to_numpy()
+        return self.group_index_dic[lfn_denominator]
 
     def get_variant_read_count_delete_df(self, lfn_variant_cutoff, lfn_variant_specific_cutoff, lfn_variant_replicate_cutoff, lfn_variant_replicate_specific_cutoff,
                                          lfn_sample_replicate_cutoff, lfn_read_count_cutoff):
 
+        self.mark_delete_lfn_all_filters(
+            lfn_variant_cutoff=lfn_variant_cutoff, lfn_variant_specific_cutoff=lfn_variant_specific_cutoff,
+            lfn_variant_replicate_cutoff=lfn_variant_replicate_cutoff,
+            lfn_variant_replicate_specific_cutoff=lfn_variant_replicate_specific_cutoff,
+            lfn_sample_replicate_cutoff=lfn_sample_replicate_cutoff, lfn_read_count_cutoff=lfn_read_count_cutoff)
+
+        return self.variant_read_count_filter_delete_df
+
+    def mark_delete_lfn_all_filters(self, lfn_variant_cutoff, lfn_variant_specific_cutoff, lfn_variant_replicate_cutoff, lfn_variant_replicate_specific_cutoff,
+                                    lfn_sample_replicate_cutoff, lfn_read_count_cutoff):
+
         ############################################################################################
         #
         # Filter 2: f2_f4_lfn_delete_variant
@@ -97,8 +122,6 @@ class RunnerFilterLFN:
 
         self.mark_delete_lfn_do_not_pass_all_filters()
 
-        return self.variant_read_count_filter_delete_df
-
     def mark_delete_lfn_per_Ni_or_Nik_or_Njk(self, lfn_denominator, cutoff, cutoff_specific_df=None,):
 
         """
@@ -107,86 +130,44 @@ class RunnerFilterLFN:
         :param cutoff: float with general cutoff
         :param cutoff_specific_df: DataFrame with either variant-specific (N_i) or variant-replicate-specific
         deletion cutoff
-        :return: None: The output of this filter is added to the 'self.variant_read_count_filter_delete_df'
+        :return: None: The deletion mask of this filter is added to 'self.filter_mask_lst'
             with filter_id=2 and 'filter_delete'=1 or 0 (General cutoff)
             and with filter_id=4 and 'filter_delete'=1 or 0 (Variant-specific cutoff)
         """
 
-        if not (cutoff_specific_df is None):
-            cutoff_specific_df.drop(['variant_sequence'], axis=1, inplace=True)
-
         if lfn_denominator == 'N_i':  # variant
             this_filter_id = 2
-            N_df = self.variant_read_count_lfn_df.get_N_i_df()  #  Compute N_i_df
-            filter_df = self.variant_read_count_df.merge(N_df, on=['run_id', 'marker_id', 'variant_id'])
-            filter_df['filter_id'] = this_filter_id
-            filter_df['cutoff'] = cutoff
-
-            filter_cutoff_specific_df = None
-            if not (cutoff_specific_df is None):
-                this_filter_id = 4
-                filter_cutoff_specific_df = filter_df.copy()
-                filter_cutoff_specific_df.drop('cutoff', axis=1, inplace=True)
-                filter_cutoff_specific_df = filter_cutoff_specific_df.merge(cutoff_specific_df,
-                                                on=['run_id', 'marker_id', 'variant_id'])
-                filter_cutoff_specific_df['filter_id'] = this_filter_id
-
-            filter_df = pandas.concat([filter_df, filter_cutoff_specific_df], axis=0)
-            filter_df['lfn_ratio'] = filter_df.read_count / filter_df.N_i
-
+            specific_filter_id = 4
+            specific_column_lst = ['run_id', 'marker_id', 'variant_id']
         elif lfn_denominator == 'N_ik':  # variant_replicate
             this_filter_id = 3
-            N_df = self.variant_read_count_lfn_df.get_N_ik_df()  #  Compute N_ik_df
-            filter_df = self.variant_read_count_df.merge(
-                N_df, on=['run_id', 'marker_id', 'variant_id', 'replicate'])
-            filter_df['lfn_ratio'] = filter_df.read_count / filter_df.N_ik
-            filter_df['filter_id'] = this_filter_id
-            filter_df['cutoff'] = cutoff
-
-            filter_cutoff_specific_df = None
-            if not (cutoff_specific_df is None):
-                this_filter_id = 5
-                filter_cutoff_specific_df = filter_df.copy()
-                filter_cutoff_specific_df.drop('cutoff', axis=1, inplace=True)
-                filter_cutoff_specific_df = filter_cutoff_specific_df.merge(cutoff_specific_df,
-                                                on=['run_id', 'marker_id', 'variant_id', 'replicate'])
-                filter_cutoff_specific_df['filter_id'] = this_filter_id
-
-            filter_df = pandas.concat([filter_df, filter_cutoff_specific_df], axis=0)
-            filter_df['lfn_ratio'] = filter_df.read_count / filter_df.N_ik
-
+            specific_filter_id = 5
+            specific_column_lst = ['run_id', 'marker_id', 'variant_id', 'replicate']
         elif lfn_denominator == 'N_jk':  # sample_replicate
             this_filter_id = 6
-            N_df = self.variant_read_count_lfn_df.get_N_jk_df()  #  Compute N_jk_df
-            filter_df = self.variant_read_count_df.merge(
-                N_df, left_on=[
-                    'run_id', 'marker_id', 'sample_id', 'replicate'], right_on=[
-                    'run_id', 'marker_id', 'sample_id', 'replicate'])
-            filter_df['lfn_ratio'] = filter_df.read_count / filter_df.N_jk
-            filter_df['filter_id'] = this_filter_id
-            filter_df['cutoff'] = cutoff
-
+            specific_filter_id = None
+            specific_column_lst = None
         else:
             Logger.instance().critical(VTAMexception("Internal error. VTAM will exit."))
             sys.exit(1)
 
-        # Initialize filter: Keep everything
-        filter_df['filter_delete'] = False
-
-        # Mark for deletion all variants with read_count=0
-        filter_df.loc[filter_df.read_count == 0, 'filter_delete'] = True
-
-        # Mark for deletion all filters with 'lfn_ratio'<=lfn_variant_cutoff
-        filter_df.loc[filter_df['lfn_ratio'] <= filter_df['cutoff'], 'filter_delete'] = True
+        #  N_i, N_ik or N_jk of each row
+        group_index_arr = self.get_group_index(lfn_denominator)
+        N_arr = numpy.bincount(group_index_arr, weights=self.read_count_arr)[group_index_arr]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            lfn_ratio_arr = self.read_count_arr / N_arr
 
-        #  Keep important columns
-        filter_df = filter_df[['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id',
-                               'read_count', 'filter_id', 'filter_delete']]
+        # Mark for deletion all variants with read_count=0 and with 'lfn_ratio'<=cutoff
+        read_count_zero_arr = self.read_count_arr == 0
+        self.filter_mask_lst.append((this_filter_id, None, read_count_zero_arr | (lfn_ratio_arr <= cutoff)))
 
-        # Prepare output variant_read_count_input_df and concatenate vertically output variant_read_count_input_df
-        # to self.variant_read_count_filter_delete_df
-        self.variant_read_count_filter_delete_df = pandas.concat(
-            [self.variant_read_count_filter_delete_df, filter_df], sort=False, axis=0)
+        if not (cutoff_specific_df is None) and not (specific_filter_id is None):
+            cutoff_specific_arr = self.variant_read_count_df[specific_column_lst].merge(
+                cutoff_specific_df[specific_column_lst + ['cutoff']].drop_duplicates(specific_column_lst),
+                on=specific_column_lst, how='left').cutoff.to_numpy(dtype='float64')
+            row_arr = numpy.flatnonzero(~numpy.isnan(cutoff_specific_arr))
+            self.filter_mask_lst.append((specific_filter_id, row_arr, read_count_zero_arr[row_arr] | (
+                lfn_ratio_arr[row_arr] <= cutoff_specific_arr[row_arr])))
 
     def mark_delete_lfn_absolute_read_count(self, lfn_read_count_cutoff):
         """
@@ -218,83 +199,57 @@ class RunnerFilterLFN:
 
 
         Returns:
-           None: The output of this filter is added to the 'self.variant_read_count_filter_delete_df'
+           None: The deletion mask of this filter is added to 'self.filter_mask_lst'
            with filter_id='mark_delete_lfn_absolute_read_count' and 'filter_delete'= 1 or 0
 
         """
         this_filter_id = 7
-        # Selecting all the indexes where the ratio is below the minimal
-        # readcount
-        filter_df = self.variant_read_count_df.copy()
-
-        # do_not_pass_variant_id_list = self.variant_read_count_input_df.loc[
-        #     self.variant_read_count_input_df['read_count'] < lfn_nijk_cutoff].variant_id.tolist()
-        # do_not_pass_replicate_list = self.variant_read_count_input_df.loc[
-        # self.variant_read_count_input_df['read_count'] <
-        # lfn_nijk_cutoff].replicate.tolist()
-
-        filter_df['filter_id'] = this_filter_id  #  set this filter
-        filter_df['filter_delete'] = False
-
-        filter_df.loc[filter_df.read_count <
-                      lfn_read_count_cutoff, 'filter_delete'] = True
-        filter_df = filter_df[['run_id',
-                               'marker_id',
-                               'variant_id',
-                               'sample_id',
-                               'replicate',
-                               'read_count',
-                               'filter_id',
-                               'filter_delete']]
-        #
-        # Concatenate vertically output variant_read_count_input_df
-        #  Prepare output variant_read_count_input_df and concatenate to
-        # self.variant_read_count_filter_delete_df
-
-        self.variant_read_count_filter_delete_df = pandas.concat(
-            [self.variant_read_count_filter_delete_df, filter_df], sort=False)
+        # Selecting all the indexes where the read count is below the minimal readcount
+        self.filter_mask_lst.append((this_filter_id, None, self.read_count_arr < lfn_read_count_cutoff))
 
     def mark_delete_lfn_do_not_pass_all_filters(self):
         this_filter_id = 8
-        # Calculating the total of reads by variant
-        filter_df = self.variant_read_count_filter_delete_df[['run_id',
-                                                              'marker_id',
-                                                              'variant_id',
-                                                              'sample_id',
-                                                              'replicate',
-                                                              'filter_delete']].groupby(['run_id',
-                                                                                         'marker_id',
-                                                                                         'variant_id',
-                                                                                         'sample_id',
-                                                                                         'replicate']).agg({'filter_delete': sum})
-        filter_df = filter_df.rename(
-            columns={'filter_delete': 'filter_delete_aggregate'})
-
-        # Merge the column with the total reads by sample replicates for
-        # calculate the ratio
-        filter_df = self.variant_read_count_df.merge(
-            filter_df, left_on=[
-                'run_id', 'marker_id', 'variant_id', 'sample_id', 'replicate'], right_on=[
-                'run_id', 'marker_id', 'variant_id', 'sample_id', 'replicate'])
-        #
-        # Initialize
-        filter_df['filter_id'] = this_filter_id
-        filter_df['filter_delete'] = False
-        #
-        #
-        # Selecting all the indexes where the ratio is below the ratio
-        filter_df.loc[
-            filter_df.filter_delete_aggregate > 0, 'filter_delete'] = True
-        #
-        # Let only interest columns
-        filter_df = filter_df[['run_id',
-                               'marker_id',
-                               'variant_id',
-                               'sample_id',
-                               'replicate',
-                               'read_count',
-                               'filter_id',
-                               'filter_delete']]
-        #
-        self.variant_read_count_filter_delete_df = pandas.concat(
-            [self.variant_read_count_filter_delete_df, filter_df], sort=False)
+        # Deleted if deleted by at least one of the previous filters
+        filter_delete_arr = numpy.zeros(self.read_count_arr.shape[0], dtype='bool')
+        for filter_id, row_arr, filter_delete_i_arr in self.filter_mask_lst:
+            if row_arr is None:
+                filter_delete_arr |= filter_delete_i_arr
+            else:
+                filter_delete_arr[row_arr] |= filter_delete_i_arr
+        self.filter_mask_lst.append((this_filter_id, None, filter_delete_arr))
+
+    def iter_variant_read_count_filter_delete_df(self, chunk_size=None):
+        """Yields the rows of the output of the filters with at most chunk_size rows per DataFrame
+
+        :param chunk_size: int, defaults to RunnerFilterLFN.output_chunk_size
+        :return: generator of DataFrames with columns run_id, marker_id, sample_id, replicate, variant_id,
+            read_count, filter_id, filter_delete
+        """
+
+        if chunk_size is None:
+            chunk_size = self.output_chunk_size
+
+        for filter_id, row_arr, filter_delete_arr in self.filter_mask_lst:
+            filter_row_count = self.read_count_arr.shape[0] if row_arr is None else row_arr.shape[0]
+            for start in range(0, filter_row_count, chunk_size):
+                chunk_row_arr = numpy.arange(start, min(start + chunk_size, filter_row_count)) if row_arr is None \
+                    else row_arr[start:start + chunk_size]
+                chunk_df = pandas.DataFrame({
+                    column: self.column_arr_dic[column][chunk_row_arr] for column in [
+                        'run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count']})
+                chunk_df['filter_id'] = filter_id
+                chunk_df['filter_delete'] = filter_delete_arr[start:start + chunk_size]
+                yield chunk_df
+
+    @property
+    def variant_read_count_filter_delete_df(self):
+        """Output of the filters with columns run_id, marker_id, sample_id, replicate, variant_id, read_count,
+        filter_id, filter_delete"""
+
+        chunk_df_lst = list(self.iter_variant_read_count_filter_delete_df(
+            chunk_size=max(self.read_count_arr.shape[0], 1)))
+        if len(chunk_df_lst) == 0:
+            return pandas.DataFrame(
+                data={'run_id': [], 'marker_id': [], 'sample_id': [], 'replicate': [], 'variant_id': [],
+                      'read_count': [], 'filter_id': [], 'filter_delete': []}, dtype='uint32')
+        return pandas.concat(chunk_df_lst, axis=0, ignore_index=True)
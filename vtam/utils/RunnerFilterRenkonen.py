@@ -1,4 +1,4 @@
-import itertools
+import numpy
 import pandas
 
 
@@ -14,9 +14,14 @@ class RunnerFilterRenkonen(object):
         self.variant_read_count_df = variant_read_count_df
 
     def get_variant_read_count_delete_df(self, renkonen_distance_quantile):
+        """Marks the replicates with more than half of their renkonen distances above the quantile cutoff
+
+        :param renkonen_distance_quantile: quantile of all the renkonen distances used as cutoff
+        :return: DataFrame (run_id, marker_id, sample_id, replicate, variant_id, read_count, filter_delete)
+        """
 
         filter_out_df = self.variant_read_count_df.copy()
-        filter_out_df['filter_delete'] = False
+        sample_column_lst = ['run_id', 'marker_id', 'sample_id']
 
         nb_of_replicates_df = self.variant_read_count_df[['run_id', 'marker_id', 'sample_id', 'replicate']]\
             .drop_duplicates().groupby(
@@ -31,31 +36,46 @@ class RunnerFilterRenkonen(object):
 
         renkonen_distance_df[
             'above_renkonen_distance_quantile'] = renkonen_distance_df.renkonen_distance > renkonen_distance_cutoff
-        for run_marker_sample_replicate_row_i, run_marker_sample_replicate_row in self.variant_read_count_df[[
-                'run_id', 'marker_id', 'sample_id', 'replicate']].drop_duplicates().iterrows():
-            run_id = run_marker_sample_replicate_row.run_id
-            marker_id = run_marker_sample_replicate_row.marker_id
-            sample_id = run_marker_sample_replicate_row.sample_id
-            replicate = run_marker_sample_replicate_row.replicate
-
-            run_marker_sample_replicate_renkonen_df = renkonen_distance_df.loc[
-                (renkonen_distance_df.run_id == run_id) & (
-                    renkonen_distance_df.marker_id == marker_id) & (
-                    renkonen_distance_df.sample_id == sample_id) & (
-                    (renkonen_distance_df.replicate_left == replicate) | (
-                        renkonen_distance_df.replicate_right == replicate))]
-
-            nb_replicates = int(nb_of_replicates_df.loc[
-                (nb_of_replicates_df.run_id == run_id) & (nb_of_replicates_df.marker_id == marker_id) & (
-                    nb_of_replicates_df.sample_id == sample_id), 'nb_replicates'].values)
-
-            delete_replicate = run_marker_sample_replicate_renkonen_df.above_renkonen_distance_quantile.sum(
-            ) > (nb_replicates - 1) / 2
-            filter_out_df.loc[(filter_out_df.run_id == run_id) & (filter_out_df.marker_id == marker_id) &
-                              (filter_out_df.sample_id == sample_id) &
-                              (filter_out_df.replicate == replicate), 'filter_delete'] = delete_replicate
+
+        ############################################################################################
+        #
+        # Each pair counts for its left and right replicates
+        #
+        ############################################################################################
+
+        replicate_above_df = pandas.concat([
+            renkonen_distance_df[sample_column_lst + [replicate_side, 'above_renkonen_distance_quantile']].rename(
+                {replicate_side: 'replicate'}, axis=1) for replicate_side in ['replicate_left', 'replicate_right']],
+            axis=0)
+        replicate_above_df = replicate_above_df.groupby(sample_column_lst + ['replicate']).sum().reset_index()
+        replicate_above_df = replicate_above_df.merge(nb_of_replicates_df, on=sample_column_lst)
+        replicate_above_df['filter_delete'] = replicate_above_df.above_renkonen_distance_quantile > (
+            replicate_above_df.nb_replicates - 1) / 2
+
+        filter_delete_df = filter_out_df[sample_column_lst + ['replicate']].merge(
+            replicate_above_df[sample_column_lst + ['replicate', 'filter_delete']],
+            on=sample_column_lst + ['replicate'], how='left')
+        filter_out_df['filter_delete'] = filter_delete_df.filter_delete.fillna(False).astype(bool).to_numpy()
+
         return filter_out_df
 
+    @staticmethod
+    def get_replicate_abundance_matrix(run_marker_sample_df):
+        """Pivots the reads of one run, marker and sample into a variant x replicate matrix of relative abundances
+
+        :param run_marker_sample_df: DataFrame (replicate, variant_id, read_count) of one run, marker and sample
+        :return: tuple with the replicates, in order of appearance, and the 2D array of N_ijk/N_jk values
+        """
+
+        variant_codes, variant_uniques = pandas.factorize(run_marker_sample_df.variant_id)
+        replicate_codes, replicate_uniques = pandas.factorize(run_marker_sample_df.replicate)
+
+        N_ijk_2d = numpy.zeros((len(variant_uniques), len(replicate_uniques)))
+        numpy.add.at(N_ijk_2d, (variant_codes, replicate_codes), run_marker_sample_df.read_count.to_numpy())
+        N_jk = N_ijk_2d.sum(axis=0)
+
+        return replicate_uniques, N_ijk_2d / N_jk
+
     def get_renkonen_distance_for_one_replicate_pair(
             self, run_marker_sample_df, replicate_left, replicate_right):
         """ Given run_name, marker_name, sample and left and right replicates computes renkonen distance
@@ -63,76 +83,48 @@ class RunnerFilterRenkonen(object):
         :type
         """
 
-        replicate_pair_vertical_df = run_marker_sample_df.loc[(run_marker_sample_df.replicate == replicate_left) | (
-            run_marker_sample_df.replicate == replicate_right)]
-
-        N_j_k_df = replicate_pair_vertical_df[['run_id',
-                                               'marker_id',
-                                               'sample_id',
-                                               'replicate',
-                                               'read_count']] .groupby(by=['run_id',
-                                                                           'marker_id',
-                                                                           'sample_id',
-                                                                           'replicate']).sum().reset_index()
-        replicate_pair_vertical_df = replicate_pair_vertical_df.merge(
-            N_j_k_df, left_on=[
-                'run_id', 'marker_id', 'sample_id', 'replicate'], right_on=[
-                'run_id', 'marker_id', 'sample_id', 'replicate'])
-        replicate_pair_vertical_df.rename(
-            {'read_count_x': 'N_i_j_k', 'read_count_y': 'N_j_k'}, axis=1, inplace=True)
-        replicate_pair_vertical_df['N_i_j_k/N_j_k'] = replicate_pair_vertical_df['N_i_j_k'] / \
-            replicate_pair_vertical_df['N_j_k']
-        replicate_left_df = replicate_pair_vertical_df.loc[
-            replicate_pair_vertical_df.replicate == replicate_left]
-        replicate_right_df = replicate_pair_vertical_df.loc[
-            replicate_pair_vertical_df.replicate == replicate_right]
-        replicate_pair_horizontal_df = replicate_left_df.merge(
-            replicate_right_df, on=[
-                'run_id', 'marker_id', 'sample_id', 'variant_id'], how='outer')
-        replicate_pair_horizontal_df.fillna(0, inplace=True)
-        replicate_pair_horizontal_df['min'] = replicate_pair_horizontal_df.apply(
-            lambda x: min(x['N_i_j_k/N_j_k_x'], x['N_i_j_k/N_j_k_y']), axis=1)
-        renkonen_distance = 1 - replicate_pair_horizontal_df['min'].sum()
+        replicate_pair_df = run_marker_sample_df.loc[run_marker_sample_df.replicate.isin(
+            [replicate_left, replicate_right])]
+        replicate_lst, abundance_2d = self.get_replicate_abundance_matrix(replicate_pair_df)
+        replicate_lst = list(replicate_lst)
+
+        # Variants missing in one replicate have a 0 abundance and do not contribute to the sum of minima
+        renkonen_distance = 1 - numpy.minimum(
+            abundance_2d[:, replicate_lst.index(replicate_left)],
+            abundance_2d[:, replicate_lst.index(replicate_right)]).sum()
 
         return renkonen_distance
 
     def get_renkonen_distance_df_for_all_sample_replicates(self):
+        """Computes the renkonen distances of all the replicate pairs of each run, marker and sample
 
-        renkonen_distance_df = pandas.DataFrame()
-
-        for pos, row in self.variant_read_count_df[[
-                'run_id', 'marker_id', 'sample_id']].drop_duplicates().iterrows():
+        Each sample is pivoted once into a variant x replicate abundance matrix and the distances of all the
+        replicate pairs are reduced at once with numpy.minimum
 
-            run_id = row.run_id
-            marker_id = row.marker_id
-            sample_id = row.sample_id
+        :return: DataFrame (run_id, marker_id, sample_id, replicate_left, replicate_right, renkonen_distance)
+        """
 
-            run_marker_sample_df = self.variant_read_count_df.loc[(self.variant_read_count_df.run_id == run_id) & (
-                self.variant_read_count_df.marker_id == marker_id) & (self.variant_read_count_df.sample_id == sample_id)]
+        column_lst = ['run_id', 'marker_id', 'sample_id', 'replicate_left', 'replicate_right', 'renkonen_distance']
+        renkonen_distance_lst_dic = {column: [] for column in column_lst}
 
-            replicate_pairs = list(
-                itertools.combinations(
-                    run_marker_sample_df.replicate.unique(), 2))
+        for (run_id, marker_id, sample_id), run_marker_sample_df in self.variant_read_count_df.groupby(
+                ['run_id', 'marker_id', 'sample_id'], sort=False):
 
-            for replicate_left, replicate_right in replicate_pairs:
+            replicate_lst, abundance_2d = self.get_replicate_abundance_matrix(run_marker_sample_df)
 
-                renkonen_distance = self.get_renkonen_distance_for_one_replicate_pair(
-                    run_marker_sample_df, replicate_left=replicate_left, replicate_right=replicate_right)
+            # Same pair order as itertools.combinations
+            replicate_left_idx, replicate_right_idx = numpy.triu_indices(len(replicate_lst), k=1)
+            renkonen_distance_lst = 1 - numpy.minimum(
+                abundance_2d[:, replicate_left_idx], abundance_2d[:, replicate_right_idx]).sum(axis=0)
 
-                renkonen_distance_df = pandas.concat(
-                    [
-                        renkonen_distance_df,
-                        pandas.DataFrame(
-                            {
-                                'run_id': run_id,
-                                'marker_id': marker_id,
-                                'sample_id': sample_id,
-                                'replicate_left': replicate_left,
-                                'replicate_right': replicate_right,
-                                'renkonen_distance': renkonen_distance},
-                            index=[0])],
-                    axis=0)
+            pair_count = len(replicate_left_idx)
+            renkonen_distance_lst_dic['run_id'] += [run_id] * pair_count
+            renkonen_distance_lst_dic['marker_id'] += [marker_id] * pair_count
+            renkonen_distance_lst_dic['sample_id'] += [sample_id] * pair_count
+            renkonen_distance_lst_dic['replicate_left'] += list(replicate_lst[replicate_left_idx])
+            renkonen_distance_lst_dic['replicate_right'] += list(replicate_lst[replicate_right_idx])
+            renkonen_distance_lst_dic['renkonen_distance'] += renkonen_distance_lst.tolist()
 
-        renkonen_distance_df = renkonen_distance_df.reset_index(drop=True)
+        renkonen_distance_df = pandas.DataFrame(renkonen_distance_lst_dic, columns=column_lst)
 
         return renkonen_distance_df
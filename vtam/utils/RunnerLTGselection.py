@@ -1,3 +1,4 @@
+import numpy
 import pandas
 
 from vtam.utils.FileParams import FileParams
@@ -6,7 +7,10 @@ from vtam.utils.constants import rank_hierarchy, identity_list
 
 class RunnerLTGselection(object):
     """Takes a DF with columns: variant_id, %identity, 'target_tax_id', 'no rank', 'species', ...
-    and the returns the LTG for each variant"""
+    and the returns the LTG for each variant
+
+    An optional 'hit_count' column gives the number of hits of each row, as in the aggregated output of
+    RunnerBlast.process_blast_result"""
 
     def __init__(self, variant_identity_lineage_df, taxonomy_df, params):
 
@@ -81,6 +85,10 @@ class RunnerLTGselection(object):
 
                 lineage_list_df_columns_sorted = [value for value in blast_lineage_identity_df if value in rank_hierarchy]
                 tax_lineage_df = (blast_lineage_identity_df[lineage_list_df_columns_sorted]).copy()
+                # Aggregated Blast output has the number of hits in each row
+                hit_count_sr = None
+                if 'hit_count' in blast_lineage_identity_df.columns:
+                    hit_count_sr = blast_lineage_identity_df.hit_count
 
                 ###############################################################
                 #
@@ -88,7 +96,7 @@ class RunnerLTGselection(object):
                 #
                 ###############################################################
 
-                ltg_tax_id, ltg_rank = self.select_ltg_include_prop(tax_lineage_df)
+                ltg_tax_id, ltg_rank = self.select_ltg_include_prop(tax_lineage_df, hit_count_sr)
 
                 if not (ltg_tax_id is None):
 
@@ -111,7 +119,7 @@ class RunnerLTGselection(object):
     2        99  species     1077837           9
 
         Args:
-            variant_identity_lineage_df (pandas.DataFrame): DF with columns: variant_id, identity, target_tax_id and lineage_columns.
+            variant_identity_lineage_df (pandas.DataFrame): DF with columns: variant_id, identity, target_tax_id, optional hit_count and lineage_columns.
             ltg_rule_threshold (int): Identity value where we change of using include_prop method to min_number_of_taxa, default 97
             include_prop (int): Percentage out of total selected qblast hits for Ltg to be present when identity>=ltg_rule_threshold
             min_number_of_taxa (int): Minimal number of taxa, where LTF must be present when identity<ltg_rule_threshold
@@ -121,25 +129,157 @@ class RunnerLTGselection(object):
 
         """
 
+        ltg_df_columns = ['variant_id', 'identity', 'ltg_tax_id', 'ltg_tax_name', 'ltg_rank']
+        hit_df = self.variantid_identity_lineage_df
+        rank_lst = [rank for rank in rank_hierarchy if rank in hit_df.columns]
+        identity_arr = numpy.array(identity_list, dtype='float')
+        ltg_empty_df = pandas.DataFrame(data=[], columns=ltg_df_columns).astype({'ltg_tax_id': 'int'})
+        if len(rank_lst) == 0:  # No lineage, no LTG
+            return ltg_empty_df
+
+        #######################################################################
+        #
+        # Hits reduced to (variant, identity step, lineage) with their count and first row.
+        # A hit with identity step k is above the identity cutoffs k, k+1, ...
+        #
+        #######################################################################
+
+        variant_idx_arr, variant_id_index = pandas.factorize(hit_df.variant_id, sort=True)
+        step_arr = numpy.searchsorted(-identity_arr, -hit_df.identity.to_numpy(dtype='float'), side='left')
+        lineage_idx_arr = hit_df.groupby(['target_tax_id'] + rank_lst, sort=False, dropna=False).ngroup().to_numpy()
+        is_hit = (variant_idx_arr >= 0) & (step_arr < identity_arr.shape[0])
+        # Aggregated Blast output has the number of hits in each row
+        if 'hit_count' in hit_df.columns:
+            hit_weight_arr = hit_df.hit_count.to_numpy(dtype='int64')
+        else:
+            hit_weight_arr = numpy.ones(hit_df.shape[0], dtype='int64')
+
+        hit_count_df = pandas.DataFrame({
+            'variant_idx': variant_idx_arr[is_hit], 'step': step_arr[is_hit], 'lineage_idx': lineage_idx_arr[is_hit],
+            'row': numpy.where(is_hit)[0], 'hit_weight': hit_weight_arr[is_hit]}).groupby(
+            ['variant_idx', 'step', 'lineage_idx']).agg(
+            hit_count=('hit_weight', 'sum'), first_row=('row', 'min')).reset_index()
+        lineage_df = hit_df[['target_tax_id'] + rank_lst].iloc[
+            numpy.unique(lineage_idx_arr, return_index=True)[1]].reset_index(drop=True)
+
+        variant_count = variant_id_index.shape[0]
+        shape = (variant_count, identity_arr.shape[0])
+        variant_idx_arr = hit_count_df.variant_idx.to_numpy()
+        step_arr = hit_count_df.step.to_numpy()
+
+        # Number of hits and of distinct target tax ids above each identity cutoff
+        hit_count_arr = numpy.zeros(shape, dtype='int64')
+        numpy.add.at(hit_count_arr, (variant_idx_arr, step_arr), hit_count_df.hit_count.to_numpy())
+        hit_count_arr = hit_count_arr.cumsum(axis=1)
+        target_df = pandas.DataFrame({
+            'variant_idx': variant_idx_arr, 'step': step_arr,
+            'target_tax_id': lineage_df.target_tax_id.to_numpy()[hit_count_df.lineage_idx.to_numpy()]}).groupby(
+            ['variant_idx', 'target_tax_id'], dropna=False).step.min().reset_index()
+        target_count_arr = numpy.zeros(shape, dtype='int64')
+        numpy.add.at(target_count_arr, (target_df.variant_idx.to_numpy(), target_df.step.to_numpy()), 1)
+        target_count_arr = target_count_arr.cumsum(axis=1)
+
+        #######################################################################
         #
-        list_variant_id_to_ltg = []
-        variant_id_list = sorted(
-            self.variantid_identity_lineage_df.variant_id.unique().tolist())
+        # Modal tax id of each rank above each identity cutoff and its percentage of the hits
         #
-        for variant_id in variant_id_list:  #  Loop sorted each variant
+        #######################################################################
 
-            ltg_dic = self.one_variant_to_ltg(variant_id)
-            if not (ltg_dic == {}):  # if there is a ltg
-                list_variant_id_to_ltg.append({**{'variant_id': variant_id}, **ltg_dic})
+        modal_tax_id_arr = numpy.full(shape + (len(rank_lst),), numpy.nan)
+        modal_count_arr = numpy.zeros(shape + (len(rank_lst),), dtype='int64')
+        for rank_i, rank in enumerate(rank_lst):
+            modal_tax_id_arr[:, :, rank_i], modal_count_arr[:, :, rank_i] = self.get_modal_tax_id_arr(
+                tax_id_arr=lineage_df[rank].to_numpy(dtype='float')[hit_count_df.lineage_idx.to_numpy()],
+                variant_idx_arr=variant_idx_arr, step_arr=step_arr,
+                hit_count_arr=hit_count_df.hit_count.to_numpy(), first_row_arr=hit_count_df.first_row.to_numpy(),
+                shape=shape)
 
-        ltg_df = pandas.DataFrame(data=list_variant_id_to_ltg, columns=['variant_id', 'identity',
-                'ltg_tax_id', 'ltg_tax_name', 'ltg_rank'])
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            modal_percentage_arr = modal_count_arr / hit_count_arr[:, :, numpy.newaxis] * 100
+        is_ltg_arr = (modal_count_arr > 0) & (modal_percentage_arr >= self.include_prop)
+
+        #######################################################################
+        #
+        # LTG: lowest rank including include_prop of the hits at the highest identity cutoff
+        # that satisfies the conditions
+        #
+        #######################################################################
+
+        condition_high_similarity = identity_arr >= self.ltg_rule_threshold
+        condition_low_similarity = (identity_arr < self.ltg_rule_threshold) \
+            & (target_count_arr >= self.min_number_of_taxa)
+        is_ltg_step_arr = (hit_count_arr > 0) & (condition_high_similarity | condition_low_similarity) \
+            & is_ltg_arr.any(axis=2)
+
+        ltg_variant_idx_arr = numpy.where(is_ltg_step_arr.any(axis=1))[0]
+        if ltg_variant_idx_arr.shape[0] == 0:
+            return ltg_empty_df
+        ltg_step_arr = is_ltg_step_arr[ltg_variant_idx_arr].argmax(axis=1)
+        ltg_rank_idx_arr = len(rank_lst) - 1 - is_ltg_arr[ltg_variant_idx_arr, ltg_step_arr, ::-1].argmax(axis=1)
+        ltg_tax_id_arr = modal_tax_id_arr[ltg_variant_idx_arr, ltg_step_arr, ltg_rank_idx_arr].astype('int')
+
+        ltg_df = pandas.DataFrame({
+            'variant_id': variant_id_index[ltg_variant_idx_arr],
+            'identity': numpy.array(identity_list)[ltg_step_arr],
+            'ltg_tax_id': ltg_tax_id_arr,
+            'ltg_tax_name': self.taxonomy_df.loc[ltg_tax_id_arr, 'name_txt'].to_numpy(),
+            'ltg_rank': numpy.array(rank_lst, dtype=object)[ltg_rank_idx_arr]}, columns=ltg_df_columns)
 
         ltg_df.ltg_tax_id = ltg_df.ltg_tax_id.astype('int')
 
         return ltg_df
 
-    def select_ltg_include_prop(self, tax_lineage_df):
+    @staticmethod
+    def get_modal_tax_id_arr(tax_id_arr, variant_idx_arr, step_arr, hit_count_arr, first_row_arr, shape):
+        """Returns the most frequent tax id of one rank above each identity cutoff and its count
+
+        As the value_counts in select_ltg_include_prop, hits without tax id at this rank are not counted. Ties are
+        broken by the first hit.
+
+        :param tax_id_arr: tax id at this rank of each (variant, identity step, lineage)
+        :param variant_idx_arr: variant index of each (variant, identity step, lineage)
+        :param step_arr: identity step of each (variant, identity step, lineage)
+        :param hit_count_arr: number of hits of each (variant, identity step, lineage)
+        :param first_row_arr: first hit row of each (variant, identity step, lineage)
+        :param shape: (number of variants, number of identity cutoffs)
+        :return: tuple of arrays with this shape with the modal tax id (NaN if none) and its count
+        """
+
+        is_tax_id = ~numpy.isnan(tax_id_arr)
+        tax_id_code_arr, tax_id_index = pandas.factorize(tax_id_arr[is_tax_id])
+        group_idx_arr, group_key_arr = pandas.factorize(
+            variant_idx_arr[is_tax_id].astype('int64') * max(tax_id_index.shape[0], 1) + tax_id_code_arr)
+        group_variant_idx_arr = group_key_arr // max(tax_id_index.shape[0], 1)
+        group_tax_id_arr = numpy.asarray(tax_id_index)[group_key_arr % max(tax_id_index.shape[0], 1)]
+
+        # Counts and first rows of each (variant, tax id) cumulated over the identity steps
+        group_count_arr = numpy.zeros((group_key_arr.shape[0], shape[1]), dtype='int64')
+        numpy.add.at(group_count_arr, (group_idx_arr, step_arr[is_tax_id]), hit_count_arr[is_tax_id])
+        group_count_arr = group_count_arr.cumsum(axis=1)
+        group_first_row_arr = numpy.full(group_count_arr.shape, numpy.iinfo('int64').max, dtype='int64')
+        numpy.minimum.at(group_first_row_arr, (group_idx_arr, step_arr[is_tax_id]), first_row_arr[is_tax_id])
+        group_first_row_arr = numpy.minimum.accumulate(group_first_row_arr, axis=1)
+
+        # For each (variant, identity step), the group with the highest count and then the first row.
+        # Both are packed in one score, which is unique in a variant because each row has one tax id per rank.
+        group_idx_arr, group_step_arr = numpy.nonzero(group_count_arr)
+        cell_arr = group_variant_idx_arr[group_idx_arr] * shape[1] + group_step_arr
+        row_count = numpy.int64(first_row_arr.max(initial=0)) + 1
+        score_arr = group_count_arr[group_idx_arr, group_step_arr] * row_count \
+            + (row_count - 1 - group_first_row_arr[group_idx_arr, group_step_arr])
+        cell_score_arr = numpy.full(shape[0] * shape[1], -1, dtype='int64')
+        numpy.maximum.at(cell_score_arr, cell_arr, score_arr)
+        is_modal = score_arr == cell_score_arr[cell_arr]
+
+        modal_tax_id_arr = numpy.full(shape[0] * shape[1], numpy.nan)
+        modal_count_arr = numpy.zeros(shape[0] * shape[1], dtype='int64')
+        modal_tax_id_arr[cell_arr[is_modal]] = group_tax_id_arr[group_idx_arr[is_modal]]
+        modal_count_arr[cell_arr[is_modal]] = score_arr[is_modal] // row_count
+        modal_tax_id_arr = modal_tax_id_arr.reshape(shape)
+        modal_count_arr = modal_count_arr.reshape(shape)
+        return modal_tax_id_arr, modal_count_arr
+
+    def select_ltg_include_prop(self, tax_lineage_df, hit_count_sr=None):
         """
         Selects LGT using the include_proc method.
         Take the LTG of the selected hits as the lowest taxonomic group contains <include_prop>
@@ -149,6 +289,8 @@ class RunnerLTGselection(object):
         ----------
         tax_lineage_df pandas DataFrame
         taxa and rank of different blast hits for a given variant id and identity
+        hit_count_sr pandas Series
+        number of hits of each row of tax_lineage_df, one hit per row if None
            no rank    species   genus     family     order     class  phylum
 0   131567   741276.0  5533.0  1799696.0  231213.0  162481.0  5204.0
 1   131567  1112827.0  6220.0   941271.0    6219.0    6218.0  6217.0
@@ -186,16 +328,17 @@ class RunnerLTGselection(object):
             filter(lambda x: x in tax_lineage_df.columns.tolist(),
                 rank_hierarchy))
         tax_lineage_df = tax_lineage_df[lineage_list_df_columns_sorted]
+        if hit_count_sr is None:
+            hit_count_sr = pandas.Series(1, index=tax_lineage_df.index)
+        # Hit count of the most frequent tax id of each rank, ties broken by the first hit
+        putative_ltg_lst = []
+        for rank in lineage_list_df_columns_sorted:
+            tax_id_count_sr = hit_count_sr.groupby(tax_lineage_df[rank], sort=False).sum()
+            putative_ltg_lst.append((tax_id_count_sr.idxmax(), tax_id_count_sr.max()))
         putative_ltg_df = pandas.DataFrame(
-            {
-                'putative_ltg_id': tax_lineage_df.apply(
-                    lambda x: x.value_counts().index[0],
-                    axis=0),
-                'putative_ltg_count': tax_lineage_df.apply(
-                    lambda x: x.value_counts().iloc[0],
-                    axis=0)})
+            putative_ltg_lst, columns=['putative_ltg_id', 'putative_ltg_count'], index=lineage_list_df_columns_sorted)
         putative_ltg_df['putative_ltg_percentage'] = putative_ltg_df.putative_ltg_count / \
-            tax_lineage_df.shape[0] * 100
+            hit_count_sr.sum() * 100
         """(Pdb) putative_ltg_df
          putative_ltg_id  putative_ltg_count  putative_ltg_percentage
 no rank         131567.0                   9               100.000000
@@ -1,4 +1,14 @@
+import multiprocessing
+import multiprocessing.util
+
+import numpy
 import pandas
+
+try:  # Python >= 3.8
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
 from vtam.utils.constants import lfn_ni_njk_cutoff_global_max, lfn_ni_njk_cutoff_lst_size, \
     lfn_nijk_cutoff_global_max, \
     lfn_nijk_cutoff_lst_size
@@ -12,18 +22,34 @@ class RunnerOptimizeLFNreadCountAndVariant:
     """This the Runner for Optimize LFN readcount and variant/variantReplicate
     in the presence of several run-marker combinations"""
 
-    def __init__(self, nijk_df, known_occurrences_df):
+    # Columns of the nijk array shared with the worker processes
+    nijk_column_lst = ['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count']
+
+    # nijk array of the worker processes, set by init_worker
+    worker_nijk_arr = None
+    worker_nijk_shm = None
+
+    def __init__(self, nijk_df, known_occurrences_df, num_threads=1):
+        """
+        :param nijk_df: DataFrame with columns run_id, marker_id, sample_id, replicate, variant_id, read_count
+        :param known_occurrences_df: DataFrame of the known occurrences with ids
+        :param num_threads: number of processes used to optimize the run-marker combinations
+        """
 
         self.nijk_df = nijk_df
         self.known_occurrences_df = known_occurrences_df
+        self.num_threads = num_threads
 
     def get_optimize_df(self, lfn_ni_cutoff, lfn_nik_cutoff, lfn_njk_cutoff, lfn_nijk_cutoff,
-                        min_replicate_number):
+                        min_replicate_number, optimize_lfn_exact=False):
+        """
+        :param optimize_lfn_exact: if True, sweeps all the cutoffs of the known occurrences instead of the grid
+        """
 
         ############################################################################################
         #
         # Group and run_name this genetic_code by run_name/marker_name combination
-        #  Loop by run_name/marker_name
+        #  Loop by run_name/marker_name
         #
         ############################################################################################
 
@@ -37,6 +63,24 @@ class RunnerOptimizeLFNreadCountAndVariant:
             lfn_ni_nik_cutoff_lst = RunnerOptimizeLFNreadCountAndVariantRunMarker.get_lfn_ni_nik_cutoff_lst(
                 lfn_nik_cutoff, lfn_ni_njk_cutoff_global_max, lfn_ni_njk_cutoff_lst_size)
 
+        ############################################################################################
+        #
+        # The nijk rows are sorted by run-marker so that each run-marker is a slice of the nijk array
+        #
+        ############################################################################################
+
+        nijk_df = self.nijk_df[self.nijk_column_lst].sort_values(
+            ['run_id', 'marker_id'], kind='mergesort').reset_index(drop=True)
+        nijk_arr = nijk_df.to_numpy(dtype='int64')
+        run_marker_slice_dic = {run_marker: (row_arr.min(), row_arr.max() + 1) for run_marker, row_arr in
+                                nijk_df.groupby(['run_id', 'marker_id']).indices.items()}
+
+        optimize_kwargs = {'lfn_nijk_cutoff_lst': lfn_nijk_cutoff_lst, 'lfn_ni_nik_cutoff_lst': lfn_ni_nik_cutoff_lst,
+                           'lfn_ni_cutoff': lfn_ni_cutoff, 'lfn_nik_cutoff': lfn_nik_cutoff,
+                           'lfn_njk_cutoff': lfn_njk_cutoff, 'lfn_nijk_cutoff': lfn_nijk_cutoff,
+                           'min_replicate_number': min_replicate_number, 'optimize_lfn_exact': optimize_lfn_exact}
+
+        task_lst = []
         for row in self.known_occurrences_df[['run_id', 'marker_id']].drop_duplicates().itertuples():
 
             run_id = row.run_id
@@ -44,64 +88,156 @@ class RunnerOptimizeLFNreadCountAndVariant:
             known_occurrs_run_marker_df = self.known_occurrences_df.loc[
                 (self.known_occurrences_df.run_id == run_id) & (
                             self.known_occurrences_df.marker_id == marker_id),]
-            nijk_run_marker_df = self.nijk_df.loc[
-                (self.nijk_df.run_id == run_id) & (self.nijk_df.marker_id == marker_id),]
-            nijk_run_marker_df = nijk_run_marker_df[
-                ['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id',
-                 'read_count']].drop_duplicates(inplace=False)
-
-            optim_run_marker_obj = RunnerOptimizeLFNreadCountAndVariantRunMarker(
-                nijk_run_marker_df, known_occurrs_run_marker_df, lfn_nijk_cutoff_lst, lfn_ni_nik_cutoff_lst)
-            out_optimize_run_marker_df = optim_run_marker_obj.get_df_optim_lfn_readcount_variant_replicate_cutoff(
-                lfn_ni_cutoff=lfn_ni_cutoff, lfn_nik_cutoff=lfn_nik_cutoff,
-                lfn_njk_cutoff=lfn_njk_cutoff, lfn_nijk_cutoff=lfn_nijk_cutoff,
-                min_replicate_number=min_replicate_number)
-
-            ########################################################################################
-            #
-            # Prepare output of this run-marker
-            #
-            ########################################################################################
-
-            # From list of dics to variant_read_count_input_df
-            # out_optimize_run_marker_df = pandas.DataFrame(out_lfn_variant_list)
-            # List of columns in order
-            column_names = ['occurrence_nb_keep', 'occurrence_nb_delete', 'lfn_nijk_cutoff',
-                            'lfn_ni_nik_cutoff']
-            # Reorder columns
-            out_optimize_run_marker_df = out_optimize_run_marker_df[column_names]
-            # Sort columns
-            out_optimize_run_marker_df.sort_values(by=column_names,
-                                                   ascending=[False, True, True, True],
-                                                   inplace=True)
-            # Rename columns depending on whether this is optimize_lfn_variant or is_optimize_lfn_variant_replicate
-            out_optimize_run_marker_df.lfn_ni_nik_cutoff = round(out_optimize_run_marker_df.lfn_ni_nik_cutoff, 3)
-            if lfn_nik_cutoff is None:  # optimize lfn variant
-                out_optimize_run_marker_df = out_optimize_run_marker_df \
-                    .rename(columns={'lfn_ni_nik_cutoff': 'lfn_variant_cutoff'})
-            else:  # optimize lfn variant replicate
-                out_optimize_run_marker_df = out_optimize_run_marker_df \
-                    .rename(columns={'lfn_ni_nik_cutoff': 'lfn_variant_replicate_cutoff'})
-
-            ########################################################################################
-            #
-            # Concat
-            #
-            ########################################################################################
-
-            out_optimize_run_marker_df['run_id'] = run_id
-            out_optimize_run_marker_df['marker_id'] = marker_id
-            out_optimize_df = pandas.concat([out_optimize_df, out_optimize_run_marker_df], axis=0)
+            nijk_slice = run_marker_slice_dic.get((run_id, marker_id), (0, 0))
+            task_lst.append((nijk_slice, known_occurrs_run_marker_df, optimize_kwargs))
 
-            ########################################################################################
-            #
-            # Variant delete-specific cutoffs
-            #
-            ########################################################################################
+        ############################################################################################
+        #
+        # The run-marker combinations are optimized in parallel with the nijk array shared by the processes
+        #
+        ############################################################################################
 
-            lfn_ni_or_nik_specific_cutoff_df = optim_run_marker_obj.get_df_variant_specific_cutoffs(lfn_nik_cutoff)
+        num_processes = max(1, min(int(self.num_threads), len(task_lst)))
+        if num_processes > 1:
+            nijk_shm = None
+            if shared_memory is None:
+                initargs = (nijk_arr, None)
+            else:
+                nijk_shm = shared_memory.SharedMemory(create=True, size=max(nijk_arr.nbytes, 1))
+                numpy.ndarray(nijk_arr.shape, dtype=nijk_arr.dtype, buffer=nijk_shm.buf)[:] = nijk_arr
+                initargs = (nijk_arr.shape, nijk_shm.name)
+            try:
+                # Workers exit after close and join so that their finalizers release the shared memory
+                pool = multiprocessing.Pool(processes=num_processes, initializer=self.init_worker,
+                                            initargs=initargs)
+                try:
+                    out_run_marker_lst = pool.map(self.optimize_run_marker, task_lst, chunksize=1)
+                except BaseException:
+                    pool.terminate()
+                    raise
+                else:
+                    pool.close()
+                finally:
+                    pool.join()
+            finally:
+                if nijk_shm is not None:
+                    nijk_shm.close()
+                    nijk_shm.unlink()
+        else:
+            out_run_marker_lst = [self.optimize_run_marker(task, nijk_arr) for task in task_lst]
 
+        ############################################################################################
+        #
+        # Concat in the order of the run-marker combinations
+        #
+        ############################################################################################
+
+        for out_optimize_run_marker_df, lfn_ni_or_nik_specific_cutoff_df in out_run_marker_lst:
+            out_optimize_df = pandas.concat([out_optimize_df, out_optimize_run_marker_df], axis=0)
             out_optimize2_df = pandas.concat(
                 [out_optimize2_df, lfn_ni_or_nik_specific_cutoff_df], axis=0)
 
         return out_optimize_df, out_optimize2_df
+
+    @classmethod
+    def init_worker(cls, nijk_arr_or_shape, nijk_shm_name):
+        """Sets the nijk array of a worker process, either the array or a view of the shared memory block.
+        The shared memory block is closed when the worker process exits
+
+        :param nijk_arr_or_shape: nijk array or shape of the nijk array in the shared memory block
+        :param nijk_shm_name: name of the shared memory block or None
+        """
+
+        if nijk_shm_name is None:
+            cls.worker_nijk_arr = nijk_arr_or_shape
+        else:
+            cls.worker_nijk_shm = shared_memory.SharedMemory(name=nijk_shm_name)
+            cls.worker_nijk_arr = numpy.ndarray(nijk_arr_or_shape, dtype='int64', buffer=cls.worker_nijk_shm.buf)
+            multiprocessing.util.Finalize(cls, cls.close_worker, exitpriority=0)
+
+    @classmethod
+    def close_worker(cls):
+        """Releases the nijk array of a worker process and closes its shared memory block"""
+
+        cls.worker_nijk_arr = None
+        if cls.worker_nijk_shm is not None:
+            cls.worker_nijk_shm.close()
+            cls.worker_nijk_shm = None
+
+    @classmethod
+    def optimize_run_marker(cls, task, nijk_arr=None):
+        """Optimizes one run-marker combination
+
+        :param task: tuple (nijk_slice, known_occurrs_run_marker_df, optimize_kwargs) with the (start, stop) rows
+            of this run-marker in the nijk array
+        :param nijk_arr: nijk array, by default the nijk array of the worker process
+        :return: tuple (out_optimize_run_marker_df, lfn_ni_or_nik_specific_cutoff_df)
+        """
+
+        (nijk_start, nijk_stop), known_occurrs_run_marker_df, optimize_kwargs = task
+        lfn_nik_cutoff = optimize_kwargs['lfn_nik_cutoff']
+        run_id = known_occurrs_run_marker_df.run_id.iloc[0]
+        marker_id = known_occurrs_run_marker_df.marker_id.iloc[0]
+
+        if nijk_arr is None:
+            nijk_arr = cls.worker_nijk_arr
+        nijk_run_marker_df = pandas.DataFrame(nijk_arr[nijk_start:nijk_stop].copy(), columns=cls.nijk_column_lst)
+        nijk_run_marker_df = nijk_run_marker_df[
+            ['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id',
+             'read_count']].drop_duplicates(inplace=False)
+
+        optim_run_marker_obj = RunnerOptimizeLFNreadCountAndVariantRunMarker(
+            nijk_run_marker_df, known_occurrs_run_marker_df, optimize_kwargs['lfn_nijk_cutoff_lst'],
+            optimize_kwargs['lfn_ni_nik_cutoff_lst'])
+        cutoff_kwargs = {'lfn_ni_cutoff': optimize_kwargs['lfn_ni_cutoff'], 'lfn_nik_cutoff': lfn_nik_cutoff,
+                         'lfn_njk_cutoff': optimize_kwargs['lfn_njk_cutoff'],
+                         'lfn_nijk_cutoff': optimize_kwargs['lfn_nijk_cutoff'],
+                         'min_replicate_number': optimize_kwargs['min_replicate_number']}
+        if optimize_kwargs['optimize_lfn_exact']:
+            out_optimize_run_marker_df = optim_run_marker_obj.get_df_optim_lfn_readcount_variant_replicate_cutoff_exact(
+                lfn_nijk_cutoff_max=lfn_nijk_cutoff_global_max, lfn_ni_nik_cutoff_max=lfn_ni_njk_cutoff_global_max,
+                **cutoff_kwargs)
+        else:
+            out_optimize_run_marker_df = optim_run_marker_obj.get_df_optim_lfn_readcount_variant_replicate_cutoff(
+                **cutoff_kwargs)
+
+        ############################################################################################
+        #
+        # Prepare output of this run-marker
+        #
+        ############################################################################################
+
+        # From list of dics to variant_read_count_input_df
+        # out_optimize_run_marker_df = pandas.DataFrame(out_lfn_variant_list)
+        # List of columns in order
+        column_names = ['occurrence_nb_keep', 'occurrence_nb_delete', 'lfn_nijk_cutoff',
+                        'lfn_ni_nik_cutoff']
+        # Reorder columns
+        out_optimize_run_marker_df = out_optimize_run_marker_df[column_names]
+        # Sort columns
+        out_optimize_run_marker_df.sort_values(by=column_names,
+                                               ascending=[False, True, True, True],
+                                               inplace=True)
+        # Rename columns depending on whether this is optimize_lfn_variant or is_optimize_lfn_variant_replicate
+        # The exact cutoffs are not rounded
+        if not optimize_kwargs['optimize_lfn_exact']:
+            out_optimize_run_marker_df.lfn_ni_nik_cutoff = round(out_optimize_run_marker_df.lfn_ni_nik_cutoff, 3)
+        if lfn_nik_cutoff is None:  # optimize lfn variant
+            out_optimize_run_marker_df = out_optimize_run_marker_df \
+                .rename(columns={'lfn_ni_nik_cutoff': 'lfn_variant_cutoff'})
+        else:  # optimize lfn variant replicate
+            out_optimize_run_marker_df = out_optimize_run_marker_df \
+                .rename(columns={'lfn_ni_nik_cutoff': 'lfn_variant_replicate_cutoff'})
+
+        out_optimize_run_marker_df['run_id'] = run_id
+        out_optimize_run_marker_df['marker_id'] = marker_id
+
+        ############################################################################################
+        #
+        # Variant delete-specific cutoffs
+        #
+        ############################################################################################
+
+        lfn_ni_or_nik_specific_cutoff_df = optim_run_marker_obj.get_df_variant_specific_cutoffs(lfn_nik_cutoff)
+
+        return out_optimize_run_marker_df, lfn_ni_or_nik_specific_cutoff_df
@@ -2,14 +2,17 @@ import pandas
 import numpy
 from vtam.utils.VTAMexception import VTAMexception
 
-from vtam.utils.RunnerFilterLFNreplicateRemain import RunnerFilterLFNreplicateRemain
 from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
 
 
 class RunnerOptimizeLFNreadCountAndVariantRunMarker:
 
     """This the Runner for Optimize LFN readcount and variant/variantReplicate
-    in the presence of one run-marker combination"""
+    in the presence of one run-marker combination
+
+    The points of the grid are evaluated with the same filters as RunnerFilterLFNreplicateRemain, but the ratios
+    N_ijk/N_i, N_ijk/N_ik and N_ijk/N_jk are computed once. Each point is then a comparison of arrays and a replicate
+    count restricted to the known occurrences."""
 
     def __init__(self, nijk_df, known_occurrences_df, lfn_nijk_cutoff_lst, lfn_ni_nik_cutoff_lst):
 
@@ -28,6 +31,9 @@ class RunnerOptimizeLFNreadCountAndVariantRunMarker:
         self.lfn_nijk_cutoff_lst = lfn_nijk_cutoff_lst
         self.lfn_ni_nik_cutoff_lst = lfn_ni_nik_cutoff_lst
 
+        # (lfn_denominator, lfn_njk_cutoff) -> arrays of the known occurrences
+        self.occurrence_arr_dic_cache = {}
+
     @classmethod
     def get_lfn_nijk_cutoff_lst(cls, start: object, stop: object, nb_points: object) -> object:
 
@@ -48,25 +54,131 @@ class RunnerOptimizeLFNreadCountAndVariantRunMarker:
         count_delete_max = len(self.known_occurrences_df.loc[self.known_occurrences_df.action == 'delete'].variant_id.unique())
         return count_delete_max
 
-    def get_lst_one_par_lfn_nijk_cutoff(self, lfn_ni_cutoff, lfn_nik_cutoff, lfn_njk_cutoff, lfn_nijk_cutoff, min_replicate_number):
-
-        """Loops through self.lfn_nijk_cutoff_lst and keeps only values while count_keep < count_keep_max"""
+    def get_occurrence_arr_dic(self, lfn_nik_cutoff, lfn_njk_cutoff):
+        """Returns the arrays used to count the known occurrences kept and deleted at each point of the grid
+
+        Only the rows of the known occurrences change the counts, so the other rows are dropped after computing
+        the ratios. The rows deleted by the lfn_njk_cutoff, which does not vary in the grid, are also dropped.
+
+        :param lfn_nik_cutoff: None to use the N_ijk/N_i ratio, otherwise the N_ijk/N_ik ratio
+        :param lfn_njk_cutoff: cutoff of the N_ijk/N_jk ratio
+        :return: dictionary with the read_count, lfn_ratio and occurrence index of each row, and the is_keep and
+            is_delete flags of each occurrence
+        """
+
+        lfn_denominator = 'N_i' if lfn_nik_cutoff is None else 'N_ik'
+        cache_key = (lfn_denominator, lfn_njk_cutoff)
+        if cache_key in self.occurrence_arr_dic_cache:
+            return self.occurrence_arr_dic_cache[cache_key]
+
+        occurrence_column_lst = ['run_id', 'marker_id', 'sample_id', 'variant_id']
+        group_column_dic = {
+            'N_i': ['run_id', 'marker_id', 'variant_id'],
+            'N_ik': ['run_id', 'marker_id', 'variant_id', 'replicate'],
+            'N_jk': ['run_id', 'marker_id', 'sample_id', 'replicate']}
+
+        read_count_arr = self.nijk_df.read_count.to_numpy()
+        lfn_ratio_dic = {}
+        for N_name in [lfn_denominator, 'N_jk']:
+            group_index_arr = self.nijk_df.groupby(group_column_dic[N_name], sort=False).ngroup().to_numpy()
+            N_arr = numpy.bincount(group_index_arr, weights=read_count_arr)[group_index_arr]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                lfn_ratio_dic[N_name] = read_count_arr / N_arr
+
+        ############################################################################################
+        #
+        # Known occurrences and the rows of the known occurrences kept by the fixed filters
+        #
+        ############################################################################################
+
+        occurrence_df = self.known_occurrences_df.loc[
+            self.known_occurrences_df.action.isin(['keep', 'delete']), occurrence_column_lst + ['action']]
+        occurrence_df = pandas.DataFrame({
+            'is_keep': occurrence_df.action == 'keep', 'is_delete': occurrence_df.action == 'delete'}).groupby(
+            [occurrence_df[column].astype('int64') for column in occurrence_column_lst], sort=False).any()
+
+        occurrence_index_arr = occurrence_df.index.get_indexer(
+            pandas.MultiIndex.from_frame(self.nijk_df[occurrence_column_lst].astype('int64')))
+        row_mask_arr = (occurrence_index_arr >= 0) & (read_count_arr != 0) & (lfn_ratio_dic['N_jk'] > lfn_njk_cutoff)
+
+        occurrence_arr_dic = {
+            'read_count': read_count_arr[row_mask_arr],
+            'lfn_ratio': lfn_ratio_dic[lfn_denominator][row_mask_arr],
+            'occurrence_index': occurrence_index_arr[row_mask_arr],
+            'is_keep': occurrence_df.is_keep.to_numpy(),
+            'is_delete': occurrence_df.is_delete.to_numpy()}
+        self.occurrence_arr_dic_cache[cache_key] = occurrence_arr_dic
+        return occurrence_arr_dic
+
+    def count_keep_delete(self, lfn_ni_cutoff, lfn_nik_cutoff, lfn_njk_cutoff, lfn_nijk_cutoff, min_replicate_number):
+        """Returns the number of known occurrences kept and deleted, as RunnerFilterLFNreplicateRemain.count_keep_delete
+
+        :return: tuple (count_keep, count_delete)
+        """
+
+        occurrence_arr_dic = self.get_occurrence_arr_dic(lfn_nik_cutoff=lfn_nik_cutoff, lfn_njk_cutoff=lfn_njk_cutoff)
+        lfn_ni_nik_cutoff = lfn_ni_cutoff if lfn_nik_cutoff is None else lfn_nik_cutoff
+
+        row_remain_arr = (occurrence_arr_dic['lfn_ratio'] > lfn_ni_nik_cutoff) \
+            & (occurrence_arr_dic['read_count'] >= lfn_nijk_cutoff)
+        # Replicate count of each occurrence after the LFN filters
+        replicate_count_arr = numpy.bincount(occurrence_arr_dic['occurrence_index'][row_remain_arr],
+                                             minlength=occurrence_arr_dic['is_keep'].shape[0])
+        occurrence_remain_arr = (replicate_count_arr > 0) & (replicate_count_arr >= min_replicate_number)
+
+        count_keep = int((occurrence_remain_arr & occurrence_arr_dic['is_keep']).sum())
+        count_delete = int((occurrence_remain_arr & occurrence_arr_dic['is_delete']).sum())
+        return count_keep, count_delete
+
+    @staticmethod
+    def get_count_keep_max_prefix_length(cutoff_lst, count_keep_fn, count_keep_max):
+        """Returns the number of first cutoffs of cutoff_lst with count_keep >= count_keep_max
+
+        count_keep does not increase with the cutoff, so the first cutoff with count_keep < count_keep_max is found
+        with a binary search if cutoff_lst is increasing, and with a linear search otherwise.
+
+        :param cutoff_lst: list of cutoffs
+        :param count_keep_fn: function of the cutoff that returns count_keep
+        :param count_keep_max: int
+        :return: int
+        """
+
+        if not all(cutoff_lst[i] <= cutoff_lst[i + 1] for i in range(len(cutoff_lst) - 1)):
+            for i, cutoff in enumerate(cutoff_lst):
+                if count_keep_fn(cutoff) < count_keep_max:
+                    return i
+            return len(cutoff_lst)
+
+        low = 0
+        high = len(cutoff_lst)
+        while low < high:
+            middle = (low + high) // 2
+            if count_keep_fn(cutoff_lst[middle]) < count_keep_max:
+                high = middle
+            else:
+                low = middle + 1
+        return low
 
-        out_lfn_nijk_cutoff_lst = []
+    @staticmethod
+    def get_lfn_ni_nik_cutoff_pair(lfn_ni_cutoff, lfn_nik_cutoff, lfn_ni_nik_cutoff_item):
+        """Returns (lfn_ni_cutoff, lfn_nik_cutoff) with the cutoff being optimized replaced by lfn_ni_nik_cutoff_item"""
 
-        count_keep_max = self.get_count_keep_max()
+        if lfn_nik_cutoff is None:
+            return lfn_ni_nik_cutoff_item, lfn_nik_cutoff
+        return lfn_ni_cutoff, lfn_ni_nik_cutoff_item
 
-        for lfn_nijk_cutoff_item in self.lfn_nijk_cutoff_lst:
+    def get_lst_one_par_lfn_nijk_cutoff(self, lfn_ni_cutoff, lfn_nik_cutoff, lfn_njk_cutoff, lfn_nijk_cutoff, min_replicate_number):
 
-            count_keep, count_delete = RunnerFilterLFNreplicateRemain(
-                nijk_df=self.nijk_df, lfn_ni_cutoff=lfn_ni_cutoff, lfn_nik_cutoff=lfn_nik_cutoff, lfn_njk_cutoff=lfn_njk_cutoff, lfn_nijk_cutoff=lfn_nijk_cutoff_item,
-                           min_replicate_number=min_replicate_number)\
-                .count_keep_delete(known_occurrences_df=self.known_occurrences_df)
+        """Loops through self.lfn_nijk_cutoff_lst and keeps only values while count_keep < count_keep_max"""
 
-            if count_keep < count_keep_max:
-                break  # stops when count_keep decreases below count_keep_max
+        count_keep_max = self.get_count_keep_max()
 
-            out_lfn_nijk_cutoff_lst.append(lfn_nijk_cutoff_item)
+        prefix_length = self.get_count_keep_max_prefix_length(
+            self.lfn_nijk_cutoff_lst, lambda lfn_nijk_cutoff_item: self.count_keep_delete(
+                lfn_ni_cutoff=lfn_ni_cutoff, lfn_nik_cutoff=lfn_nik_cutoff, lfn_njk_cutoff=lfn_njk_cutoff,
+                lfn_nijk_cutoff=lfn_nijk_cutoff_item, min_replicate_number=min_replicate_number)[0], count_keep_max)
+        # stops when count_keep decreases below count_keep_max
+        out_lfn_nijk_cutoff_lst = self.lfn_nijk_cutoff_lst[:prefix_length]
 
         return out_lfn_nijk_cutoff_lst
 
@@ -74,28 +186,15 @@ class RunnerOptimizeLFNreadCountAndVariantRunMarker:
 
         """Loops between default lfn_nijk_cutoff and vtam.utils.constants.lfn_nijk_cutoff_global_max to obtain count_keep_max"""
 
-        out_lfn_ni_nik_cutoff_lst = []
-
-        # lfn_ni_nik_cutoff_lst = self.get_lfn_ni_nik_cutoff_lst(start=lfn_ni_nik_cutoff, stop=lfn_ni_njk_cutoff_global_max, nb_points=lfn_ni_njk_cutoff_lst_size)
         count_keep_max = self.get_count_keep_max()
-        for lfn_ni_nik_cutoff_item in self.lfn_ni_nik_cutoff_lst:
-
-            if lfn_nik_cutoff is None:
-                count_keep, count_delete = RunnerFilterLFNreplicateRemain(
-                    nijk_df=self.nijk_df, lfn_ni_cutoff=lfn_ni_nik_cutoff_item, lfn_nik_cutoff=lfn_nik_cutoff, lfn_njk_cutoff=lfn_njk_cutoff, lfn_nijk_cutoff=lfn_nijk_cutoff,
-                               min_replicate_number=min_replicate_number)\
-                    .count_keep_delete(known_occurrences_df=self.known_occurrences_df)
-            else:
-                count_keep, count_delete = RunnerFilterLFNreplicateRemain(
-                    nijk_df=self.nijk_df, lfn_ni_cutoff=lfn_ni_cutoff, lfn_nik_cutoff=lfn_ni_nik_cutoff_item, lfn_njk_cutoff=lfn_njk_cutoff, lfn_nijk_cutoff=lfn_nijk_cutoff,
-                               min_replicate_number=min_replicate_number)\
-                    .count_keep_delete(known_occurrences_df=self.known_occurrences_df)
-
 
-            if count_keep < count_keep_max:
-                break  # stops when count_keep decreases below count_keep_max
-
-            out_lfn_ni_nik_cutoff_lst.append(lfn_ni_nik_cutoff_item)
+        prefix_length = self.get_count_keep_max_prefix_length(
+            self.lfn_ni_nik_cutoff_lst, lambda lfn_ni_nik_cutoff_item: self.count_keep_delete(
+                *self.get_lfn_ni_nik_cutoff_pair(lfn_ni_cutoff, lfn_nik_cutoff, lfn_ni_nik_cutoff_item),
+                lfn_njk_cutoff=lfn_njk_cutoff, lfn_nijk_cutoff=lfn_nijk_cutoff,
+                min_replicate_number=min_replicate_number)[0], count_keep_max)
+        # stops when count_keep decreases below count_keep_max
+        out_lfn_ni_nik_cutoff_lst = self.lfn_ni_nik_cutoff_lst[:prefix_length]
 
         return out_lfn_ni_nik_cutoff_lst
 
@@ -114,23 +213,22 @@ class RunnerOptimizeLFNreadCountAndVariantRunMarker:
         count_keep_max = self.get_count_keep_max()
         # loop over lfn_nijk_cutoff
         for lfn_nijk_cutoff_item in lfn_nijk_cutoff_lst:
+
+            def count_keep_delete_fn(lfn_ni_nik_cutoff_item):
+                return self.count_keep_delete(
+                    *self.get_lfn_ni_nik_cutoff_pair(lfn_ni_cutoff, lfn_nik_cutoff, lfn_ni_nik_cutoff_item),
+                    lfn_njk_cutoff=lfn_njk_cutoff, lfn_nijk_cutoff=lfn_nijk_cutoff_item,
+                    min_replicate_number=min_replicate_number)
+
+            # stops when count_keep decreases below count_keep_max
+            prefix_length = self.get_count_keep_max_prefix_length(
+                lfn_ni_nik_cutoff_lst, lambda lfn_ni_nik_cutoff_item: count_keep_delete_fn(lfn_ni_nik_cutoff_item)[0],
+                count_keep_max)
+
             # loop over lfn_ni_nik_cutoff: 0.001, 0.002, ...
-            for lfn_ni_nik_cutoff_item in lfn_ni_nik_cutoff_lst:
-
-                if lfn_nik_cutoff is None:
-                    count_keep, count_delete = RunnerFilterLFNreplicateRemain(
-                        nijk_df=self.nijk_df, lfn_ni_cutoff=lfn_ni_nik_cutoff_item,
-                        lfn_nik_cutoff=lfn_nik_cutoff, lfn_njk_cutoff=lfn_njk_cutoff,
-                        lfn_nijk_cutoff=lfn_nijk_cutoff_item,
-                        min_replicate_number=min_replicate_number) \
-                        .count_keep_delete(known_occurrences_df=self.known_occurrences_df)
-                else:
-                    count_keep, count_delete = RunnerFilterLFNreplicateRemain(
-                        nijk_df=self.nijk_df, lfn_ni_cutoff=lfn_ni_cutoff,
-                        lfn_nik_cutoff=lfn_ni_nik_cutoff_item, lfn_njk_cutoff=lfn_njk_cutoff,
-                        lfn_nijk_cutoff=lfn_nijk_cutoff_item,
-                        min_replicate_number=min_replicate_number) \
-                        .count_keep_delete(known_occurrences_df=self.known_occurrences_df)
+            for lfn_ni_nik_cutoff_item in lfn_ni_nik_cutoff_lst[:prefix_length]:
+
+                count_keep, count_delete = count_keep_delete_fn(lfn_ni_nik_cutoff_item)
 
                 ################################################################################
                 #
@@ -138,14 +236,11 @@ class RunnerOptimizeLFNreadCountAndVariantRunMarker:
                 #
                 ################################################################################
 
-                if count_keep >= count_keep_max:  # Store results if count_keep maximal
-                    out_lfn_variant_row_dic = {
-                        "lfn_ni_nik_cutoff": lfn_ni_nik_cutoff_item,
-                        "lfn_nijk_cutoff": lfn_nijk_cutoff_item,
-                        "occurrence_nb_keep": count_keep, "occurrence_nb_delete": count_delete}
-                    out_two_pars_lst.append(out_lfn_variant_row_dic)
-                else:
-                    break  # stops when count_keep decreases below count_keep_max
+                out_lfn_variant_row_dic = {
+                    "lfn_ni_nik_cutoff": lfn_ni_nik_cutoff_item,
+                    "lfn_nijk_cutoff": lfn_nijk_cutoff_item,
+                    "occurrence_nb_keep": count_keep, "occurrence_nb_delete": count_delete}
+                out_two_pars_lst.append(out_lfn_variant_row_dic)
 
         out_two_pars_df = pandas.DataFrame(out_two_pars_lst)
         column_names = ['occurrence_nb_keep', 'occurrence_nb_delete', 'lfn_nijk_cutoff',
@@ -156,6 +251,96 @@ class RunnerOptimizeLFNreadCountAndVariantRunMarker:
                                                inplace=True)
         return out_two_pars_df
 
+    def get_df_optim_lfn_readcount_variant_replicate_cutoff_exact(
+            self, lfn_ni_cutoff, lfn_nik_cutoff, lfn_njk_cutoff, lfn_nijk_cutoff, min_replicate_number,
+            lfn_nijk_cutoff_max, lfn_ni_nik_cutoff_max):
+
+        """Exact version of get_df_optim_lfn_readcount_variant_replicate_cutoff that sweeps all the cutoffs
+
+        Instead of a grid, lfn_nijk_cutoff takes each read count and lfn_ni_nik_cutoff each N_ijk/N_i (Or N_ijk/N_ik)
+        ratio of the known occurrences above the default cutoffs and below the maximal cutoffs, so that each cutoff
+        deletes at least one more row. For a given lfn_nijk_cutoff, an occurrence remains while lfn_ni_nik_cutoff is
+        below the min_replicate_number-th largest ratio of its rows, so the counts of all the lfn_ni_nik_cutoff values
+        come from one sort of these ratios. As in the grid, the loops stop when count_keep decreases below
+        count_keep_max. For each lfn_nijk_cutoff, only the lowest lfn_ni_nik_cutoff of each count is kept.
+
+        :param lfn_nijk_cutoff_max: lfn_nijk_cutoff values are below this value
+        :param lfn_ni_nik_cutoff_max: lfn_ni_nik_cutoff values are below this value
+        :return: DataFrame with the same columns as get_df_optim_lfn_readcount_variant_replicate_cutoff
+        """
+
+        occurrence_arr_dic = self.get_occurrence_arr_dic(lfn_nik_cutoff=lfn_nik_cutoff, lfn_njk_cutoff=lfn_njk_cutoff)
+        lfn_ni_nik_cutoff = lfn_ni_cutoff if lfn_nik_cutoff is None else lfn_nik_cutoff
+        min_replicate_number = max(int(min_replicate_number), 1)
+        count_keep_max = self.get_count_keep_max()
+
+        # Rows sorted by occurrence and by decreasing ratio
+        order_arr = numpy.lexsort((-occurrence_arr_dic['lfn_ratio'], occurrence_arr_dic['occurrence_index']))
+        read_count_arr = occurrence_arr_dic['read_count'][order_arr]
+        lfn_ratio_arr = occurrence_arr_dic['lfn_ratio'][order_arr]
+        occurrence_index_arr = occurrence_arr_dic['occurrence_index'][order_arr]
+        is_keep_arr = occurrence_arr_dic['is_keep']
+        is_delete_arr = occurrence_arr_dic['is_delete']
+
+        lfn_nijk_cutoff_arr = numpy.unique(numpy.concatenate([[lfn_nijk_cutoff], read_count_arr[
+            (read_count_arr > lfn_nijk_cutoff) & (read_count_arr < lfn_nijk_cutoff_max)]]))
+        lfn_ni_nik_cutoff_arr = numpy.unique(numpy.concatenate([[lfn_ni_nik_cutoff], lfn_ratio_arr[
+            (lfn_ratio_arr > lfn_ni_nik_cutoff) & (lfn_ratio_arr < lfn_ni_nik_cutoff_max)]]))
+
+        out_two_pars_lst = []
+        for lfn_nijk_cutoff_item in lfn_nijk_cutoff_arr:
+
+            ########################################################################################
+            #
+            # Ratio of each occurrence above which it is deleted
+            #
+            ########################################################################################
+
+            row_remain_arr = read_count_arr >= lfn_nijk_cutoff_item
+            occurrence_remain_arr = occurrence_index_arr[row_remain_arr]
+            lfn_ratio_remain_arr = lfn_ratio_arr[row_remain_arr]
+            # Rank of each row among the rows of its occurrence
+            rank_arr = numpy.arange(occurrence_remain_arr.shape[0]) - numpy.searchsorted(
+                occurrence_remain_arr, occurrence_remain_arr, side='left')
+            occurrence_ratio_arr = numpy.full(is_keep_arr.shape[0], -numpy.inf)
+            occurrence_ratio_arr[occurrence_remain_arr[rank_arr == min_replicate_number - 1]] = \
+                lfn_ratio_remain_arr[rank_arr == min_replicate_number - 1]
+
+            ########################################################################################
+            #
+            # count_keep and count_delete of all the lfn_ni_nik_cutoff values
+            #
+            ########################################################################################
+
+            keep_ratio_arr = numpy.sort(occurrence_ratio_arr[is_keep_arr])
+            delete_ratio_arr = numpy.sort(occurrence_ratio_arr[is_delete_arr])
+            count_keep_arr = keep_ratio_arr.shape[0] - numpy.searchsorted(
+                keep_ratio_arr, lfn_ni_nik_cutoff_arr, side='right')
+            count_delete_arr = delete_ratio_arr.shape[0] - numpy.searchsorted(
+                delete_ratio_arr, lfn_ni_nik_cutoff_arr, side='right')
+
+            prefix_length = int((count_keep_arr >= count_keep_max).sum())  # count_keep does not increase
+            if prefix_length == 0:
+                break  # stops when count_keep decreases below count_keep_max
+
+            for i in range(prefix_length):
+                if i > 0 and count_keep_arr[i] == count_keep_arr[i - 1] \
+                        and count_delete_arr[i] == count_delete_arr[i - 1]:
+                    continue
+                out_two_pars_lst.append({
+                    "lfn_ni_nik_cutoff": lfn_ni_nik_cutoff_arr[i].item(),
+                    "lfn_nijk_cutoff": lfn_nijk_cutoff_item.item(),
+                    "occurrence_nb_keep": int(count_keep_arr[i]),
+                    "occurrence_nb_delete": int(count_delete_arr[i])})
+
+        column_names = ['occurrence_nb_keep', 'occurrence_nb_delete', 'lfn_nijk_cutoff',
+                        'lfn_ni_nik_cutoff']
+        out_two_pars_df = pandas.DataFrame(out_two_pars_lst, columns=column_names)
+        out_two_pars_df.sort_values(by=column_names,
+                                               ascending=[False, True, False, False],
+                                               inplace=True)
+        return out_two_pars_df
+
     def get_df_variant_specific_cutoffs(self, lfn_nik_cutoff):
 
         """Two parameter loop for lfn_nijk_cutoff and lfn_ni_cutoff/lfn_nik_cutoff to get keep_nb, delete_nb with the two parameters"""
@@ -5,6 +5,7 @@ from vtam.models.Marker import Marker
 from vtam.models.Run import Run
 from vtam.utils.RunnerFilterPCRerror import RunnerFilterPCRerror
 from vtam.utils.NameIdConverter import NameIdConverter
+from vtam.utils.SequenceNeighbourIndex import SequenceNeighbourIndex
 
 
 class RunnerOptimizePCRerror:
@@ -41,12 +42,23 @@ class RunnerOptimizePCRerror:
 
         known_occurrences_run_marker_sample_df = self.known_occurrences_df[
             ['run_id', 'marker_id', 'sample_id']].drop_duplicates()
+        # One index of the expected variants of all the mock samples per run-marker
+        sequence_neighbour_index_dic = {}
         for row in known_occurrences_run_marker_sample_df.itertuples():
 
             run_id = row.run_id
             marker_id = row.marker_id
             sample_id = row.sample_id
 
+            if (run_id, marker_id) not in sequence_neighbour_index_dic:
+                sequence_expected_run_marker = known_occurrences_df.loc[(known_occurrences_df.run_id == run_id) & (
+                    known_occurrences_df.marker_id == marker_id) & (known_occurrences_df.action == 'keep'),
+                    'variant_sequence'].drop_duplicates()
+                variant_expected_run_marker = NameIdConverter(id_name_or_sequence_list=sequence_expected_run_marker,
+                                                              engine=engine).variant_sequence_to_id()
+                sequence_neighbour_index_dic[(run_id, marker_id)] = SequenceNeighbourIndex(variant_df=pandas.DataFrame(
+                    {'sequence': sequence_expected_run_marker.tolist()}, index=variant_expected_run_marker))
+
             sequence_expected = known_occurrences_df.loc[(known_occurrences_df.run_id == run_id) & (
                         known_occurrences_df.marker_id == marker_id) & (
                                          known_occurrences_df.sample_id == sample_id) & (
@@ -77,7 +89,8 @@ class RunnerOptimizePCRerror:
 
             filter_pcr_error_runner = RunnerFilterPCRerror(
                 variant_expected_df=variant_expected_df, variant_unexpected_df=variant_unexpected_df,
-                variant_read_count_df=variant_read_count_per_sample_df)
+                variant_read_count_df=variant_read_count_per_sample_df,
+                sequence_neighbour_index=sequence_neighbour_index_dic[(run_id, marker_id)])
 
             pcr_error_df = filter_pcr_error_runner.get_variant_unexpected_to_expected_ratio_df()
 
@@ -0,0 +1,242 @@
+import os
+import shutil
+
+import numpy
+
+from vtam.utils.Logger import Logger
+from vtam.utils.PathManager import PathManager
+
+
+class RunnerSortReads(object):
+    """Demultiplexes and trims the reads of one merged FASTA file in a single pass
+
+    The reads are matched with the same rules as the former cutadapt calls: tags are exact, full-length,
+    non-anchored linked adapters (--no-indels --error-rate 0) and primers are full-length linked adapters
+    without indels and with at most int(error_rate * primer length) mismatches, where IUPAC codes of the primers
+    are wildcards. Reads are searched in the forward and in the reverse-complement orientation. The reverse
+    reads are reverse-complemented and appended after the forward reads of the same sorted file."""
+
+    # IUPAC code of each nucleotide as a bit mask. The read N has its own bit so that it matches only the primer N
+    iupac_bit_dic = {'A': 1, 'C': 2, 'G': 4, 'T': 8, 'U': 8, 'R': 5, 'Y': 10, 'S': 6, 'W': 9, 'K': 12,
+                     'M': 3, 'B': 14, 'D': 13, 'H': 11, 'V': 7, 'N': 31}
+    read_bit_dic = {'A': 1, 'C': 2, 'G': 4, 'T': 8, 'U': 8, 'N': 16}
+
+    complement_table = str.maketrans('ACGTURYSWKMBDHVNacgturyswkmbdhvn', 'TGCAAYRSWMKVHDBNtgcaayrswmkvhdbn')
+
+    def __init__(self, fastainfo_df, in_fasta_path, sorteddir, cutadapt_error_rate, cutadapt_minimum_length,
+                 cutadapt_maximum_length):
+        """
+        :param fastainfo_df: rows of the fastainfo TSV that share the same merged FASTA. The DataFrame index numbers the sorted files
+        :param in_fasta_path: path to the merged FASTA file
+        :param sorteddir: output directory of the sorted FASTA files
+        :param cutadapt_error_rate: maximal mismatch rate in the primers
+        :param cutadapt_minimum_length: minimal length of the trimmed reads
+        :param cutadapt_maximum_length: maximal length of the trimmed reads
+        """
+
+        self.fastainfo_df = fastainfo_df
+        self.in_fasta_path = in_fasta_path
+        self.sorteddir = sorteddir
+        self.cutadapt_error_rate = cutadapt_error_rate
+        self.cutadapt_minimum_length = cutadapt_minimum_length
+        self.cutadapt_maximum_length = cutadapt_maximum_length
+
+        self.read_code_lookup = numpy.zeros(256, dtype='uint8')
+        for nucleotide, bit in self.read_bit_dic.items():
+            self.read_code_lookup[ord(nucleotide)] = bit
+
+    @classmethod
+    def reverse_complement(cls, sequence):
+
+        return sequence.translate(cls.complement_table)[::-1]
+
+    @staticmethod
+    def read_fasta(fasta_path):
+        """Yields (header, sequence) tuples of a, possibly multi-line, FASTA file
+
+        :param fasta_path: FASTA path
+        :return: generator of tuples with header without '>' and sequence
+        """
+
+        header = None
+        sequence_lst = []
+        with open(fasta_path) as fin:
+            for line in fin:
+                line = line.rstrip()
+                if line.startswith('>'):
+                    if header is not None:
+                        yield header, ''.join(sequence_lst)
+                    header = line[1:]
+                    sequence_lst = []
+                elif line:
+                    sequence_lst.append(line)
+        if header is not None:
+            yield header, ''.join(sequence_lst)
+
+    def get_demultiplexing_index(self):
+        """Indexes the linked tags and primers of all rows in both orientations
+
+        Tags are looked up in the dictionaries at each position of the reads, see find_tags.
+
+        :return: dictionary tag_5prime -> tag_3prime -> list of (row index, is_reverse, primer_5prime_codes, primer_3prime_codes)
+        """
+
+        index_dic = {}
+        for i, row in self.fastainfo_df.iterrows():
+            tag_fwd = row.tagfwd.upper()
+            tag_rev = row.tagrev.upper()
+            primer_fwd = row.primerfwd.upper()
+            primer_rev = row.primerrev.upper()
+            linked_lst = [
+                (False, tag_fwd, self.reverse_complement(tag_rev), primer_fwd, self.reverse_complement(primer_rev)),
+                (True, tag_rev, self.reverse_complement(tag_fwd), primer_rev, self.reverse_complement(primer_fwd)),
+            ]
+            for is_reverse, tag_5prime, tag_3prime, primer_5prime, primer_3prime in linked_lst:
+                index_dic.setdefault(tag_5prime, {}).setdefault(tag_3prime, []).append(
+                    (i, is_reverse, self.encode_primer(primer_5prime), self.encode_primer(primer_3prime)))
+        return index_dic
+
+    @staticmethod
+    def get_tag_length_lst(tag_dic):
+
+        return sorted({len(tag) for tag in tag_dic})
+
+    @staticmethod
+    def find_tags(sequence, tag_dic, tag_length_lst, start=0):
+        """Finds the leftmost occurrence from start of each tag of tag_dic in the sequence
+
+        The substrings of the sequence with the tag lengths are looked up in tag_dic, so that the cost does not
+        depend on the number of tags.
+
+        :param sequence: read sequence
+        :param tag_dic: dictionary with the tags as keys
+        :param tag_length_lst: lengths of the tags of tag_dic
+        :param start: start position of the search
+        :return: dictionary tag -> position
+        """
+
+        position_dic = {}
+        for tag_length in tag_length_lst:
+            for position in range(start, len(sequence) - tag_length + 1):
+                tag = sequence[position:position + tag_length]
+                if tag in tag_dic and tag not in position_dic:
+                    position_dic[tag] = position
+        return position_dic
+
+    def encode_primer(self, primer):
+
+        return numpy.array([self.iupac_bit_dic.get(nucleotide, 0) for nucleotide in primer], dtype='uint8')
+
+    def locate_primer(self, read_codes, primer_codes):
+        """Finds the leftmost best full-length ungapped match of the primer in the read
+
+        :param read_codes: numpy array with read_bit_dic codes of the read
+        :param primer_codes: numpy array with iupac_bit_dic codes of the primer
+        :return: start position of the match or -1
+        """
+
+        primer_len = primer_codes.shape[0]
+        if read_codes.shape[0] < primer_len:
+            return -1
+        windows = numpy.lib.stride_tricks.as_strided(
+            read_codes, shape=(read_codes.shape[0] - primer_len + 1, primer_len),
+            strides=(read_codes.strides[0], read_codes.strides[0]), writeable=False)
+        match_count = ((windows & primer_codes) > 0).sum(axis=1)
+        position = int(match_count.argmax())
+        max_errors = int(self.cutadapt_error_rate * primer_len)
+        if primer_len - match_count[position] > max_errors:
+            return -1
+        return position
+
+    def trim_primers(self, read_codes, start, end, primer_5prime_codes, primer_3prime_codes):
+        """Returns the (start, end) coordinates of the read between the primers or None"""
+
+        position_5prime = self.locate_primer(read_codes[start:end], primer_5prime_codes)
+        if position_5prime < 0:
+            return None
+        start = start + position_5prime + primer_5prime_codes.shape[0]
+        position_3prime = self.locate_primer(read_codes[start:end], primer_3prime_codes)
+        if position_3prime < 0:
+            return None
+        end = start + position_3prime
+        if not (self.cutadapt_minimum_length <= end - start <= self.cutadapt_maximum_length):
+            return None
+        return start, end
+
+    def get_sorted_fasta_basename(self, i):
+
+        return os.path.basename(self.in_fasta_path).replace('.fasta', '_%03d.fasta' % i)
+
+    def run(self):
+        """Reads the merged FASTA once and writes one sorted FASTA per row of fastainfo_df
+
+        :return: DataFrame with columns run, marker, sample, replicate, sortedfasta
+        """
+
+        Logger.instance().debug("Analysing FASTA file: {}".format(self.in_fasta_path))
+
+        tempdir = PathManager.instance().get_tempdir()
+        index_dic = self.get_demultiplexing_index()
+        tag_5prime_length_lst = self.get_tag_length_lst(index_dic)
+        tag_3prime_length_dic = {tag_5prime: self.get_tag_length_lst(tag_3prime_dic) for tag_5prime, tag_3prime_dic
+                                 in index_dic.items()}
+
+        fout_dic = {}
+        fout_rc_dic = {}
+        rc_fasta_path_dic = {}
+        read_count_dic = {}
+        for i in self.fastainfo_df.index:
+            fout_dic[i] = open(os.path.join(self.sorteddir, self.get_sorted_fasta_basename(i)), 'w')
+            rc_fasta_path_dic[i] = os.path.join(tempdir, os.path.basename(self.in_fasta_path).replace(
+                '.fasta', '_rc_sorted_trimmed_%03d.fasta' % i))
+            fout_rc_dic[i] = open(rc_fasta_path_dic[i], 'w')
+            read_count_dic[i] = 0
+
+        try:
+            for header, sequence in self.read_fasta(self.in_fasta_path):
+                sequence_upper = sequence.upper()
+                read_codes = None
+                for tag_5prime, position_5prime in self.find_tags(
+                        sequence_upper, index_dic, tag_5prime_length_lst).items():
+                    start = position_5prime + len(tag_5prime)
+                    tag_3prime_dic = index_dic[tag_5prime]
+                    for tag_3prime, end in self.find_tags(
+                            sequence_upper, tag_3prime_dic, tag_3prime_length_dic[tag_5prime], start).items():
+                        target_lst = tag_3prime_dic[tag_3prime]
+                        if read_codes is None:
+                            read_codes = self.read_code_lookup[numpy.frombuffer(
+                                sequence_upper.encode('ascii', 'replace'), dtype='uint8')]
+                        for i, is_reverse, primer_5prime_codes, primer_3prime_codes in target_lst:
+                            trimmed = self.trim_primers(read_codes, start, end, primer_5prime_codes,
+                                                        primer_3prime_codes)
+                            if trimmed is None:
+                                continue
+                            read_count_dic[i] += 1
+                            if is_reverse:
+                                fout_rc_dic[i].write(">{}\n{}\n".format(
+                                    header, self.reverse_complement(sequence[trimmed[0]:trimmed[1]])))
+                            else:
+                                fout_dic[i].write(">{}\n{}\n".format(header, sequence[trimmed[0]:trimmed[1]]))
+        finally:
+            for fout in list(fout_dic.values()) + list(fout_rc_dic.values()):
+                fout.close()
+
+        ############################################################################################
+        #
+        # Pool fwd and reverse-complemented rc reads
+        #
+        ############################################################################################
+
+        Logger.instance().debug("Pooling fwd and rc reads...")
+        for i in self.fastainfo_df.index:
+            with open(os.path.join(self.sorteddir, self.get_sorted_fasta_basename(i)), 'a') as fout:
+                with open(rc_fasta_path_dic[i]) as fin:
+                    shutil.copyfileobj(fin, fout)
+            os.remove(rc_fasta_path_dic[i])
+            Logger.instance().debug("Sorted reads in {}: {}".format(
+                self.get_sorted_fasta_basename(i), read_count_dic[i]))
+
+        sorted_read_info_df = self.fastainfo_df[['run', 'marker', 'sample', 'replicate']].copy()
+        sorted_read_info_df['sortedfasta'] = [self.get_sorted_fasta_basename(i) for i in self.fastainfo_df.index]
+
+        return sorted_read_info_df
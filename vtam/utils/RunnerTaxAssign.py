@@ -1,4 +1,5 @@
 import inspect
+import numpy
 import os
 import pandas
 import pathlib
@@ -27,8 +28,6 @@ class RunnerTaxAssign(object):
 
         """
 
-        self.old_tax_id_df = taxonomy.old_tax_df
-        self.taxonomy_df = taxonomy.df
         self.blast_db_dir = blast_db_dir
         self.this_temp_dir = os.path.join(PathManager.instance().get_tempdir(),
             os.path.basename(__file__))
@@ -69,7 +68,7 @@ class RunnerTaxAssign(object):
             num_threads, qcov_hsp_perc)
         # run blast
         blast_output_tsv = runner_blast.run_local_blast()
-        # process blast results
+        # process blast results, aggregated by variant, identity step and target tax id
         blast_output_df = RunnerBlast.process_blast_result(blast_output_tsv)
 
         #######################################################################
@@ -87,6 +86,9 @@ class RunnerTaxAssign(object):
                 __file__, inspect.currentframe().f_lineno))
         tax_id_list = blast_output_df.target_tax_id.unique().tolist()
         tax_id_to_lineage_df = taxonomy.get_several_tax_id_lineages(tax_id_list)
+        # Names of the tax ids in the lineages, the candidate LTGs
+        lineage_tax_id_arr = tax_id_to_lineage_df.to_numpy(dtype='float').ravel()
+        self.taxonomy_df = taxonomy.get_name_df(lineage_tax_id_arr[~numpy.isnan(lineage_tax_id_arr)])
 
         #######################################################################
         #
@@ -105,8 +107,7 @@ class RunnerTaxAssign(object):
         # variant_identity_lineage_df.drop('tax_id', axis=1, inplace=True)
 
         """(Pdb) variant_identity_lineage_df.columns  
-Index(['variant_id', 'target_id', 'identity', 'evalue', 'coverage',
-       'target_tax_id', 'no rank', 'species', 'genus', 'family', 'order',
+Index(['variant_id', 'identity', 'target_tax_id', 'hit_count', 'no rank', 'species', 'genus', 'family', 'order',
        'class', 'subphylum', 'phylum', 'subkingdom', 'kingdom', 'superkingdom',
        'superfamily', 'infraorder', 'suborder', 'infraclass', 'subclass',
        'tribe', 'subfamily', 'cohort', 'subgenus', 'subspecies', 'parvorder',
@@ -0,0 +1,155 @@
+import collections
+import multiprocessing
+import os
+
+import numpy
+import pandas
+import sqlalchemy
+
+from vtam.utils.Logger import Logger
+from vtam.utils import constants
+
+
+class RunnerVariantReadCount(object):
+    """Counts the reads of the sorted FASTA files of each run, marker, sample and replicate
+
+    The FASTA files are streamed line by line and only a 'sequence -> count' map is kept for each sample-replicate,
+    so that the memory scales with the number of distinct variants and not with the number of reads"""
+
+    def __init__(self, sample_info_ids_df, read_dir, num_threads=1):
+        """
+        :param sample_info_ids_df: DataFrame with columns run_id, marker_id, sample_id, replicate, sortedfasta
+        :param read_dir: directory of the sorted FASTA files
+        :param num_threads: number of worker processes counting the FASTA files, one file per task
+        """
+
+        self.sample_info_ids_df = sample_info_ids_df
+        self.read_dir = read_dir
+        self.num_threads = num_threads
+
+    @staticmethod
+    def count_fasta_reads(fasta_path):
+        """Counts the upper-case read sequences of a, possibly multi-line, FASTA file
+
+        :param fasta_path: FASTA path
+        :return: collections.Counter with sequence keys and read count values
+        """
+
+        read_count_counter = collections.Counter()
+        sequence_lst = None
+        with open(fasta_path) as fin:
+            for line in fin:
+                if line.startswith('>'):
+                    if sequence_lst is not None:
+                        read_count_counter[''.join(sequence_lst)] += 1
+                    sequence_lst = []
+                elif sequence_lst is not None:
+                    sequence_lst.append(line.strip().upper())
+        if sequence_lst is not None:
+            read_count_counter[''.join(sequence_lst)] += 1
+        return read_count_counter
+
+    def get_variant_read_count_df(self):
+        """Counts the reads of each sorted FASTA and merges the counts in a columnar DataFrame
+
+        :return: DataFrame with columns run_id, marker_id, sample_id, replicate, read_sequence, read_count
+        """
+
+        column_lst_dic = {}
+        for column in ['run_id', 'marker_id', 'sample_id', 'replicate', 'read_sequence', 'read_count']:
+            column_lst_dic[column] = [numpy.array([], dtype='object' if column == 'read_sequence' else 'int64')]
+
+        sample_info_ids_df = self.sample_info_ids_df.copy()
+        sample_info_ids_df['read_fasta_path'] = [
+            os.path.join(self.read_dir, sortedfasta) for sortedfasta in sample_info_ids_df.sortedfasta]
+        is_file = sample_info_ids_df.read_fasta_path.apply(os.path.exists)
+        for read_fasta_path in sample_info_ids_df.loc[~is_file, 'read_fasta_path']:
+            Logger.instance().warning('This file {} doest not exists'.format(read_fasta_path))
+        sample_info_ids_df = sample_info_ids_df.loc[is_file]
+        read_fasta_path_lst = sample_info_ids_df.read_fasta_path.tolist()
+
+        ############################################################################################
+        #
+        # Count reads of each file, in worker processes if several threads.
+        # Counters come back in the file order and are merged in the parent process.
+        #
+        ############################################################################################
+
+        num_processes = max(1, min(int(self.num_threads), len(read_fasta_path_lst)))
+        if num_processes > 1:
+            pool = multiprocessing.Pool(processes=num_processes)
+            read_count_counter_iter = pool.imap(self.count_fasta_reads, read_fasta_path_lst, chunksize=1)
+        else:
+            pool = None
+            read_count_counter_iter = map(self.count_fasta_reads, read_fasta_path_lst)
+
+        try:
+            for row, read_count_counter in zip(sample_info_ids_df.itertuples(), read_count_counter_iter):
+
+                Logger.instance().debug("Read FASTA: {}".format(row.read_fasta_path))
+                variant_count = len(read_count_counter)
+
+                column_lst_dic['run_id'].append(numpy.full(variant_count, row.run_id, dtype='int64'))
+                column_lst_dic['marker_id'].append(numpy.full(variant_count, row.marker_id, dtype='int64'))
+                column_lst_dic['sample_id'].append(numpy.full(variant_count, row.sample_id, dtype='int64'))
+                column_lst_dic['replicate'].append(numpy.full(variant_count, row.replicate, dtype='int64'))
+                column_lst_dic['read_sequence'].append(
+                    numpy.array(list(read_count_counter.keys()), dtype='object'))
+                column_lst_dic['read_count'].append(numpy.fromiter(read_count_counter.values(), dtype='int64',
+                                                                   count=variant_count))
+        except BaseException:  # The remaining files are not counted
+            if pool is not None:
+                pool.terminate()
+            raise
+        else:
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.join()
+
+        variant_read_count_df = pandas.DataFrame(
+            {column: numpy.concatenate(array_lst) for column, array_lst in column_lst_dic.items()})
+
+        return variant_read_count_df
+
+    @staticmethod
+    def get_variant_id_df(variant_read_count_df, variant_model, engine):
+        """Resolves the variant IDs of the variant sequences in bulk
+
+        Existing IDs are read from the Variant table with one chunked 'IN' query per constants.sql_in_chunk_size
+        distinct sequences. New sequences get consecutive IDs after the maximal Variant ID, in the order of
+        first appearance in variant_read_count_df.
+
+        :param variant_read_count_df: DataFrame with at least a variant_sequence column
+        :param variant_model: Variant SQLAlchemy model
+        :param engine: SQLAlchemy engine
+        :return: tuple with variant_read_count_df with a new variant_id column and the DataFrame with columns id, sequence of the new variants
+        """
+
+        variant_table = variant_model.__table__
+        variant_sequence_lst = variant_read_count_df.variant_sequence.drop_duplicates().tolist()
+
+        variant_id_dic = {}
+        with engine.connect() as conn:
+            variant_id_max = conn.execute(sqlalchemy.select([sqlalchemy.func.max(variant_table.c.id)])).first()[0]
+            for i in range(0, len(variant_sequence_lst), constants.sql_in_chunk_size):
+                stmt_select = sqlalchemy.select([variant_table.c.id, variant_table.c.sequence]).where(
+                    variant_table.c.sequence.in_(variant_sequence_lst[i:i + constants.sql_in_chunk_size]))
+                for variant_id, sequence in conn.execute(stmt_select):
+                    variant_id_dic[sequence] = variant_id
+        if variant_id_max is None:
+            variant_id_max = 0  # If no variants, then maximal variant id is 0
+
+        variant_df = pandas.DataFrame({'variant_sequence': variant_sequence_lst})
+        variant_df['variant_id'] = variant_df.variant_sequence.map(variant_id_dic)
+        is_new = variant_df.variant_id.isna()
+        variant_df.loc[is_new, 'variant_id'] = numpy.arange(variant_id_max + 1, variant_id_max + 1 + is_new.sum())
+        variant_df['variant_id'] = variant_df.variant_id.astype('int64')
+
+        variant_new_df = variant_df.loc[is_new].rename(columns={'variant_id': 'id', 'variant_sequence': 'sequence'})
+        variant_read_count_df = variant_read_count_df.copy()
+        variant_read_count_df['variant_id'] = variant_read_count_df.variant_sequence.map(
+            variant_df.set_index('variant_sequence').variant_id)
+
+        return variant_read_count_df, variant_new_df[['id', 'sequence']]
@@ -0,0 +1,131 @@
+import numpy
+import pandas
+
+
+class SequenceNeighbourIndex(object):
+    """Finds the pairs of sequences that differ by at most one mismatch or one gap, without alignment
+
+    Each indexed sequence of length L is represented by the hashes of its L one-deletion sequences. Two sequences
+    of the same length differ by one mismatch at position p if their deletions at position p are equal. A sequence
+    is one gap away from a sequence one nucleotide longer if it is equal to one of its deletions. Candidate pairs
+    found with the hashes are verified on the sequences.
+
+    The index is built once and can be queried, for instance, with the variants of each sample of a run-marker."""
+
+    def __init__(self, variant_df):
+        """
+        :param variant_df: DataFrame (id, sequence) with the variant IDs as index
+        """
+
+        self.variant_id_arr = variant_df.index.to_numpy()
+        self.sequence_lst = variant_df.sequence.tolist()
+        self.sequence_df = self.get_sequence_df(self.sequence_lst)
+        self.deletion_df = self.get_deletion_df(self.sequence_lst)
+
+    @staticmethod
+    def get_sequence_df(sequence_lst):
+        """Returns DataFrame (idx, hash, length) of the sequences"""
+
+        return pandas.DataFrame({
+            'idx': numpy.arange(len(sequence_lst), dtype='int64'),
+            'hash': numpy.array([hash(sequence) for sequence in sequence_lst], dtype='int64'),
+            'length': numpy.array([len(sequence) for sequence in sequence_lst], dtype='int64')})
+
+    @staticmethod
+    def get_deletion_df(sequence_lst):
+        """Returns DataFrame (idx, hash, length, position) of the one-deletion sequences of the sequences
+
+        The length is the length of the sequence after the deletion
+        """
+
+        length_arr = numpy.array([len(sequence) for sequence in sequence_lst], dtype='int64')
+        hash_lst = []
+        for sequence in sequence_lst:
+            hash_lst += [hash(sequence[:position] + sequence[position + 1:]) for position in range(len(sequence))]
+
+        return pandas.DataFrame({
+            'idx': numpy.repeat(numpy.arange(len(sequence_lst), dtype='int64'), length_arr),
+            'hash': numpy.array(hash_lst, dtype='int64'),
+            'length': numpy.repeat(length_arr - 1, length_arr),
+            'position': numpy.concatenate([numpy.arange(length, dtype='int64') for length in length_arr] + [
+                numpy.array([], dtype='int64')])})
+
+    def get_one_edit_pair_df(self, query_variant_df):
+        """Returns the pairs of query and indexed variants with identical sequences or one mismatch or one gap
+
+        :param query_variant_df: DataFrame (id, sequence) with the variant IDs as index
+        :return: DataFrame (variant_id_query, variant_id_target, alnlen, ids, mism, gaps)
+        """
+
+        query_sequence_lst = query_variant_df.sequence.tolist()
+        query_sequence_df = self.get_sequence_df(query_sequence_lst)
+        query_deletion_df = self.get_deletion_df(query_sequence_lst)
+
+        ############################################################################################
+        #
+        # Candidate pairs: identical, one mismatch, one gap in the target or in the query
+        #
+        ############################################################################################
+
+        identical_df = query_sequence_df.merge(self.sequence_df, on=['hash', 'length'])
+        mismatch_df = query_deletion_df.merge(self.deletion_df, on=['hash', 'length', 'position'])
+        target_gap_df = query_deletion_df.merge(self.sequence_df, on=['hash', 'length'])
+        query_gap_df = query_sequence_df.merge(self.deletion_df, on=['hash', 'length'])
+
+        pair_df_lst = []
+        for candidate_df, mism, gaps in [(identical_df, 0, 0), (mismatch_df, 1, 0), (target_gap_df, 0, 1),
+                                         (query_gap_df, 0, 1)]:
+            candidate_df = candidate_df[['idx_x', 'idx_y']].drop_duplicates()
+            candidate_df.columns = ['query_idx', 'target_idx']
+            candidate_df = candidate_df.loc[[self.is_pair(
+                query_sequence_lst[query_idx], self.sequence_lst[target_idx], mism, gaps) for query_idx, target_idx in
+                zip(candidate_df.query_idx, candidate_df.target_idx)]].copy()
+            candidate_df['mism'] = mism
+            candidate_df['gaps'] = gaps
+            pair_df_lst.append(candidate_df)
+
+        pair_df = pandas.concat(pair_df_lst, axis=0).sort_values(['query_idx', 'target_idx'])
+
+        ############################################################################################
+        #
+        # Alignment statistics as in the vsearch userfields
+        #
+        ############################################################################################
+
+        query_length_arr = query_sequence_df.length.to_numpy()[pair_df.query_idx.to_numpy()]
+        target_length_arr = self.sequence_df.length.to_numpy()[pair_df.target_idx.to_numpy()]
+
+        alignement_df = pandas.DataFrame({
+            'variant_id_query': query_variant_df.index.to_numpy()[pair_df.query_idx.to_numpy()],
+            'variant_id_target': self.variant_id_arr[pair_df.target_idx.to_numpy()],
+            'alnlen': numpy.maximum(query_length_arr, target_length_arr),
+            'ids': numpy.minimum(query_length_arr, target_length_arr) - pair_df.mism.to_numpy(),
+            'mism': pair_df.mism.to_numpy(),
+            'gaps': pair_df.gaps.to_numpy()})
+
+        return alignement_df
+
+    @staticmethod
+    def is_pair(query_sequence, target_sequence, mism, gaps):
+        """Verifies that the sequences are identical (mism=0, gaps=0), or differ by one mismatch (mism=1) or by one
+        gap (gaps=1)"""
+
+        if mism == 0 and gaps == 0:
+            return query_sequence == target_sequence
+        elif mism == 1:
+            if query_sequence == target_sequence:
+                return False
+            mismatch_count = 0
+            for query_nt, target_nt in zip(query_sequence, target_sequence):
+                mismatch_count += query_nt != target_nt
+                if mismatch_count > 1:
+                    return False
+            return mismatch_count == 1
+        # One gap: the shorter sequence is one of the deletions of the longer one
+        short_sequence, long_sequence = sorted([query_sequence, target_sequence], key=len)
+        if len(long_sequence) != len(short_sequence) + 1:
+            return False
+        position = 0
+        while position < len(short_sequence) and short_sequence[position] == long_sequence[position]:
+            position += 1
+        return short_sequence[position:] == long_sequence[position + 1:]
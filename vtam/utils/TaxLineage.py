@@ -1,15 +1,20 @@
+import numpy
 import pandas
 
+from vtam.utils.Taxonomy import Taxonomy
 from vtam.utils.constants import rank_hierarchy_asv_table
 
 
 class TaxLineage(object):
     """This class construct a TaxLineage for a given tax_id and based on the taxonomic_tsv file"""
 
-    def __init__(self, taxonomic_tsv_path):
-        self.taxonomy_df = pandas.read_csv(
-            taxonomic_tsv_path, sep="\t", header=0, dtype={
-                'tax_id': 'int', 'parent_tax_id': 'int', 'old_tax_id': 'float'})
+    def __init__(self, taxonomic_tsv_path, lineage_cache=False):
+        """
+        :param taxonomic_tsv_path: path to the taxonomy.tsv file
+        :param lineage_cache: loads or writes the lineages of all the tax_ids next to the tsv file
+        """
+        # Memory-mapped if the binary taxonomy and the lineage cache are up to date
+        self.taxonomy = Taxonomy(tsv=taxonomic_tsv_path, lineage_cache=lineage_cache)
 
     def create_lineage_from_one_tax_id(self, tax_id, tax_name=False):
         """
@@ -38,20 +43,17 @@ class TaxLineage(object):
         tax_lineage_dic = {}
         tax_lineage_dic['tax_id'] = tax_id
         while tax_id != 1:
-            # try to use taxonomy_df.tax_id
-            tax_id_row = self.taxonomy_df.loc[self.taxonomy_df.tax_id == tax_id, ]
-            # if row empty, try to use old_tax_id
-            if tax_id_row.shape[0] == 0:
-                tax_id_row = self.taxonomy_df.loc[self.taxonomy_df.old_tax_id == tax_id, ]
-                # if row still empty, return None
-                if tax_id_row.shape[0] == 0:
-                    return None
-
-            rank = tax_id_row['rank'].values[0]
-            parent_tax_id = tax_id_row['parent_tax_id'].values[0]
+            # tax_id or old_tax_id index in the taxonomy arrays
+            tax_id_idx = self.taxonomy.get_tax_id_idx([tax_id])[0]
+            # if not found, return None
+            if tax_id_idx == -1:
+                return None
+
+            rank = self.taxonomy.rank_lst[self.taxonomy.rank_code_arr[tax_id_idx]]
+            parent_tax_id = int(self.taxonomy.parent_tax_id_arr[tax_id_idx])
             tax_lineage_dic[rank] = tax_id
             if tax_name:  # return tax_name instead of tax_id
-                tax_name = tax_id_row['name_txt'].values[0]
+                tax_name = self.taxonomy.get_name_lst([tax_id_idx])[0]
                 tax_lineage_dic[rank] = tax_name
             tax_id = parent_tax_id
 
@@ -72,31 +74,36 @@ class TaxLineage(object):
                              'superkingdom': 2759}
 
         """
-        taxa_lineage_list = []
-
+        # Try to convert to int or skip otherwise
+        tax_id_int_list = []
         for tax_id in tax_id_list:
-
-            # if not math.isnan(tax_id):
-            # tax_lineage = TaxLineage(taxonomic_tsv_path=taxonomy_tsv_path)
-            tax_lineage_dic = self.create_lineage_from_one_tax_id(
-                tax_id=tax_id, tax_name=tax_name)
-            # tax_lineage_dic = create_lineage_from_one_tax_id(tax_id, taxonomy_df, tax_name=True)
-            if not (tax_lineage_dic is None):
-                taxa_lineage_list.append(tax_lineage_dic)
-
-        tax_lineage_df = pandas.DataFrame(data=taxa_lineage_list)
-        # lineage_list_df_columns_sorted = list(
-        #     filter(lambda x: x in lineage_df.columns.tolist(), rank_hierarchy_asv_table))
-        # lineage_list_df_columns_sorted = lineage_list_df_columns_sorted + ['tax_id']
-        # lineage_df = lineage_df[lineage_list_df_columns_sorted]
-
-        lineage_list_df_columns_sorted = list(
-            filter(
-                lambda x: x in tax_lineage_df.columns.tolist(),
-                rank_hierarchy_asv_table))
-        lineage_list_df_columns_sorted = lineage_list_df_columns_sorted + \
-            ['tax_id']
-        tax_lineage_df = tax_lineage_df[lineage_list_df_columns_sorted]
+            try:
+                tax_id_int_list.append(int(tax_id))
+            except (ValueError, TypeError):
+                continue
+        tax_id_arr = numpy.array(tax_id_int_list, dtype='int64')
+
+        # Lineages are computed together and the ones that do not reach the root are skipped
+        lineage_arr, is_complete_arr = self.taxonomy.get_tax_id_lineage_arr(tax_id_arr)
+        lineage_arr = lineage_arr[is_complete_arr]
+
+        tax_lineage_df = pandas.DataFrame()
+        for rank in rank_hierarchy_asv_table:
+            if not (rank in self.taxonomy.rank_lst):
+                continue
+            rank_arr = lineage_arr[:, self.taxonomy.rank_lst.index(rank)]
+            if (rank_arr == 0).all():
+                continue
+            if tax_name:  # return tax_name instead of tax_id
+                tax_id_idx_arr = self.taxonomy.get_tax_id_idx(rank_arr[rank_arr != 0])
+                rank_name_arr = numpy.full(rank_arr.shape[0], numpy.nan, dtype=object)
+                rank_name_arr[rank_arr != 0] = self.taxonomy.get_name_lst(tax_id_idx_arr)
+                tax_lineage_df[rank] = rank_name_arr
+            elif (rank_arr == 0).any():
+                tax_lineage_df[rank] = numpy.where(rank_arr == 0, numpy.nan, rank_arr)
+            else:
+                tax_lineage_df[rank] = rank_arr
+        tax_lineage_df['tax_id'] = tax_id_arr[is_complete_arr]
         # do not move. required because sometimes tax_id is none
         tax_lineage_df = tax_lineage_df.astype({'tax_id': 'object'})
 
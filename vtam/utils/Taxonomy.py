@@ -1,26 +1,241 @@
+import numpy
+import os
 import pandas
+import pathlib
+import shutil
 from vtam.utils.VTAMexception import VTAMexception
 
 from vtam.utils.Logger import Logger
 
 
 class Taxonomy(object):
-    """A class for the taxonomy file"""
+    """A class for the taxonomy file
 
-    def __init__(self, tsv=None, df=None):
-        """Taxonomy gets initialize either from a TSV path or a DataFrame"""
+    Besides the DataFrames, the taxonomy is kept as integer arrays sorted by tax_id: the index of the parent of each
+    node and the code of its rank. The lineages of many tax_ids are computed together by following the parent
+    indices of all of them at each step."""
 
-        self.df = df
-        if not (tsv is None):
-            self.df = pandas.read_csv(tsv, sep="\t", header=0, dtype={'tax_id': 'int', 'parent_tax_id': 'int', 'old_tax_id': 'float'}).drop_duplicates()
+    # Index of the parent of nodes whose parent is the root, or missing in the taxonomy
+    parent_root = -1
+    parent_missing = -2
+    # Number of tax_ids whose lineages are computed together when writing the lineage cache
+    lineage_cache_chunk_size = 100000
 
-        self.old_tax_df = self.df[['tax_id', 'old_tax_id']].drop_duplicates()
-        self.old_tax_df = self.old_tax_df.loc[~self.old_tax_df.old_tax_id.isna()]
-        self.old_tax_df.old_tax_id = self.old_tax_df.old_tax_id.astype('int')
-        self.old_tax_df.set_index('old_tax_id', drop=True, inplace=True, verify_integrity=False)
+    def __init__(self, tsv=None, df=None, lineage_cache=False):
+        """Taxonomy gets initialize either from a TSV path or a DataFrame
 
-        self.df = self.df.drop(['old_tax_id'], axis=1, inplace=False).drop_duplicates()
-        self.df.set_index('tax_id', drop=True, inplace=True, verify_integrity=True)
+        :param tsv: path to the taxonomy.tsv file
+        :param df: DataFrame with columns tax_id, parent_tax_id, rank, name_txt, old_tax_id
+        :param lineage_cache: with tsv, loads or writes the lineages of all the tax_ids next to the tsv file
+        """
+
+        self._df = None
+        self._old_tax_df = None
+
+        if not (tsv is None) and self.is_binary_up_to_date(tsv):
+            self.read_binary(self.get_binary_dir(tsv))
+        else:
+            if not (tsv is None):
+                df = pandas.read_csv(tsv, sep="\t", header=0, dtype={'tax_id': 'int', 'parent_tax_id': 'int', 'old_tax_id': 'float'}).drop_duplicates()
+            self.set_df(df)
+
+        self.lineage_arr = None
+        self.lineage_complete_arr = None
+        if lineage_cache and not (tsv is None):
+            self.lineage_arr, self.lineage_complete_arr = self.get_lineage_cache_arr(
+                *self.get_lineage_cache_npy(tsv), tsv)
+
+    def set_df(self, df):
+        """Sets the DataFrames and the integer arrays from a DataFrame with columns tax_id, parent_tax_id, rank,
+        name_txt, old_tax_id"""
+
+        self._old_tax_df = df[['tax_id', 'old_tax_id']].drop_duplicates()
+        self._old_tax_df = self._old_tax_df.loc[~self._old_tax_df.old_tax_id.isna()]
+        self._old_tax_df.old_tax_id = self._old_tax_df.old_tax_id.astype('int')
+        self._old_tax_df.set_index('old_tax_id', drop=True, inplace=True, verify_integrity=False)
+
+        self._df = df.drop(['old_tax_id'], axis=1, inplace=False).drop_duplicates()
+        self._df.set_index('tax_id', drop=True, inplace=True, verify_integrity=True)
+
+        #######################################################################
+        #
+        # Integer arrays sorted by tax_id
+        #
+        #######################################################################
+
+        sort_df = self._df.sort_index()
+        self.tax_id_arr = sort_df.index.to_numpy(dtype='int64')
+        rank_code_arr, rank_index = pandas.factorize(sort_df['rank'])
+        self.rank_code_arr = rank_code_arr.astype('int64')
+        self.rank_lst = rank_index.tolist()
+        self.name_arr = sort_df.name_txt.to_numpy()
+        self.name_offset_arr = None
+        self.name_blob_arr = None
+
+        old_tax_df = self._old_tax_df.loc[~self._old_tax_df.index.duplicated(keep='first')].sort_index()
+        self.old_tax_id_arr = old_tax_df.index.to_numpy(dtype='int64')
+        self.old_tax_id_idx_arr = self.get_tax_id_idx(old_tax_df.tax_id.to_numpy(dtype='int64'), old=False)
+
+        self.parent_tax_id_arr = sort_df.parent_tax_id.to_numpy(dtype='int64')
+        self.parent_idx_arr = self.get_tax_id_idx(self.parent_tax_id_arr)
+        self.parent_idx_arr[self.parent_idx_arr == -1] = self.parent_missing
+        self.parent_idx_arr[self.parent_tax_id_arr == 1] = self.parent_root
+        self.parent_idx_arr[self.tax_id_arr == 1] = self.parent_root
+
+    @property
+    def df(self):
+        """DataFrame with columns parent_tax_id, rank, name_txt and tax_id as index
+
+        With the binary taxonomy, it is only created when used."""
+
+        if self._df is None:
+            self._df = pandas.DataFrame({
+                'parent_tax_id': numpy.asarray(self.parent_tax_id_arr),
+                'rank': numpy.array(self.rank_lst, dtype=object)[self.rank_code_arr],
+                'name_txt': self.get_name_lst(numpy.arange(self.tax_id_arr.shape[0]))},
+                index=pandas.Index(numpy.asarray(self.tax_id_arr), name='tax_id'))
+        return self._df
+
+    @property
+    def old_tax_df(self):
+        """DataFrame with column tax_id and old_tax_id as index"""
+
+        if self._old_tax_df is None:
+            self._old_tax_df = pandas.DataFrame(
+                {'tax_id': self.tax_id_arr[self.old_tax_id_idx_arr]},
+                index=pandas.Index(numpy.asarray(self.old_tax_id_arr), name='old_tax_id'))
+        return self._old_tax_df
+
+    def get_name_lst(self, idx_arr):
+        """Returns the list of the names of the nodes with these indices in self.tax_id_arr"""
+
+        if self.name_blob_arr is None:
+            return self.name_arr[idx_arr].tolist()
+        return [self.name_blob_arr[self.name_offset_arr[idx]:self.name_offset_arr[idx + 1]].tobytes().decode('utf-8')
+                for idx in numpy.asarray(idx_arr).tolist()]
+
+    def get_name_df(self, tax_id_lst):
+        """Returns a DataFrame with column name_txt and the tax_ids found in the taxonomy as index
+
+        :param tax_id_lst: list of tax_ids, including old tax_ids
+        :return: DataFrame
+        """
+
+        tax_id_arr = numpy.unique(numpy.array(tax_id_lst, dtype='int64'))
+        idx_arr = self.get_tax_id_idx(tax_id_arr)
+        return pandas.DataFrame({'name_txt': self.get_name_lst(idx_arr[idx_arr >= 0])},
+                                index=pandas.Index(tax_id_arr[idx_arr >= 0], name='tax_id'))
+
+    #######################################################################
+    #
+    # Binary taxonomy: one directory next to the TSV file with NumPy arrays sorted by tax_id.
+    # The names are a blob of UTF-8 bytes with the offsets of each name.
+    #
+    #######################################################################
+
+    binary_array_lst = ['tax_id', 'parent_tax_id', 'parent_idx', 'rank_code', 'old_tax_id', 'old_tax_id_idx',
+                        'name_offset', 'name_blob']
+
+    @staticmethod
+    def get_binary_dir(tsv):
+
+        return os.path.splitext(tsv)[0] + '_npy'
+
+    @classmethod
+    def is_binary_up_to_date(cls, tsv):
+        """True if all the files of the binary taxonomy exist and are newer than the TSV file"""
+
+        binary_dir = cls.get_binary_dir(tsv)
+        path_lst = [os.path.join(binary_dir, '{}.npy'.format(array)) for array in cls.binary_array_lst] \
+            + [os.path.join(binary_dir, 'rank.txt')]
+        if not all([os.path.isfile(path) for path in path_lst]):
+            return False
+        return min([os.path.getmtime(path) for path in path_lst]) >= os.path.getmtime(tsv)
+
+    def read_binary(self, binary_dir):
+        """Memory-maps the arrays of the binary taxonomy"""
+
+        Logger.instance().debug("Memory-map binary taxonomy: {}".format(binary_dir))
+        for array in self.binary_array_lst:
+            setattr(self, '{}_arr'.format(array), numpy.load(
+                os.path.join(binary_dir, '{}.npy'.format(array)), mmap_mode='r'))
+        with open(os.path.join(binary_dir, 'rank.txt')) as fin:
+            self.rank_lst = fin.read().splitlines()
+        self.name_arr = None
+
+    def write_binary(self, binary_dir):
+        """Writes the arrays of the binary taxonomy to a temporary directory, which then replaces binary_dir"""
+
+        Logger.instance().debug("Write binary taxonomy: {}".format(binary_dir))
+        name_bytes_lst = [str(name).encode('utf-8') for name in self.get_name_lst(
+            numpy.arange(self.tax_id_arr.shape[0]))]
+        name_offset_arr = numpy.zeros(len(name_bytes_lst) + 1, dtype='int64')
+        name_offset_arr[1:] = numpy.cumsum([len(name_bytes) for name_bytes in name_bytes_lst])
+        array_dic = {
+            'tax_id': self.tax_id_arr, 'parent_tax_id': self.parent_tax_id_arr, 'parent_idx': self.parent_idx_arr,
+            'rank_code': self.rank_code_arr, 'old_tax_id': self.old_tax_id_arr,
+            'old_tax_id_idx': self.old_tax_id_idx_arr, 'name_offset': name_offset_arr,
+            'name_blob': numpy.frombuffer(b''.join(name_bytes_lst), dtype='uint8')}
+
+        binary_dir_tmp = '{}.{}.tmp'.format(binary_dir, os.getpid())
+        pathlib.Path(binary_dir_tmp).mkdir(parents=True, exist_ok=True)
+        for array in self.binary_array_lst:
+            numpy.save(os.path.join(binary_dir_tmp, '{}.npy'.format(array)), numpy.asarray(array_dic[array]))
+        with open(os.path.join(binary_dir_tmp, 'rank.txt'), 'w') as fout:
+            fout.write(''.join(['{}\n'.format(rank) for rank in self.rank_lst]))
+        shutil.rmtree(binary_dir, ignore_errors=True)
+        os.replace(binary_dir_tmp, binary_dir)
+
+    def get_tax_id_idx(self, tax_id_arr, old=True):
+        """Returns the indices of the tax_ids in self.tax_id_arr, or -1 if missing
+
+        :param tax_id_arr: numpy array of tax_ids
+        :param old: if True, tax_ids missing in self.tax_id_arr are looked up in the old tax_ids
+        :return: numpy array of indices
+        """
+
+        tax_id_arr = numpy.asarray(tax_id_arr, dtype='int64')
+        idx_arr = numpy.searchsorted(self.tax_id_arr, tax_id_arr)
+        idx_arr[idx_arr >= self.tax_id_arr.shape[0]] = 0
+        is_found = numpy.zeros(tax_id_arr.shape, dtype=bool)
+        if self.tax_id_arr.shape[0] > 0:
+            is_found = self.tax_id_arr[idx_arr] == tax_id_arr
+        idx_arr[~is_found] = -1
+        if old and self.old_tax_id_arr.shape[0] > 0:
+            old_idx_arr = numpy.searchsorted(self.old_tax_id_arr, tax_id_arr)
+            old_idx_arr[old_idx_arr >= self.old_tax_id_arr.shape[0]] = 0
+            is_old = ~is_found & (self.old_tax_id_arr[old_idx_arr] == tax_id_arr)
+            idx_arr[is_old] = self.old_tax_id_idx_arr[old_idx_arr[is_old]]
+        return idx_arr
+
+    def get_lineage_arr(self, idx_arr):
+        """Returns the lineages of the nodes with these indices as an array with one column per rank in self.rank_lst
+
+        All the nodes go up one level at each step until the root or a missing parent. As in a dictionary, an ancestor
+        overwrites the lower ones with the same rank. Missing ranks are 0.
+
+        :param idx_arr: numpy array of indices in self.tax_id_arr
+        :return: tuple with the numpy array of tax_ids with shape (len(idx_arr), len(self.rank_lst)) and the boolean
+        array of the lineages that reach the root
+        """
+
+        lineage_arr = numpy.zeros((idx_arr.shape[0], len(self.rank_lst)), dtype='int64')
+        is_complete_arr = idx_arr >= 0
+        row_arr = numpy.arange(idx_arr.shape[0])[idx_arr >= 0]
+        current_idx_arr = idx_arr[idx_arr >= 0]
+        for _ in range(self.tax_id_arr.shape[0] + 1):  # The depth is bounded by the number of nodes
+            if row_arr.shape[0] == 0:
+                break
+            lineage_arr[row_arr, self.rank_code_arr[current_idx_arr]] = self.tax_id_arr[current_idx_arr]
+            is_missing = self.parent_idx_arr[current_idx_arr] == self.parent_missing
+            for tax_id in numpy.unique(self.parent_tax_id_arr[current_idx_arr[is_missing]]).tolist():
+                self.warn_missing_tax_id(tax_id)
+            is_complete_arr[row_arr[is_missing]] = False
+            current_idx_arr = self.parent_idx_arr[current_idx_arr]
+            is_active = current_idx_arr >= 0
+            row_arr = row_arr[is_active]
+            current_idx_arr = current_idx_arr[is_active]
+        return lineage_arr, is_complete_arr
 
     def get_one_tax_id_lineage(self, tax_id):
         """
@@ -48,15 +263,13 @@ class Taxonomy(object):
             if tax_id in self.df.index:
                 tax_id_row = self.df.loc[tax_id, ]
             # tax_id is found as old_tax_id column in the taxonomy file
-            elif tax_id in self.old_tax_df.index.tolist():  # Try old tax id
+            elif tax_id in self.old_tax_df.index:  # Try old tax id
                 tax_id_new = self.old_tax_df.loc[tax_id, 'tax_id']
                 tax_id_row = self.df.loc[tax_id_new, ]
             # tax_id is not found in the taxonomy file.
             # Return current lineage dic and exit the function
             else:
-                Logger.instance().warning(
-                    "The taxon ID {} in the Blast database is missing in the taxonomy.tsv. "
-                    "Consider updating this file with the following command: vtam taxonomy --output taxonomy.tsv.".format(tax_id))
+                self.warn_missing_tax_id(tax_id)
                 # raise VTAMexception("tax_id {} from Blast database not found in the taxonomy.tsv file".format(tax_id))
                 return lineage_dic
             rank = tax_id_row['rank']
@@ -86,14 +299,109 @@ tax_id (index)  no rank    species     genus     family     order     class
 
         """
 
-        lineage_list = []
-        for target_tax_id_i, target_tax_id in enumerate(tax_id_list):
-            if target_tax_id_i % 100 == 0:
-                Logger.instance().debug(
-                    "Get lineage of {}-th tax id {} (Total {} tax ids)".format(
-                        target_tax_id_i, target_tax_id, len(tax_id_list)))
-            lineage_list.append({**{'tax_id': target_tax_id},
-                                 **self.get_one_tax_id_lineage(tax_id=target_tax_id)})
-        tax_id_lineage_df = pandas.DataFrame(lineage_list)
-        tax_id_lineage_df.set_index('tax_id', drop=True, inplace=True, verify_integrity=True)
+        tax_id_arr = numpy.array(tax_id_list, dtype='int64')
+        Logger.instance().debug("Get lineages of {} tax ids".format(tax_id_arr.shape[0]))
+        lineage_arr = self.get_tax_id_lineage_arr(tax_id_arr)[0]
+
+        tax_id_lineage_df = pandas.DataFrame(index=pandas.Index(tax_id_arr, name='tax_id'))
+        for rank_code, rank in enumerate(self.rank_lst):
+            rank_arr = lineage_arr[:, rank_code]
+            if (rank_arr == 0).all():
+                continue
+            if (rank_arr == 0).any():
+                tax_id_lineage_df[rank] = numpy.where(rank_arr == 0, numpy.nan, rank_arr)
+            else:
+                tax_id_lineage_df[rank] = rank_arr
+        if not tax_id_lineage_df.index.is_unique:
+            raise ValueError("Index has duplicate keys: {}".format(
+                tax_id_lineage_df.index[tax_id_lineage_df.index.duplicated()].unique().tolist()))
         return tax_id_lineage_df
+
+    def get_tax_id_lineage_arr(self, tax_id_arr):
+        """Returns the lineages of these tax_ids, like get_one_tax_id_lineage, as an array with one column per rank in
+        self.rank_lst
+
+        :param tax_id_arr: numpy array of tax_ids, including old tax_ids
+        :return: tuple with the numpy array of tax_ids with shape (len(tax_id_arr), len(self.rank_lst)) and the
+        boolean array of the lineages found up to the root
+        """
+
+        idx_arr = self.get_tax_id_idx(tax_id_arr)
+        for tax_id in numpy.unique(tax_id_arr[(idx_arr == -1) & (tax_id_arr != 1)]).tolist():
+            self.warn_missing_tax_id(tax_id)
+        idx_arr[tax_id_arr == 1] = -1  # The root has an empty lineage
+
+        if self.lineage_arr is None:
+            lineage_arr, is_complete_arr = self.get_lineage_arr(idx_arr)
+        else:
+            lineage_arr = numpy.zeros((idx_arr.shape[0], len(self.rank_lst)), dtype='int64')
+            is_complete_arr = numpy.zeros(idx_arr.shape[0], dtype=bool)
+            row_arr = numpy.where(idx_arr >= 0)[0]
+            lineage_arr[row_arr] = self.lineage_arr[idx_arr[row_arr]]
+            is_complete_arr[row_arr] = self.lineage_complete_arr[idx_arr[row_arr]]
+            # The lineages stopping at a missing parent are followed again to log the missing tax_ids
+            row_arr = row_arr[~is_complete_arr[row_arr]]
+            if row_arr.shape[0] > 0:
+                lineage_arr[row_arr] = self.get_lineage_arr(idx_arr[row_arr])[0]
+        is_complete_arr[tax_id_arr == 1] = True
+
+        # Like in get_one_tax_id_lineage, an old tax_id is kept at the rank of its node
+        row_arr = numpy.where(idx_arr >= 0)[0]
+        rank_code_arr = self.rank_code_arr[idx_arr[row_arr]]
+        is_old = (lineage_arr[row_arr, rank_code_arr] == self.tax_id_arr[idx_arr[row_arr]]) \
+            & (tax_id_arr[row_arr] != self.tax_id_arr[idx_arr[row_arr]])
+        lineage_arr[row_arr[is_old], rank_code_arr[is_old]] = tax_id_arr[row_arr[is_old]]
+
+        return lineage_arr, is_complete_arr
+
+    @staticmethod
+    def get_lineage_cache_npy(tsv):
+        """Returns the paths of the lineage cache files next to the tsv file"""
+
+        return os.path.splitext(tsv)[0] + '.lineage.npy', os.path.splitext(tsv)[0] + '.lineage_complete.npy'
+
+    def get_lineage_cache_arr(self, lineage_npy, lineage_complete_npy, tsv):
+        """Returns the lineages of all the tax_ids and whether they reach the root, from the lineage_npy and
+        lineage_complete_npy files if they are newer than the tsv file, or computed and written to these files
+
+        The files are memory-mapped, so that only the lineages of the looked up tax_ids are read.
+
+        :param lineage_npy: path to the lineage cache file
+        :param lineage_complete_npy: path to the cache file of the lineages reaching the root
+        :param tsv: path to the taxonomy.tsv file
+        :return: tuple with the numpy array with shape (len(self.tax_id_arr), len(self.rank_lst)) and the boolean
+        array with shape (len(self.tax_id_arr),)
+        """
+
+        shape = (self.tax_id_arr.shape[0], len(self.rank_lst))
+        if all([os.path.isfile(npy) and os.path.getmtime(npy) >= os.path.getmtime(tsv)
+                for npy in [lineage_npy, lineage_complete_npy]]):
+            lineage_arr = numpy.load(lineage_npy, mmap_mode='r')
+            lineage_complete_arr = numpy.load(lineage_complete_npy, mmap_mode='r')
+            if lineage_arr.shape == shape and lineage_complete_arr.shape == shape[:1]:
+                return lineage_arr, lineage_complete_arr
+
+        Logger.instance().debug("Write lineage cache: {}".format(lineage_npy))
+        lineage_arr = numpy.zeros(shape, dtype='int64')
+        lineage_complete_arr = numpy.zeros(shape[0], dtype=bool)
+        for start in range(0, shape[0], self.lineage_cache_chunk_size):  # Bounds the memory of the lineage walk
+            idx_arr = numpy.arange(start, min(start + self.lineage_cache_chunk_size, shape[0]))
+            lineage_arr[idx_arr], lineage_complete_arr[idx_arr] = self.get_lineage_arr(idx_arr)
+        lineage_arr[self.tax_id_arr == 1] = 0  # The root has an empty lineage
+        lineage_complete_arr[self.tax_id_arr == 1] = True
+        try:
+            for npy, arr in [(lineage_npy, lineage_arr), (lineage_complete_npy, lineage_complete_arr)]:
+                npy_tmp = npy + '.{}.tmp'.format(os.getpid())
+                with open(npy_tmp, 'wb') as fout:
+                    numpy.save(fout, arr)
+                os.replace(npy_tmp, npy)  # Atomic for concurrent jobs
+        except OSError:
+            Logger.instance().warning("The lineage cache {} could not be written".format(lineage_npy))
+        return lineage_arr, lineage_complete_arr
+
+    @staticmethod
+    def warn_missing_tax_id(tax_id):
+
+        Logger.instance().warning(
+            "The taxon ID {} in the Blast database is missing in the taxonomy.tsv. "
+            "Consider updating this file with the following command: vtam taxonomy --output taxonomy.tsv.".format(tax_id))
@@ -47,6 +47,9 @@ lfn_variant_replicate_cutoff: 0.001
 lfn_sample_replicate_cutoff: 0.001
 # Occurrence is deleted if N_ijk < lfn_ lfn_read_count_cutoff
 lfn_read_count_cutoff: 10
+# If 1, "vtam optimize" tries each read count and N_ijk/N_i (Or N_ijk/N_ik) ratio of the known occurrences
+# as lfn_read_count_cutoff and lfn_variant_cutoff (Or lfn_variant_replicate_cutoff) instead of a grid of values
+optimize_lfn_exact: 0
 
 ################################################################################
 # Parameters of the "FilterMinReplicateNumber" filter in the "filter" command
@@ -199,6 +202,15 @@ sorted_tar_gz_url3 = "https://osf.io/dhk5g/download"
 
 identity_list = [100, 99, 97, 95, 90, 85, 80, 75, 70]
 
+####################################################################################################
+#
+# Database
+#
+####################################################################################################
+
+# Maximal number of values bound in a single SQL 'IN (...)' clause (SQLite older limit is 999 variables)
+sql_in_chunk_size = 500
+
 ####################################################################################################
 #
 #  FilterLFNreference
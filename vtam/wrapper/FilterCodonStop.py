@@ -22,6 +22,7 @@ class FilterCodonStop(ToolWrapper):
     __input_table_Variant = "Variant"
     # Output table
     __output_table_filter_codon_stop = "FilterCodonStop"
+    __output_table_variant_codon_stop = "VariantCodonStop"
 
     def specify_input_file(self):
         return[
@@ -40,6 +41,7 @@ class FilterCodonStop(ToolWrapper):
     def specify_output_table(self):
         return [
             FilterCodonStop.__output_table_filter_codon_stop,
+            FilterCodonStop.__output_table_variant_codon_stop,
         ]
 
     def specify_params(self):
@@ -72,6 +74,8 @@ class FilterCodonStop(ToolWrapper):
         # Output table models
         output_filter_codon_stop_model = self.output_table(
             FilterCodonStop.__output_table_filter_codon_stop)
+        output_variant_codon_stop_model = self.output_table(
+            FilterCodonStop.__output_table_variant_codon_stop)
 
         #######################################################################
         #
@@ -101,7 +105,9 @@ class FilterCodonStop(ToolWrapper):
             variant_read_count_df=variant_read_count_df).get_variant_read_count_delete_df(
             variant_df=variant_df,
             genetic_code=genetic_code,
-            skip_filter_codon_stop=skip_filter_codon_stop)
+            skip_filter_codon_stop=skip_filter_codon_stop,
+            engine=engine,
+            variant_codon_stop_model=output_variant_codon_stop_model)
 
         #######################################################################
         #
@@ -118,6 +124,8 @@ class FilterCodonStop(ToolWrapper):
             declarative_meta_i = self.output_table(output_table_i)
             obj = session.query(declarative_meta_i).order_by(
                 declarative_meta_i.id.desc()).first()
+            if obj is None:  # VariantCodonStop is empty if the filter is skipped
+                continue
             session.query(declarative_meta_i).filter_by(
                 id=obj.id).update({'id': obj.id})
             session.commit()
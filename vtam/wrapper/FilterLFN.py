@@ -119,7 +119,8 @@ class FilterLFN(ToolWrapper):
         #
         ############################################################################################
 
-        variant_read_count_delete_df = RunnerFilterLFN(variant_read_count_df).get_variant_read_count_delete_df(
+        lfn_filter_runner = RunnerFilterLFN(variant_read_count_df)
+        lfn_filter_runner.mark_delete_lfn_all_filters(
             lfn_variant_cutoff=lfn_variant_cutoff,
             lfn_variant_specific_cutoff=lfn_variant_specific_cutoff_df,
             lfn_variant_replicate_cutoff=lfn_variant_replicate_cutoff,
@@ -127,8 +128,14 @@ class FilterLFN(ToolWrapper):
             lfn_sample_replicate_cutoff=lfn_sample_replicate_cutoff,
             lfn_read_count_cutoff=lfn_read_count_cutoff)
 
-        DataframeVariantReadCountLike(variant_read_count_delete_df).to_sql(
-            engine=engine, variant_read_count_like_model=output_filter_lfn_model)
+        # The output table is written by chunks of rows
+        row_count = 0
+        filter_delete_count = 0
+        for variant_read_count_delete_df in lfn_filter_runner.iter_variant_read_count_filter_delete_df():
+            DataframeVariantReadCountLike(variant_read_count_delete_df).to_sql(
+                engine=engine, variant_read_count_like_model=output_filter_lfn_model)
+            row_count += variant_read_count_delete_df.shape[0]
+            filter_delete_count += variant_read_count_delete_df.filter_delete.sum()
 
         for output_table_i in self.specify_output_table():
             declarative_meta_i = self.output_table(output_table_i)
@@ -138,8 +145,7 @@ class FilterLFN(ToolWrapper):
                 id=obj.id).update({'id': obj.id})
             session.commit()
 
-        if variant_read_count_delete_df.filter_delete.sum(
-        ) == variant_read_count_delete_df.shape[0]:
+        if filter_delete_count == row_count:
             Logger.instance().warning(
                 VTAMexception(
                     "This filter has deleted all the variants: {}. "
@@ -3,13 +3,9 @@ from vtam import Logger
 from vtam.utils.RunnerFilterPCRerror import RunnerFilterPCRerror
 from vtam.utils.FileSampleInformation import FileSampleInformation
 from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
-from vtam.utils.ModelVariantReadCountLike import ModelVariantReadCountLike
-from vtam.utils.PathManager import PathManager
 from vtam.utils.VTAMexception import VTAMexception
 
-import os
 import pandas
-import pathlib
 import sys
 
 
@@ -57,11 +53,6 @@ class FilterPCRerror(ToolWrapper):
         session = self.session
         engine = session._session().get_bind()
 
-        this_temp_dir = os.path.join(
-            PathManager.instance().get_tempdir(),
-            os.path.basename(__file__))
-        pathlib.Path(this_temp_dir).mkdir(exist_ok=True)
-
         ############################################################################################
         #
         # Wrapper inputs, outputs and parameters
@@ -102,57 +93,36 @@ class FilterPCRerror(ToolWrapper):
 
         ############################################################################################
         #
-        # Run per sample_id
+        # Run per run_id, marker_id
+        # The one-edit pairs are found once over the union of the variants of the run-marker
+        # and projected onto each sample with the N_ij of both variants
         #
         ############################################################################################
 
         variant_df = sample_info_tsv_obj.get_variant_df(
             variant_read_count_like_model=input_filter_min_replicate_model, engine=engine)
 
-        record_list = []
-
-        run_marker_sample_df = variant_read_count_df[[
-            'run_id', 'marker_id', 'sample_id']].drop_duplicates()
-        for row in run_marker_sample_df.itertuples():
-            run_id = row.run_id
-            marker_id = row.marker_id
-            sample_id = row.sample_id
-
-            # Get variant read for the current run-marker-sample
-            variant_read_count_per_sample_df = variant_read_count_df.loc[(variant_read_count_df.run_id == run_id) & (
-                variant_read_count_df.marker_id == marker_id) & (variant_read_count_df.sample_id == sample_id)]
+        variant_read_count_delete_df_lst = []
 
-            variant_per_sample_df = variant_df.loc[variant_df.index.isin(variant_read_count_per_sample_df.variant_id.unique().tolist())]
-            this_step_tmp_per_sample_dir = os.path.join(
-                this_temp_dir, "run_{}_marker_{}_sample{}".format(
-                    run_id, marker_id, sample_id))
-            pathlib.Path(this_step_tmp_per_sample_dir).mkdir(exist_ok=True)
+        for (run_id, marker_id), variant_read_count_per_run_marker_df in variant_read_count_df.groupby(
+                ['run_id', 'marker_id'], sort=False):
 
-            ########################################################################################
-            #
-            # Run vsearch and get alignement variant_read_count_input_df
-            #
-            ########################################################################################
+            variant_per_run_marker_df = variant_df.loc[variant_df.index.isin(
+                variant_read_count_per_run_marker_df.variant_id.unique().tolist())]
 
             filter_pcr_error_runner = RunnerFilterPCRerror(
-                variant_expected_df=variant_per_sample_df,
-                variant_unexpected_df=variant_per_sample_df,
-                variant_read_count_df=variant_read_count_per_sample_df)
-            filter_output_per_sample_df = filter_pcr_error_runner.get_variant_read_count_delete_df(
-                pcr_error_var_prop)
-
-            ########################################################################################
-            #
-            # Per sample add to record list
-            #
-            ########################################################################################
-
-            record_per_sample_list = ModelVariantReadCountLike.filter_delete_df_to_dict(
-                filter_output_per_sample_df)
-            record_list = record_list + record_per_sample_list
-
-        variant_read_count_delete_df = pandas.DataFrame.from_records(
-            data=record_list)
+                variant_expected_df=variant_per_run_marker_df,
+                variant_unexpected_df=variant_per_run_marker_df,
+                variant_read_count_df=variant_read_count_per_run_marker_df)
+            variant_read_count_delete_df_lst.append(
+                filter_pcr_error_runner.get_variant_read_count_delete_df(pcr_error_var_prop))
+
+        variant_read_count_delete_df = pandas.concat(variant_read_count_delete_df_lst, axis=0)
+
+        # Rows ordered sample by sample
+        sample_order_sr = variant_read_count_df.groupby(['run_id', 'marker_id', 'sample_id'], sort=False).ngroup()
+        variant_read_count_delete_df = variant_read_count_delete_df.loc[
+            sample_order_sr.sort_values(kind='mergesort').index].reset_index(drop=True)
 
         ############################################################################################
         #
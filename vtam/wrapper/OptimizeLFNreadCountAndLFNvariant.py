@@ -1,3 +1,6 @@
+import multiprocessing
+import os
+
 import numpy
 from vtam.utils.RunnerOptimizeLFNreadCountAndVariantRunMarker import \
     RunnerOptimizeLFNreadCountAndVariantRunMarker
@@ -63,6 +66,7 @@ class OptimizeLFNreadCountAndLFNvariant(ToolWrapper):
             "lfn_sample_replicate_cutoff": "required|float",
             "lfn_read_count_cutoff": "required|float",
             "min_replicate_number": "required|int",
+            "optimize_lfn_exact": "int",
         }
 
     def run(self):
@@ -115,6 +119,7 @@ class OptimizeLFNreadCountAndLFNvariant(ToolWrapper):
         min_replicate_number = self.option("min_replicate_number")
         lfn_njk_cutoff = self.option("lfn_sample_replicate_cutoff")
         lfn_nijk_cutoff = int(self.option("lfn_read_count_cutoff"))
+        optimize_lfn_exact = bool(self.option("optimize_lfn_exact"))
 
         filter_kwargs = {"lfn_ni_cutoff": lfn_ni_cutoff,
                          "lfn_nik_cutoff": lfn_nik_cutoff,
@@ -157,11 +162,17 @@ class OptimizeLFNreadCountAndLFNvariant(ToolWrapper):
         #
         ############################################################################################
 
+        if os.getenv('VTAM_THREADS') is None:
+            num_threads = multiprocessing.cpu_count()
+        else:
+            num_threads = int(os.getenv('VTAM_THREADS'))
+
         optim_lfn_readcount_variant_runner = RunnerOptimizeLFNreadCountAndVariant(
-            nijk_df=nijk_df, known_occurrences_df=known_occurrences_df)
+            nijk_df=nijk_df, known_occurrences_df=known_occurrences_df, num_threads=num_threads)
         out_optimize_df, out_optimize2_df = optim_lfn_readcount_variant_runner.get_optimize_df(
             lfn_ni_cutoff=lfn_ni_cutoff, lfn_nik_cutoff=lfn_nik_cutoff, lfn_njk_cutoff=lfn_njk_cutoff,
-            lfn_nijk_cutoff=lfn_nijk_cutoff, min_replicate_number=min_replicate_number)
+            lfn_nijk_cutoff=lfn_nijk_cutoff, min_replicate_number=min_replicate_number,
+            optimize_lfn_exact=optimize_lfn_exact)
 
         ############################################################################################
         #
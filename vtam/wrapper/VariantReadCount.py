@@ -1,22 +1,17 @@
-from Bio import SeqIO
-from sqlalchemy import select, bindparam, func
+from sqlalchemy import bindparam
 from vtam.utils.Logger import Logger
 from vtam.utils.FileSampleInformation import FileSampleInformation
+from vtam.utils.NameIdConverter import NameIdConverter
 from vtam.utils.VTAMexception import VTAMexception
 from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
+from vtam.utils.RunnerVariantReadCount import RunnerVariantReadCount
 from wopmars.models.ToolWrapper import ToolWrapper
 import inspect
+import multiprocessing
 import os
 import pandas
-import sqlalchemy
 import sys
 
-# Compatible with both pre- and post Biopython 1.78:
-try:
-    from Bio.Alphabet import generic_dna
-except ImportError:
-    generic_dna = None
-
 
 class VariantReadCount(ToolWrapper):
 
@@ -118,34 +113,14 @@ class VariantReadCount(ToolWrapper):
             "file: {}; line: {}; Read sample information".format(
                 __file__, inspect.currentframe().f_lineno))
         sortedinfo_df = pandas.read_csv(input_file_sortedinfo, sep="\t", header=0)
-        sample_instance_list = []
         sortedinfo_df.columns = sortedinfo_df.columns.str.lower()
 
-        for row in sortedinfo_df.itertuples():
-            Logger.instance().debug(row)
-            marker_name = row.marker
-            run_name = row.run
-            sample_name = row.sample
-            replicate = row.replicate
-            with engine.connect() as conn:
-                # get run_id ###########
-                stmt_select_run_id = select([run_model.__table__.c.id]).where(
-                    run_model.__table__.c.name == run_name)
-                run_id = conn.execute(stmt_select_run_id).first()[0]
-                # get marker_id ###########
-                stmt_select_marker_id = select([marker_model.__table__.c.id]).where(
-                    marker_model.__table__.c.name == marker_name)
-                marker_id = conn.execute(stmt_select_marker_id).first()[0]
-                # get sample_id ###########
-                stmt_select_sample_id = select([sample_model.__table__.c.id]).where(
-                    sample_model.__table__.c.name == sample_name)
-                sample_id = conn.execute(
-                    stmt_select_sample_id).first()[0]
-                # add this sample_instance ###########
-                sample_instance_list.append({'run_id': run_id,
-                                             'marker_id': marker_id,
-                                             'sample_id': sample_id,
-                                             'replicate': replicate})
+        sample_instance_df = pandas.DataFrame({
+            'run_id': NameIdConverter(sortedinfo_df.run.tolist(), engine=engine).to_ids(run_model),
+            'marker_id': NameIdConverter(sortedinfo_df.marker.tolist(), engine=engine).to_ids(marker_model),
+            'sample_id': NameIdConverter(sortedinfo_df['sample'].tolist(), engine=engine).to_ids(sample_model),
+            'replicate': sortedinfo_df.replicate.astype(int).tolist()})
+        sample_instance_list = sample_instance_df.to_dict('records')
 
         #######################################################################
         #
@@ -185,64 +160,14 @@ class VariantReadCount(ToolWrapper):
             "file: {}; line: {}; Read demultiplexed FASTA files".format(
                 __file__, inspect.currentframe().f_lineno))
 
-        variant_read_count_df = pandas.DataFrame()
-
-        for row in sample_info_ids_df.itertuples():
-            run_id = row.run_id
-            marker_id = row.marker_id
-            sample_id = row.sample_id
-            replicate = row.replicate
-            read_fasta = row.sortedfasta
-
-            Logger.instance().debug(
-                "file: {}; line: {}; Read FASTA: {}".format(
-                    __file__, inspect.currentframe().f_lineno, read_fasta))
-
-            read_fasta_path = os.path.join(read_dir, read_fasta)
-
-            if os.path.exists(read_fasta_path):
-
-                ####################################################################################
-                #
-                # Read FASTA
-                #
-                ####################################################################################
-
-                if generic_dna:  # Biopython <1.78
-                    sorted_read_list = [str(seq_record.seq).upper() for
-                                        seq_record in
-                                        SeqIO.parse(read_fasta_path,
-                                                    format="fasta",
-                                                    alphabet=generic_dna)]
-                else:  # Biopython =>1.78
-                    sorted_read_list = [str(seq_record.seq).upper() for
-                                        seq_record in
-                                        SeqIO.parse(read_fasta_path,
-                                                    format="fasta",
-                                                    alphabet=generic_dna)]
-
-                variant_read_count_df_sorted_i = pandas.DataFrame(
-                    {
-                        'run_id': [run_id] *
-                        len(sorted_read_list),
-                        'marker_id': [marker_id] *
-                        len(sorted_read_list),
-                        'sample_id': [sample_id] *
-                        len(sorted_read_list),
-                        'replicate': [replicate] *
-                        len(sorted_read_list),
-                        'read_sequence': sorted_read_list,
-                        'read_count': [1] *
-                        len(sorted_read_list)})
-                #  Compute read count
-                variant_read_count_df_sorted_i = variant_read_count_df_sorted_i.groupby(
-                    ['run_id', 'marker_id', 'sample_id', 'replicate', 'read_sequence']).sum().reset_index()
-
-                variant_read_count_df = variant_read_count_df.append(
-                    variant_read_count_df_sorted_i)
-
-            else:
-                Logger.instance().warning('This file {} doest not exists'.format(read_fasta_path))
+        if os.getenv('VTAM_THREADS') is None:
+            num_threads = multiprocessing.cpu_count()
+        else:
+            num_threads = int(os.getenv('VTAM_THREADS'))
+
+        variant_read_count_df = RunnerVariantReadCount(
+            sample_info_ids_df=sample_info_ids_df, read_dir=read_dir,
+            num_threads=num_threads).get_variant_read_count_df()
 
         #######################################################################
         #
@@ -288,43 +213,13 @@ class VariantReadCount(ToolWrapper):
 
         Logger.instance().debug("file: {}; line: {}; Insert variants".format(
                 __file__, inspect.currentframe().f_lineno))
-        variant_read_count_instance_list = []
         variant_read_count_df.sort_values(
             by=['variant_sequence', 'run_id', 'marker_id', 'sample_id', 'replicate'], inplace=True)
-        variant_new_set = set()
-        variant_new_instance_list = []
-        with engine.connect() as conn:
-            # Retrieve maximal variant id if possible
-            select_variant_id_max = conn.execute(sqlalchemy.select(
-                [func.max(variant_model.__table__.c.id)])).first()[0]
-            if select_variant_id_max is None:
-                select_variant_id_max = 0  # If no variants, then maximal variant id is 0
-            for row in variant_read_count_df.itertuples():
-                run_id = row.run_id
-                marker_id = row.marker_id
-                sample_id = row.sample_id
-                replicate = row.replicate
-                variant_sequence = row.variant_sequence
-                read_count = row.read_count
-                select_row = conn.execute(sqlalchemy.select([variant_model.__table__.c.id]) .where(
-                    variant_model.__table__.c.sequence == variant_sequence)).first()
-                if select_row is None:  # variant_sequence IS NOT in the database, so will INSERT it
-                    if not (variant_sequence in variant_new_set):
-                        variant_id = select_variant_id_max + \
-                            len(variant_new_instance_list) + 1
-                        variant_new_set.add(variant_sequence)
-                        variant_new_instance_list.append(
-                            {'id': variant_id, 'sequence': variant_sequence})
-                else:  # variant_sequence IS in the database
-                    variant_id = select_row[0]
-                variant_read_count_instance_list.append(
-                    {
-                        'run_id': run_id,
-                        'marker_id': marker_id,
-                        'variant_id': variant_id,
-                        'sample_id': sample_id,
-                        'replicate': replicate,
-                        'read_count': read_count})
+        variant_read_count_df, variant_new_df = RunnerVariantReadCount.get_variant_id_df(
+            variant_read_count_df=variant_read_count_df, variant_model=variant_model, engine=engine)
+        variant_new_instance_list = variant_new_df.to_dict('records')
+        variant_read_count_instance_list = variant_read_count_df[
+            ['run_id', 'marker_id', 'variant_id', 'sample_id', 'replicate', 'read_count']].to_dict('records')
 
         #######################################################################
         #